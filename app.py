@@ -1,17 +1,112 @@
-from flask import Flask, request, jsonify, render_template, session
+from flask import Flask, request, jsonify, render_template, session, Response, stream_with_context, g, url_for
 import uuid
 import os
-from insurance_recommender import insurance_recommender, ALL_CATEGORIES, SUGGESTED_ANSWERS
+import logging
+import json
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from insurance_recommender import ALL_CATEGORIES, profile_llm, update_slots
 from prompts import profile_template
-from langchain_ollama import OllamaLLM
-from vector_search_neo4j import document_retrieval, get_datasets
+from retrieval import document_retrieval, policy_catalog
+from llm_cache import llm_cache
+from session_store import session_store
+from job_queue import DONE, FAILED, FINISHED, job_key, recommendation_jobs
+from metrics import REQUEST_SECONDS, registry, route_label
 from config import settings
 
+logging.basicConfig(level=settings.LOG_LEVEL, format="%(levelname)s - %(name)s - %(message)s")
+logger = logging.getLogger(__name__)
+
 app = Flask(__name__)
-app.secret_key = os.urandom(24)
+app.secret_key = settings.SECRET_KEY or os.urandom(24)
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def observe_request(response):
+    # Streamed responses are observed when their headers are sent, not when the stream ends
+    if "request_start" in g:
+        REQUEST_SECONDS.observe(time.perf_counter() - g.request_start,
+                                method=request.method, route=route_label(request), status=response.status_code)
+    return response
+
+@app.route('/metrics')
+def metrics():
+    """Latency, row and token histograms in the Prometheus text format"""
+    if not settings.METRICS_ENABLED:
+        return jsonify({"error": "Metrics are disabled"}), 404
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
+# Shared pool for the independent LLM / retrieval branches of a single request
+pipeline_executor = ThreadPoolExecutor(max_workers=settings.PIPELINE_WORKERS, thread_name_prefix="pipeline")
+
+# Seconds a client is told to wait after a 429, and between keep-alives of a quiet job event stream
+RETRY_AFTER_SECONDS = 10
+SSE_KEEPALIVE_SECONDS = 15
+
+# Per-conversation state carried from one /update_requirements turn to the next
+PROGRESS_KEYS = ("retrieval_candidates", "retrieved_info", "retrieval_retries", "asked_categories")
+
+def save_retrieval_progress(thread_id, state):
+    """Remember the incremental retrieval candidates and asked categories of a conversation for its next turn"""
+    progress = {key: state[key] for key in PROGRESS_KEYS if key in state}
+    if progress:
+        session_store.update(thread_id, progress)
+
+def company_info_for(data, key, conversation):
+    """Answers posted under key by an older page, otherwise the ones kept in the session store"""
+    posted = data.get(key)
+    return posted if posted is not None else conversation.get("company_info", [])
+
+def generate_profile_summary(collected_info):
+    """Run the profile template and strip the model's thinking"""
+    profile = llm_cache.invoke(profile_template, profile_llm, {"collected_info": "\n".join(collected_info)})
+    return re.sub(r'<think>.*?</think>', '', profile, flags=re.DOTALL).strip()
 
-# Initialize the LLM
-llm = OllamaLLM(model=settings.LLM_MODEL)
+FALLBACK_RECOMMENDATION = """
+            <h2>Insurance Recommendation</h2>
+            
+            <p>Based on the information provided about your company, we recommend considering the following insurance policies:</p>
+            
+            <h3>POLICY RECOMMENDATIONS</h3>
+            <ul>
+                <li><strong>General Liability Insurance</strong> - Essential coverage for all businesses</li>
+                <li><strong>Professional Liability Insurance</strong> - Protects against claims of errors or negligence</li>
+                <li><strong>Cyber Liability Insurance</strong> - Coverage for data breaches and cyber attacks</li>
+                <li><strong>Commercial Property Insurance</strong> - Protects your physical assets</li>
+                <li><strong>Business Interruption Insurance</strong> - Covers lost income during disruptions</li>
+            </ul>
+            
+            <h3>WHY THESE POLICIES</h3>
+            <p>These policies provide a foundation of protection for most businesses. For more tailored recommendations, please provide additional details about your specific industry, size, and risk concerns.</p>
+            
+            <h3>COST CONSIDERATIONS</h3>
+            <p>Insurance costs vary widely based on your business specifics. We recommend consulting with a licensed insurance broker who can provide detailed quotes based on your exact needs.</p>
+            """
+
+ERROR_RECOMMENDATION = """
+            <h2>Insurance Recommendation</h2>
+            
+            <p>We encountered an issue while generating your personalized recommendation, but we can still provide some general guidance.</p>
+            
+            <h3>GENERAL RECOMMENDATIONS</h3>
+            <ul>
+                <li><strong>General Liability Insurance</strong> - Essential coverage for all businesses</li>
+                <li><strong>Professional Liability Insurance</strong> - Protects against claims of errors or negligence</li>
+                <li><strong>Cyber Liability Insurance</strong> - Coverage for data breaches and cyber attacks</li>
+            </ul>
+            
+            <p>For more tailored recommendations, please try again or consult with a licensed insurance broker.</p>
+            """
+
+def detect_categories(state):
+    """Extract the category slots of the turn into the state; returns the detected categories"""
+    # Runs once per turn, before the branches start, so refine_question reuses the slots
+    update_slots(state)
+    return list(state["slots"])
 
 @app.route('/')
 def index():
@@ -27,13 +122,18 @@ def update_requirements():
     """Process user input and update requirements"""
     data = request.json
     user_input = data.get('input', '')
-    current_info = data.get('current_info', [])
     
     if not user_input:
         return jsonify({"error": "No input provided"})
     
+    # The answers so far are kept server-side, keyed by the session's thread_id
+    thread_id = session.setdefault('thread_id', str(uuid.uuid4()))
+    conversation = session_store.load(thread_id)
+    current_info = company_info_for(data, 'current_info', conversation)
+    
     # Add the new input to the current info
     updated_info = current_info + [user_input]
+    session_store.update(thread_id, {"company_info": updated_info})
     
     # Create a state object to use with LangGraph
     state = {
@@ -42,76 +142,125 @@ def update_requirements():
         "question_attempts": len(updated_info)
     }
     
+    # Resume incremental retrieval from the previous turn of this conversation
+    state.update({key: conversation[key] for key in PROGRESS_KEYS if key in conversation})
+    
     # We can't directly access the node functions in the compiled workflow
     # Let's use the refine_question function directly instead
     from insurance_recommender import refine_question
-    state = refine_question(state)
     
-    # Check if we have a next question or if we're complete
-    if state.get("next_step") == "COMPLETE":
-        next_question = "Great! You've provided all the necessary information. You can now generate a recommendation."
-        completed = True
-    else:
-        next_question = state.get("next_question", "Please provide more information about your company.")
-        completed = False
-    
-    # Generate a profile summary using the profile template
-    profile_chain = profile_template | llm
-    profile = profile_chain.invoke({"collected_info": "\n".join(updated_info)})
-    
-    # Remove any thinking tags
-    import re
-    profile = re.sub(r'<think>.*?</think>', '', profile, flags=re.DOTALL).strip()
-    
-    # Determine which categories have been detected in the input
-    # This is a simplified version - the actual function would be more sophisticated
-    all_detected = []
-    for category in ALL_CATEGORIES:
-        category_lower = category.lower()
-        input_text = " ".join(updated_info).lower()
-        
-        # Check if category keywords are in the input
-        for keyword in category.lower().split('/'):
-            if keyword.strip() in input_text:
-                all_detected.append(category)
-                break
-        
-        # Check if any suggested answers for this category are in the input
-        if category not in all_detected:
-            for answer in SUGGESTED_ANSWERS[category]:
-                if answer.lower() in input_text:
-                    all_detected.append(category)
-                    break
+    # Slot extraction is cheap, so it runs before the branches and they share the result
+    all_detected = detect_categories(state)
+    
+    # The question (retrieval + LLM) and the profile (LLM) do not depend on each other, so run them together
+    question_future = pipeline_executor.submit(refine_question, state)
+    profile_future = pipeline_executor.submit(generate_profile_summary, updated_info)
+    
+    # Saved from the callback so a late question branch still feeds the next turn
+    def on_question_done(future):
+        if future.exception() is None:
+            save_retrieval_progress(thread_id, future.result())
+    question_future.add_done_callback(on_question_done)
     
     # Get remaining missing categories
     missing_categories = [cat for cat in ALL_CATEGORIES if cat not in all_detected]
     
+    # Wait for both branches up to the deadline; a branch that misses it is reported as timed out
+    wait([question_future, profile_future], timeout=settings.UPDATE_REQUIREMENTS_DEADLINE)
+    timed_out = []
+    
+    next_question = "Please provide more information about your company."
+    completed = False
+    if question_future.done() and question_future.exception() is None:
+        state = question_future.result()
+        # Check if we have a next question or if we're complete
+        if state.get("next_step") == "COMPLETE":
+            next_question = "Great! You've provided all the necessary information. You can now generate a recommendation."
+            completed = True
+        else:
+            next_question = state.get("next_question", next_question)
+    else:
+        if not question_future.done():
+            timed_out.append("next_question")
+        else:
+            logger.error("Error refining question: %s", question_future.exception())
+    
+    profile = ""
+    if profile_future.done() and profile_future.exception() is None:
+        profile = profile_future.result()
+    else:
+        if not profile_future.done():
+            timed_out.append("profile")
+        else:
+            logger.error("Error generating profile: %s", profile_future.exception())
+    
+    if timed_out:
+        logger.debug("update_requirements returning partial results, timed out: %s", timed_out)
+    
     return jsonify({
         "updated_info": updated_info,
         "all_detected_categories": all_detected,
+        "slots": state.get("slots", {}),
         "next_question": next_question,
         "profile": profile,
         "missing_categories": missing_categories,
-        "completed": completed
+        "completed": completed,
+        "partial": bool(timed_out),
+        "timed_out": timed_out
     })
 
-@app.route('/generate_recommendation', methods=['POST'])
-def generate_recommendation():
-    """Generate insurance recommendations based on company information"""
-    print("\nDEBUG - Starting generate_recommendation endpoint")
+def run_recommendation(company_info):
+    """Run profile generation, retrieval and the recommendation LLM call; the body of a recommendation job"""
+    # Start with initial state
+    state = {
+        "company_info": company_info,
+        "collected_categories": [],
+        "question_attempts": 5,  # Set to max attempts to skip questioning
+        "next_step": "COMPLETE"  # Skip to profile generation
+    }
     
-    data = request.json
-    company_info = data.get('company_info', [])
-    thread_id = session.get('thread_id', str(uuid.uuid4()))
+    from insurance_recommender import generate_company_profile, retrieve_relevant_policies, generate_recommendation
     
-    print(f"DEBUG - Company info received: {company_info}")
-    print(f"DEBUG - Thread ID: {thread_id}")
+    # Generate company profile
+    logger.debug("Calling generate_company_profile")
+    profile_state = generate_company_profile(state)
+    logger.debug("Company profile generated: %s...", profile_state.get('company_profile', '')[:100])
     
-    if not company_info:
-        print("DEBUG - No company information provided")
-        return jsonify({"error": "No company information provided."})
+    # Retrieve relevant policies
+    logger.debug("Calling retrieve_relevant_policies")
+    retrieval_state = retrieve_relevant_policies(profile_state)
     
-    # Start with initial state
+    # Check if we got any policy information
+    policy_context = retrieval_state.get("policy_context", "")
+    if policy_context and not policy_context.startswith("No specific policy information"):
+        logger.debug("Retrieved policy context length: %s", len(policy_context))
+        logger.debug("Policy context sample: %s...", policy_context[:200])
+    else:
+        logger.debug("No specific policy information retrieved")
+    
+    # Generate recommendation
+    logger.debug("Calling generate_recommendation")
+    final_state = generate_recommendation(retrieval_state)
+    
+    # Check if we have a recommendation
+    recommendation = final_state.get("recommendation", "")
+    if recommendation:
+        logger.debug("Generated recommendation length: %s", len(recommendation))
+        logger.debug("Recommendation sample: %s...", recommendation[:200])
+    else:
+        logger.debug("No recommendation generated")
+        # Create a fallback recommendation
+        final_state["recommendation"] = FALLBACK_RECOMMENDATION
+    
+    return {
+        "recommendation": final_state.get("recommendation", "No recommendation available."),
+        "company_profile": final_state.get("company_profile", ""),
+        "chunk_count": len(final_state.get("retrieved_chunks", [])),
+        "context_report": final_state.get("context_report", {})
+    }
+
+def stream_recommendation_job(company_info):
+    """The body of a streamed recommendation job: publishes a meta event, then every generated token"""
     state = {
         "company_info": company_info,
         "collected_categories": [],
@@ -119,91 +268,149 @@ def generate_recommendation():
         "next_step": "COMPLETE"  # Skip to profile generation
     }
     
-    try:
-        print("DEBUG - Importing functions from insurance_recommender")
-        # Import the functions directly
-        from insurance_recommender import generate_company_profile, retrieve_relevant_policies, generate_recommendation
-        
-        # Generate company profile
-        print("DEBUG - Calling generate_company_profile")
-        profile_state = generate_company_profile(state)
-        print(f"DEBUG - Company profile generated: {profile_state.get('company_profile', '')[:100]}...")
-        
-        # Retrieve relevant policies
-        print("DEBUG - Calling retrieve_relevant_policies")
-        retrieval_state = retrieve_relevant_policies(profile_state)
-        
-        # Check if we got any policy information
-        policy_context = retrieval_state.get("policy_context", "")
-        if policy_context and not policy_context.startswith("No specific policy information"):
-            print(f"DEBUG - Retrieved policy context length: {len(policy_context)}")
-            print(f"DEBUG - Policy context sample: {policy_context[:200]}...")
-        else:
-            print("DEBUG - No specific policy information retrieved")
-        
-        # Generate recommendation
-        print("DEBUG - Calling generate_recommendation")
-        final_state = generate_recommendation(retrieval_state)
-        
-        # Check if we have a recommendation
-        recommendation = final_state.get("recommendation", "")
-        if recommendation:
-            print(f"DEBUG - Generated recommendation length: {len(recommendation)}")
-            print(f"DEBUG - Recommendation sample: {recommendation[:200]}...")
-        else:
-            print("DEBUG - No recommendation generated")
-            # Create a fallback recommendation
-            final_state["recommendation"] = """
-            <h2>Insurance Recommendation</h2>
-            
-            <p>Based on the information provided about your company, we recommend considering the following insurance policies:</p>
-            
-            <h3>POLICY RECOMMENDATIONS</h3>
-            <ul>
-                <li><strong>General Liability Insurance</strong> - Essential coverage for all businesses</li>
-                <li><strong>Professional Liability Insurance</strong> - Protects against claims of errors or negligence</li>
-                <li><strong>Cyber Liability Insurance</strong> - Coverage for data breaches and cyber attacks</li>
-                <li><strong>Commercial Property Insurance</strong> - Protects your physical assets</li>
-                <li><strong>Business Interruption Insurance</strong> - Covers lost income during disruptions</li>
-            </ul>
-            
-            <h3>WHY THESE POLICIES</h3>
-            <p>These policies provide a foundation of protection for most businesses. For more tailored recommendations, please provide additional details about your specific industry, size, and risk concerns.</p>
-            
-            <h3>COST CONSIDERATIONS</h3>
-            <p>Insurance costs vary widely based on your business specifics. We recommend consulting with a licensed insurance broker who can provide detailed quotes based on your exact needs.</p>
-            """
-        
-        # Return the recommendation
-        print("DEBUG - Returning recommendation response")
-        return jsonify({
-            "recommendation": final_state.get("recommendation", "No recommendation available."),
-            "company_profile": final_state.get("company_profile", ""),
-            "chunk_count": len(final_state.get("retrieved_chunks", []))
-        })
-    except Exception as e:
-        print(f"ERROR generating recommendation: {e}")
-        import traceback
-        print(f"DEBUG - Exception traceback: {traceback.format_exc()}")
-        
-        # Return a more useful error response
-        return jsonify({
-            "error": str(e),
-            "recommendation": """
-            <h2>Insurance Recommendation</h2>
-            
-            <p>We encountered an issue while generating your personalized recommendation, but we can still provide some general guidance.</p>
-            
-            <h3>GENERAL RECOMMENDATIONS</h3>
-            <ul>
-                <li><strong>General Liability Insurance</strong> - Essential coverage for all businesses</li>
-                <li><strong>Professional Liability Insurance</strong> - Protects against claims of errors or negligence</li>
-                <li><strong>Cyber Liability Insurance</strong> - Coverage for data breaches and cyber attacks</li>
-            </ul>
-            
-            <p>For more tailored recommendations, please try again or consult with a licensed insurance broker.</p>
-            """
-        })
+    from insurance_recommender import generate_company_profile, retrieve_relevant_policies, stream_recommendation
+    
+    profile_state = generate_company_profile(state)
+    retrieval_state = retrieve_relevant_policies(profile_state)
+    
+    # Sent before the first token so the page can leave the loading state
+    chunk_count = len(retrieval_state.get("retrieved_chunks", []))
+    recommendation_jobs.publish("meta", {
+        "company_profile": retrieval_state.get("company_profile", ""),
+        "chunk_count": chunk_count
+    })
+    
+    tokens = []
+    for token in stream_recommendation(retrieval_state):
+        tokens.append(token)
+        recommendation_jobs.publish("token", {"token": token})
+    
+    return {
+        "recommendation": "".join(tokens) or FALLBACK_RECOMMENDATION,
+        "company_profile": retrieval_state.get("company_profile", ""),
+        "chunk_count": chunk_count,
+        "context_report": retrieval_state.get("context_report", {})
+    }
+
+def queue_full_response():
+    """429 answer of a recommendation route while the job queue is full"""
+    logger.warning("Recommendation queue is full, rejecting request")
+    response = jsonify({"error": "Too many recommendations are being generated, please try again shortly."})
+    response.headers["Retry-After"] = str(RETRY_AFTER_SECONDS)
+    return response, 429
+
+def job_view(job):
+    """Status of a recommendation job, with the result once done and the error recommendation if it failed"""
+    view = recommendation_jobs.snapshot(job)
+    if view["status"] == FAILED:
+        view["recommendation"] = ERROR_RECOMMENDATION
+    return view
+
+@app.route('/generate_recommendation', methods=['POST'])
+def generate_recommendation():
+    """Queue a recommendation for the company information; poll /jobs/<job_id> for the result"""
+    logger.debug("Starting generate_recommendation endpoint")
+    
+    data = request.json
+    thread_id = session.get('thread_id', str(uuid.uuid4()))
+    company_info = company_info_for(data, 'company_info', session_store.load(thread_id))
+    
+    logger.debug("Company info received: %s answers", len(company_info))
+    logger.debug("Thread ID: %s", thread_id)
+    
+    if not company_info:
+        logger.debug("No company information provided")
+        return jsonify({"error": "No company information provided."})
+    
+    # Identical answers give the same recommendation, so an in-flight job for them is shared
+    job, deduplicated = recommendation_jobs.submit(job_key(company_info), run_recommendation, company_info)
+    if job is None:
+        return queue_full_response()
+    
+    view = job_view(job)
+    view["deduplicated"] = deduplicated
+    view["status_url"] = url_for('job_status', job_id=job.id)
+    view["events_url"] = url_for('job_events', job_id=job.id)
+    return jsonify(view), 202
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Poll a recommendation job; ?wait=<seconds> holds the request until the job finishes or the wait ends"""
+    job = recommendation_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown or expired job"}), 404
+    
+    wait = min(request.args.get('wait', 0, type=float), settings.JOB_POLL_MAX_WAIT)
+    if wait > 0:
+        recommendation_jobs.wait(job, timeout=wait)
+    return jsonify(job_view(job))
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """Subscribe to a recommendation job as Server-Sent Events: status changes and published events, then done or error"""
+    job = recommendation_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown or expired job"}), 404
+    return job_event_stream(job)
+
+def poll_job(job, seen, seen_status, timeout):
+    """
+    Wait up to timeout seconds for a recommendation job to publish or change status.
+    
+    Args:
+        seen: Number of published events already relayed
+        seen_status: The status last relayed
+    
+    Returns:
+        tuple: (Server-Sent Events messages, empty when nothing changed; events relayed; status relayed)
+    """
+    # Nothing relayed yet: report the current status right away
+    published, status = recommendation_jobs.wait_events(job, seen, seen_status, timeout if seen_status else 0)
+    messages = [sse_event(data, event=event) for event, data in published]
+    if status in FINISHED:
+        messages.append(sse_event(job_view(job), event="done" if status == DONE else "error"))
+    elif status != seen_status:
+        messages.append(sse_event(dict(job_view(job), status=status), event="status"))
+    return messages, seen + len(published), status
+
+def job_event_stream(job):
+    """Relay a recommendation job as a Server-Sent Events response until it finishes"""
+    def events():
+        seen, status = 0, None
+        while status not in FINISHED:
+            messages, seen, status = poll_job(job, seen, status, SSE_KEEPALIVE_SECONDS)
+            # Comment line, keeps proxies from closing a quiet connection
+            yield from messages or [": keep-alive\n\n"]
+    
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def sse_event(data, event=None):
+    """Format a Server-Sent Events message with a JSON payload"""
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data)}\n\n"
+
+@app.route('/generate_recommendation_stream', methods=['POST'])
+def generate_recommendation_stream():
+    """Stream the insurance recommendation as Server-Sent Events while the LLM generates it
+    
+    The generation runs as a recommendation job like POST /generate_recommendation, so it is
+    subject to the same queue limit (429 when full) and identical answers in flight share one
+    job; this response relays the job's events.
+    """
+    data = request.json
+    company_info = company_info_for(data, 'company_info', session_store.load(session.get('thread_id', '')))
+    
+    if not company_info:
+        return jsonify({"error": "No company information provided."})
+    
+    job, _ = recommendation_jobs.submit(job_key("stream", company_info), stream_recommendation_job, company_info)
+    if job is None:
+        return queue_full_response()
+    return job_event_stream(job)
 
 @app.route('/search', methods=['POST'])
 def direct_search():
@@ -214,9 +421,8 @@ def direct_search():
     if not query:
         return jsonify({"error": "Query is required"}), 400
     
-    # Get all available datasets
-    datasets = get_datasets()
-    dataset_ids = [d['id'] for d in datasets] if datasets else []
+    # Get all available datasets from the in-memory catalog
+    dataset_ids = policy_catalog.dataset_ids()
     
     if not dataset_ids:
         return jsonify({"error": "No datasets available for search"}), 404
@@ -0,0 +1,269 @@
+from quart import Quart, request, jsonify, render_template, session, Response, g, url_for
+import asyncio
+import uuid
+import os
+import logging
+import time
+from insurance_recommender import ALL_CATEGORIES
+from insurance_recommender_async import refine_question_async, generate_company_profile_async
+from retrieval import document_retrieval_async, policy_catalog
+from app import (
+    PROGRESS_KEYS, RETRY_AFTER_SECONDS, SSE_KEEPALIVE_SECONDS, company_info_for, detect_categories, job_view,
+    poll_job, run_recommendation, save_retrieval_progress, stream_recommendation_job
+)
+from session_store import session_store
+from job_queue import FINISHED, job_key, recommendation_jobs
+from metrics import REQUEST_SECONDS, registry, route_label
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# ASGI variant of app.py with the same routes. Run it with an ASGI server, e.g.
+#   hypercorn app_async:app --bind 0.0.0.0:5000
+# Every request awaits its LLM / Neo4j / RAGFlow I/O instead of holding a worker thread,
+# so one process can keep hundreds of conversations in flight.
+app = Quart(__name__)
+app.secret_key = settings.SECRET_KEY or os.urandom(24)
+
+# Recommendations run as jobs on the same bounded worker pool as in app.py, with the same
+# 429 and deduplication; their progress is looked at this often (seconds) instead of
+# holding a thread per waiting request
+JOB_POLL_INTERVAL = 0.1
+
+@app.before_serving
+async def warm_up():
+    """Load the policy catalog off the event loop before the first request needs it"""
+    await policy_catalog.dataset_ids_async()
+
+@app.before_request
+async def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+async def observe_request(response):
+    if "request_start" in g:
+        REQUEST_SECONDS.observe(time.perf_counter() - g.request_start,
+                                method=request.method, route=route_label(request), status=response.status_code)
+    return response
+
+@app.after_serving
+async def shut_down():
+    if settings.RETRIEVAL_BACKEND == "ragflow":
+        from vector_search import close_async_client
+        await close_async_client()
+    elif settings.RETRIEVAL_BACKEND not in ("local", "hybrid"):
+        from vector_search_neo4j import Neo4jConnection
+        await Neo4jConnection().close_async()
+
+@app.route('/metrics')
+async def metrics():
+    """Latency, row and token histograms in the Prometheus text format"""
+    if not settings.METRICS_ENABLED:
+        return jsonify({"error": "Metrics are disabled"}), 404
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route('/')
+async def index():
+    """Render the main application page"""
+    # Initialize a new session
+    session['thread_id'] = str(uuid.uuid4())
+    session['company_info'] = []
+    session['collected_categories'] = []
+    return await render_template('index.html')
+
+@app.route('/update_requirements', methods=['POST'])
+async def update_requirements():
+    """Process user input and update requirements"""
+    data = await request.get_json()
+    user_input = data.get('input', '')
+
+    if not user_input:
+        return jsonify({"error": "No input provided"})
+
+    # The answers so far are kept server-side, keyed by the session's thread_id
+    thread_id = session.setdefault('thread_id', str(uuid.uuid4()))
+    conversation = await asyncio.to_thread(session_store.load, thread_id)
+    current_info = company_info_for(data, 'current_info', conversation)
+
+    # Add the new input to the current info
+    updated_info = current_info + [user_input]
+    await asyncio.to_thread(session_store.update, thread_id, {"company_info": updated_info})
+
+    state = {
+        "company_info": updated_info,
+        "collected_categories": [],
+        "question_attempts": len(updated_info)
+    }
+
+    # Resume incremental retrieval from the previous turn of this conversation
+    state.update({key: conversation[key] for key in PROGRESS_KEYS if key in conversation})
+
+    # Slot extraction is cheap, so it runs before the branches and they share the result
+    all_detected = detect_categories(state)
+
+    # The question and profile branches are independent and run concurrently
+    question_task = asyncio.ensure_future(refine_question_async(state))
+    profile_task = asyncio.ensure_future(generate_company_profile_async({"company_info": updated_info}))
+
+    def on_question_done(task):
+        if not task.cancelled() and task.exception() is None:
+            asyncio.ensure_future(asyncio.to_thread(save_retrieval_progress, thread_id, task.result()))
+    question_task.add_done_callback(on_question_done)
+
+    missing_categories = [cat for cat in ALL_CATEGORIES if cat not in all_detected]
+
+    # Wait for both branches up to the deadline; a branch that misses it is reported as timed out
+    await asyncio.wait([question_task, profile_task], timeout=settings.UPDATE_REQUIREMENTS_DEADLINE)
+    timed_out = []
+
+    next_question = "Please provide more information about your company."
+    completed = False
+    if question_task.done() and question_task.exception() is None:
+        state = question_task.result()
+        if state.get("next_step") == "COMPLETE":
+            next_question = "Great! You've provided all the necessary information. You can now generate a recommendation."
+            completed = True
+        else:
+            next_question = state.get("next_question", next_question)
+    elif not question_task.done():
+        timed_out.append("next_question")
+    else:
+        logger.error("Error refining question: %s", question_task.exception())
+
+    profile = ""
+    if profile_task.done() and profile_task.exception() is None:
+        profile = profile_task.result().get("company_profile", "")
+    elif not profile_task.done():
+        timed_out.append("profile")
+    else:
+        logger.error("Error generating profile: %s", profile_task.exception())
+
+    return jsonify({
+        "updated_info": updated_info,
+        "all_detected_categories": all_detected,
+        "slots": state.get("slots", {}),
+        "next_question": next_question,
+        "profile": profile,
+        "missing_categories": missing_categories,
+        "completed": completed,
+        "partial": bool(timed_out),
+        "timed_out": timed_out
+    })
+
+def queue_full_response():
+    """429 answer of a recommendation route while the job queue is full"""
+    logger.warning("Recommendation queue is full, rejecting request")
+    response = jsonify({"error": "Too many recommendations are being generated, please try again shortly."})
+    response.headers["Retry-After"] = str(RETRY_AFTER_SECONDS)
+    return response, 429
+
+async def recommendation_info():
+    """Company information of the request, or None when there is none"""
+    data = await request.get_json()
+    conversation = await asyncio.to_thread(session_store.load, session.get('thread_id', ''))
+    return company_info_for(data, 'company_info', conversation) or None
+
+@app.route('/generate_recommendation', methods=['POST'])
+async def generate_recommendation():
+    """Queue a recommendation for the company information; poll /jobs/<job_id> for the result"""
+    company_info = await recommendation_info()
+    if not company_info:
+        return jsonify({"error": "No company information provided."})
+
+    # Identical answers give the same recommendation, so an in-flight job for them is shared
+    job, deduplicated = await asyncio.to_thread(
+        recommendation_jobs.submit, job_key(company_info), run_recommendation, company_info
+    )
+    if job is None:
+        return queue_full_response()
+
+    view = await asyncio.to_thread(job_view, job)
+    view["deduplicated"] = deduplicated
+    view["status_url"] = url_for('job_status', job_id=job.id)
+    view["events_url"] = url_for('job_events', job_id=job.id)
+    return jsonify(view), 202
+
+@app.route('/jobs/<job_id>')
+async def job_status(job_id):
+    """Poll a recommendation job; ?wait=<seconds> holds the request until the job finishes or the wait ends"""
+    job = await asyncio.to_thread(recommendation_jobs.get, job_id)
+    if job is None:
+        return jsonify({"error": "Unknown or expired job"}), 404
+
+    deadline = time.monotonic() + min(request.args.get('wait', 0, type=float), settings.JOB_POLL_MAX_WAIT)
+    while time.monotonic() < deadline:
+        if await asyncio.to_thread(recommendation_jobs.wait, job, None, 0) in FINISHED:
+            break
+        await asyncio.sleep(JOB_POLL_INTERVAL)
+    return jsonify(await asyncio.to_thread(job_view, job))
+
+@app.route('/jobs/<job_id>/events')
+async def job_events(job_id):
+    """Subscribe to a recommendation job as Server-Sent Events: status changes and published events, then done or error"""
+    job = await asyncio.to_thread(recommendation_jobs.get, job_id)
+    if job is None:
+        return jsonify({"error": "Unknown or expired job"}), 404
+    return job_event_stream(job)
+
+def job_event_stream(job):
+    """Relay a recommendation job as a Server-Sent Events response until it finishes"""
+    async def events():
+        seen, status = 0, None
+        quiet_since = time.monotonic()
+        while True:
+            messages, seen, status = await asyncio.to_thread(poll_job, job, seen, status, 0)
+            for message in messages:
+                yield message
+            if status in FINISHED:
+                return
+            if messages:
+                quiet_since = time.monotonic()
+            elif time.monotonic() - quiet_since >= SSE_KEEPALIVE_SECONDS:
+                # Comment line, keeps proxies from closing a quiet connection
+                yield ": keep-alive\n\n"
+                quiet_since = time.monotonic()
+            await asyncio.sleep(JOB_POLL_INTERVAL)
+
+    return Response(
+        events(),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.route('/generate_recommendation_stream', methods=['POST'])
+async def generate_recommendation_stream():
+    """Stream the insurance recommendation as Server-Sent Events while the LLM generates it, relayed from its job"""
+    company_info = await recommendation_info()
+    if not company_info:
+        return jsonify({"error": "No company information provided."})
+
+    job, _ = await asyncio.to_thread(
+        recommendation_jobs.submit, job_key("stream", company_info), stream_recommendation_job, company_info
+    )
+    if job is None:
+        return queue_full_response()
+    return job_event_stream(job)
+
+@app.route('/search', methods=['POST'])
+async def direct_search():
+    """Allow direct search of policies"""
+    data = await request.get_json()
+    query = data.get('query', '')
+
+    if not query:
+        return jsonify({"error": "Query is required"}), 400
+
+    dataset_ids = await policy_catalog.dataset_ids_async()
+    if not dataset_ids:
+        return jsonify({"error": "No datasets available for search"}), 404
+
+    chunks = await document_retrieval_async(dataset_ids, query)
+
+    return jsonify({"results": chunks})
+
+if __name__ == '__main__':
+    app.run(
+        host=settings.APP_HOST,
+        port=settings.APP_PORT,
+        debug=settings.APP_DEBUG
+    )
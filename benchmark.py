@@ -0,0 +1,365 @@
+import argparse
+import asyncio
+import copy
+import gc
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from langchain_core.language_models.llms import LLM
+from langchain_core.outputs import GenerationChunk
+from config import settings
+
+# Micro-benchmarks for the graph nodes, document_retrieval / document_retrieval_multi / document_match_stats
+# and the Flask routes.
+#   python benchmark.py --iterations 50 --llm-latency 0.05 --output before.json
+#   python benchmark.py --compare before.json --output after.json
+# OllamaLLM is replaced by StubLLM and Neo4j by InMemoryGraph built from csv/, so runs are
+# deterministic and need neither service.
+
+# A conversation that touches every category, used whole for the recommendation
+SAMPLE_ANSWERS = [
+    "We are a fintech startup in Hong Kong with 120 employees",
+    "Annual revenue is around $20M",
+    "We are worried about cyberattacks and regulatory investigations",
+    "Our insurance budget is $50K a year",
+    "Yes, we hold crypto assets for clients",
+    "90 days for new subsidiaries"
+]
+
+# The turn benchmarks stop before the 5-question limit, where refine_question returns at once;
+# the last of these answers is the one posted per turn
+TURN_ANSWERS = SAMPLE_ANSWERS[:4]
+
+QUESTION_RESPONSE = "CATEGORY: Risk profile/concerns\nQUESTION: What are the main risks your company is concerned about?"
+PROFILE_RESPONSE = (
+    "## Company Profile\n- Industry: Fintech\n- Size: Medium (51-250 employees)\n- Country: Hong Kong\n"
+    "- Revenue: $20M\n- Key risks: cyberattacks, regulatory investigations\n- Budget: $50K"
+)
+RECOMMENDATION_RESPONSE = " ".join(
+    ["## Recommended Policies\nDirectors and Officers liability with regulatory investigation cover,"
+     " cyber liability including incident response, and crime cover extended to digital assets."] * 8
+)
+
+
+class StubLLM(LLM):
+    """Deterministic stand-in for OllamaLLM: a fixed response after latency + token_latency per token"""
+
+    response: str
+    latency: float = 0.0
+    token_latency: float = 0.0
+    model: str = "stub"
+
+    @property
+    def _llm_type(self):
+        return "stub"
+
+    def _tokens(self):
+        return re.findall(r"\S+\s*", self.response)
+
+    def _call(self, prompt, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency + self.token_latency * len(self._tokens()))
+        return self.response
+
+    async def _acall(self, prompt, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency + self.token_latency * len(self._tokens()))
+        return self.response
+
+    def _stream(self, prompt, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        for token in self._tokens():
+            if self.token_latency:
+                time.sleep(self.token_latency)
+            yield GenerationChunk(text=token)
+
+
+class InMemoryGraph:
+    """
+    Stand-in for Neo4jConnection answering the queries of vector_search_neo4j.py from csv/.
+
+    Clause search is scored by the BM25 index of vector_search_local.py, which mirrors the
+    'standard' analyzer of clause_text_idx; latency adds a fixed round trip per query.
+    """
+
+    def __init__(self, csv_dir, latency=0.0):
+        from vector_search_local import ClauseIndex
+        self.index = ClauseIndex().build_from_csv(csv_dir)
+        self.latency = latency
+        self.queries = 0
+
+    def stream_read(self, query, params=None, fetch_size=None, max_retries=3, retry_delay=1):
+        params = params or {}
+        self.queries += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if "clause_text_idx" in query:
+            policy_ids = params.get("policy_ids")
+            policy_ids = None if not policy_ids or policy_ids[0] == "all" else policy_ids
+            if "$queries" in query:
+                # Multi-query search: one ranked list per sub-query, fused by reciprocal rank
+                from rank_fusion import fuse_ranks
+                ranked = self.index.search_many(params["queries"], policy_ids, params.get("threshold", 0.0), params.get("limit", 1024))
+                fused = fuse_ranks([[doc for doc, _ in hits] for hits in ranked], params["rrf_k"], params.get("limit", 1024))
+                for doc, score, matched in fused:
+                    yield self.index.texts[doc], self.index.source(doc), score, self.index.texts[doc], matched
+                return
+            if "collect(score)" in query:
+                # Count-only query: one aggregated row per policy
+                stats = self.index.match_stats(params["query_text"], policy_ids, params.get("threshold", 0.0))
+                for source, policy in stats["policies"].items():
+                    yield source, policy["matches"], policy["max_score"], policy["histogram"]
+                return
+            hits = self.index.search(params["query_text"], policy_ids, params.get("threshold", 0.0), params.get("limit", 1024))
+            for doc, score in hits:
+                yield self.index.texts[doc], self.index.source(doc), score, self.index.texts[doc]
+        elif "MATCH (p:Policy)" in query:
+            name = params.get("name")
+            for policy in self.index.policies:
+                if name is None or name in policy["name"]:
+                    yield policy["id"], policy["name"], policy["insurer"], policy["jurisdiction"]
+        else:
+            raise NotImplementedError(f"InMemoryGraph does not answer: {query.strip()[:80]}")
+
+    def execute_query(self, query, params=None, max_retries=3, retry_delay=1):
+        return list(self.stream_read(query, params))
+
+    async def execute_read_async(self, query, params=None, max_retries=3, retry_delay=1):
+        return list(self.stream_read(query, params))
+
+    def close(self):
+        pass
+
+    async def close_async(self):
+        pass
+
+
+def summarize(timings, retained_blocks, peak_bytes):
+    ms = np.array(timings) * 1000
+    return {
+        "iterations": len(timings),
+        "min_ms": round(float(ms.min()), 3),
+        "mean_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "max_ms": round(float(ms.max()), 3),
+        # Net blocks still allocated after a call, and the peak traced above the pre-call baseline
+        "retained_blocks": int(np.median(retained_blocks)),
+        "peak_kib": round(float(np.median(peak_bytes)) / 1024, 1)
+    }
+
+
+def measure(func, setup=None, iterations=50, warmup=3, alloc_iterations=10):
+    """
+    Time func(*setup()) over iterations calls, then trace allocations over a few more.
+
+    setup runs outside the timed region, so each call can get a fresh copy of its state.
+    The allocation pass is separate because tracemalloc slows every allocation down.
+    """
+    setup = setup or (lambda: ())
+    for _ in range(warmup):
+        func(*setup())
+
+    timings = []
+    for _ in range(iterations):
+        args = setup()
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+
+    retained_blocks, peak_bytes = [], []
+    tracemalloc.start()
+    try:
+        for _ in range(min(alloc_iterations, iterations)):
+            args = setup()
+            gc.collect()
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            blocks = sys.getallocatedblocks()
+            func(*args)
+            peak_bytes.append(tracemalloc.get_traced_memory()[1] - baseline)
+            retained_blocks.append(sys.getallocatedblocks() - blocks)
+    finally:
+        tracemalloc.stop()
+    return summarize(timings, retained_blocks, peak_bytes)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def install_stubs(args):
+    """Point the app at StubLLM and InMemoryGraph; must run before app and retrieval are imported"""
+    # Caches would turn every iteration after the first into a lookup
+    settings.RETRIEVAL_BACKEND = "neo4j"
+    settings.RETRIEVAL_CACHE_SIZE = 0
+    settings.LLM_CACHE_PATH = ""
+    settings.POLICY_CATALOG_REFRESH = 0
+    # DEBUG logging of every call would dominate the cheaper nodes
+    settings.LOG_LEVEL = "DEBUG" if args.verbose else "WARNING"
+    settings.SESSION_DB_PATH = os.path.join(tempfile.mkdtemp(prefix="benchmark-"), "sessions.sqlite3")
+    settings.JOB_DB_PATH = settings.SESSION_DB_PATH
+
+    import vector_search_neo4j
+    from clause_normalizer import ensure_normalized
+    # What graph_loader.py would have loaded into Neo4j
+    graph_dir = ensure_normalized(args.csv_dir) if settings.NORMALIZE_CLAUSES else args.csv_dir
+    graph = InMemoryGraph(graph_dir, args.graph_latency)
+    # Neo4jConnection() returns the existing instance, so every caller gets the fixture
+    vector_search_neo4j.Neo4jConnection._instance = graph
+
+    import insurance_recommender
+    import app as app_module
+    llms = {
+        name: StubLLM(response=response, latency=args.llm_latency, token_latency=args.token_latency)
+        for name, response in (("question_llm", QUESTION_RESPONSE), ("profile_llm", PROFILE_RESPONSE),
+                               ("recommendation_llm", RECOMMENDATION_RESPONSE))
+    }
+    for name, llm in llms.items():
+        setattr(insurance_recommender, name, llm)
+    app_module.profile_llm = llms["profile_llm"]
+    return graph, insurance_recommender, app_module
+
+
+def build_cases(ir, app_module):
+    """(name, func, setup) for every benchmarked node and route"""
+    from retrieval import document_match_stats, document_retrieval, document_retrieval_multi, policy_catalog
+
+    dataset_ids = policy_catalog.dataset_ids()
+    turn_state = {
+        "company_info": list(TURN_ANSWERS),
+        "collected_categories": [],
+        "question_attempts": len(TURN_ANSWERS)
+    }
+    # Later nodes start from the output of the earlier ones, computed once
+    profile_state = ir.generate_company_profile(dict(copy.deepcopy(turn_state), company_info=list(SAMPLE_ANSWERS)))
+    retrieval_state = ir.retrieve_relevant_policies(copy.deepcopy(profile_state))
+    sub_queries = ir.policy_queries(copy.deepcopy(profile_state), SAMPLE_ANSWERS[2])
+
+    def fresh(state):
+        return lambda: (copy.deepcopy(state),)
+
+    client = app_module.app.test_client()
+
+    def new_conversation(payload):
+        def setup():
+            # A new thread per call, so incremental retrieval starts from scratch every time
+            client.get('/')
+            return (payload,)
+        return setup
+
+    def post(path):
+        def call(payload):
+            response = client.post(path, json=payload)
+            response.get_data()
+            assert response.status_code == 200, f"{path} returned {response.status_code}"
+        return call
+
+    def run_job(path):
+        # Queue the job, then long-poll it to completion
+        def call(payload):
+            response = client.post(path, json=payload)
+            assert response.status_code == 202, f"{path} returned {response.status_code}"
+            status = client.get(response.get_json()["status_url"], query_string={"wait": 60}).get_json()
+            assert status["status"] == "done", f"{path} job ended {status['status']}"
+        return call
+
+    turn_payload = {"input": TURN_ANSWERS[-1], "current_info": TURN_ANSWERS[:-1]}
+    recommendation_payload = {"company_info": list(SAMPLE_ANSWERS)}
+    return [
+        ("node:update_slots", ir.update_slots, fresh(turn_state)),
+        ("node:process_user_input", ir.process_user_input,
+         fresh(dict(turn_state, company_info=TURN_ANSWERS[:-1], user_input=TURN_ANSWERS[-1]))),
+        ("node:refine_question", ir.refine_question, fresh(turn_state)),
+        ("node:generate_company_profile", ir.generate_company_profile, fresh(dict(turn_state, company_info=list(SAMPLE_ANSWERS)))),
+        ("node:retrieve_relevant_policies", ir.retrieve_relevant_policies, fresh(profile_state)),
+        ("node:generate_recommendation", ir.generate_recommendation, fresh(retrieval_state)),
+        ("retrieval:document_retrieval", document_retrieval, lambda: (dataset_ids, SAMPLE_ANSWERS[2])),
+        ("retrieval:document_retrieval_multi", document_retrieval_multi, lambda: (dataset_ids, sub_queries)),
+        ("retrieval:document_match_stats", document_match_stats, lambda: (dataset_ids, "\n".join(TURN_ANSWERS))),
+        ("route:POST /update_requirements", post('/update_requirements'), new_conversation(turn_payload)),
+        ("route:POST /generate_recommendation", run_job('/generate_recommendation'), new_conversation(recommendation_payload)),
+        ("route:POST /generate_recommendation_stream", post('/generate_recommendation_stream'),
+         new_conversation(recommendation_payload)),
+        ("route:POST /search", post('/search'), lambda: ({"query": SAMPLE_ANSWERS[2]},))
+    ]
+
+
+def compare(results, baseline_path):
+    """Print p50/p95 of this run next to a previous results file"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)["results"]
+    print(f"\n{'benchmark':<48} {'p50 ms':>10} {'was':>10} {'change':>8} {'p95 ms':>10} {'was':>10} {'change':>8}")
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            print(f"{name:<48} {result['p50_ms']:>10.2f} {'-':>10} {'new':>8} {result['p95_ms']:>10.2f} {'-':>10} {'new':>8}")
+            continue
+        changes = [
+            f"{(result[key] - before[key]) / before[key] * 100:+.1f}%" if before[key] else "-"
+            for key in ("p50_ms", "p95_ms")
+        ]
+        print(f"{name:<48} {result['p50_ms']:>10.2f} {before['p50_ms']:>10.2f} {changes[0]:>8} "
+              f"{result['p95_ms']:>10.2f} {before['p95_ms']:>10.2f} {changes[1]:>8}")
+
+
+def run(args):
+    graph, ir, app_module = install_stubs(args)
+    cases = build_cases(ir, app_module)
+
+    results = {}
+    for name, func, setup in cases:
+        if args.only and not any(pattern in name for pattern in args.only):
+            continue
+        results[name] = measure(func, setup, args.iterations, args.warmup, args.alloc_iterations)
+        r = results[name]
+        print(f"{name:<48} p50 {r['p50_ms']:>9.2f} ms  p95 {r['p95_ms']:>9.2f} ms  p99 {r['p99_ms']:>9.2f} ms  "
+              f"retained {r['retained_blocks']:>6} blocks  peak {r['peak_kib']:>8.1f} KiB")
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "iterations": args.iterations,
+            "llm_latency": args.llm_latency,
+            "token_latency": args.token_latency,
+            "graph_latency": args.graph_latency,
+            "csv_dir": args.csv_dir,
+            "clauses": len(graph.index.clause_ids)
+        },
+        "results": results
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        compare(results, args.compare)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the graph nodes and Flask routes against stubbed LLM and Neo4j backends")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--alloc-iterations", type=int, default=10, help="Calls traced with tracemalloc per benchmark")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Seconds before the stub LLM answers")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="Extra seconds per generated token")
+    parser.add_argument("--graph-latency", type=float, default=0.0, help="Seconds of round trip per graph query")
+    parser.add_argument("--csv-dir", default=settings.GRAPH_CSV_DIR)
+    parser.add_argument("--only", action="append", help="Run only benchmarks whose name contains this (repeatable)")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", help="Earlier results file to compare p50/p95 against")
+    parser.add_argument("--verbose", action="store_true", help="Keep the DEBUG output of the benchmarked code")
+    run(parser.parse_args())
@@ -0,0 +1,366 @@
+import argparse
+import csv
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import time
+from collections import Counter, defaultdict
+import numpy as np
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+CLAUSE_FILE = "nodes_clause.csv"
+CLAUSE_ID_COLUMN = "clauseId:ID(Clause)"
+# The raw export is never rewritten; the normalized copy goes into this subdirectory of it
+NORMALIZED_DIR = "normalized"
+# Written into the normalized copy last: hashes of the raw files and the settings it was made
+# from, so readers can tell whether it is still current
+STAMP_FILE = "normalized.json"
+STAMP_VERSION = 2
+# Id prefix of a canonical clause merged from more than one policy; it belongs to none of them
+SHARED_CLAUSE_PREFIX = "cl_shared_"
+
+LEADER_DOTS = re.compile(r"(?:\s*\.){4,}\s*")
+PAGE_MARKER = re.compile(r"(?:\s*-{3,})+\s*$")
+WHITESPACE = re.compile(r"\s+")
+WORD = re.compile(r"\w+")
+# Table-of-contents entries: a title, leader dots, then a page number or roman numeral
+TOC_ENTRY = re.compile(r"\.{4,}\s*(?:\d+(?:\s*-\s*\d+)?|[ivxlc]+)\b", re.IGNORECASE)
+# Empty form fields of the schedule, e.g. "Policy Number:" or "Effective Date:"
+FORM_FIELD = re.compile(r"^(?:[A-Z][\w/&()’'-]*\s?){1,4}:$")
+
+# MinHash signature: NUM_PERM hashes split into LSH bands of NUM_PERM // LSH_BANDS rows
+NUM_PERM = 128
+LSH_BANDS = 16
+SHINGLE_SIZE = 3
+MERSENNE_PRIME = (1 << 31) - 1
+
+csv.field_size_limit(10 * 1024 * 1024)
+
+
+def normalize_clause_text(text):
+    """Replace leader dots, drop trailing page-break markers and collapse whitespace"""
+    text = LEADER_DOTS.sub(" ", text or "")
+    text = PAGE_MARKER.sub("", text)
+    return WHITESPACE.sub(" ", text).strip()
+
+
+def boilerplate_reason(raw_text, text):
+    """Why a clause carries no policy content ("empty", "toc", "form_field"), or None"""
+    if not WORD.search(text):
+        return "empty"
+    if TOC_ENTRY.search(raw_text or "") or (raw_text or "").count("....") >= 2:
+        return "toc"
+    if FORM_FIELD.match(text):
+        return "form_field"
+    return None
+
+
+def shingles(text):
+    words = WORD.findall(text.lower())
+    if len(words) < SHINGLE_SIZE:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+class MinHasher:
+    """MinHash signatures over word shingles with universal hashing (a * x + b) mod p"""
+
+    def __init__(self, num_perm=NUM_PERM, seed=1):
+        rng = np.random.RandomState(seed)
+        self.a = rng.randint(1, MERSENNE_PRIME, size=num_perm).astype(np.uint64)
+        self.b = rng.randint(0, MERSENNE_PRIME, size=num_perm).astype(np.uint64)
+
+    def signature(self, shingle_set):
+        values = np.fromiter(
+            (int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little") & MERSENNE_PRIME
+             for s in shingle_set),
+            dtype=np.uint64, count=len(shingle_set)
+        )
+        # (a * x + b) stays below 2**63 because a, x and b are all below 2**31
+        hashed = (np.outer(values, self.a) + self.b) % MERSENNE_PRIME
+        return hashed.min(axis=0)
+
+
+def near_duplicate_groups(texts, threshold=None):
+    """
+    Group indexes of identical or near-identical texts; returns {member index: canonical index}.
+
+    Exact duplicates are matched by normalized text. Near duplicates are found with MinHash
+    LSH and confirmed by exact shingle Jaccard >= threshold; the earliest text is canonical.
+    """
+    threshold = settings.CLAUSE_DEDUP_THRESHOLD if threshold is None else threshold
+    parent = list(range(len(texts)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(i, j):
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+            parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    first_by_text = {}
+    for i, text in enumerate(texts):
+        key = text.lower()
+        if key in first_by_text:
+            union(first_by_text[key], i)
+        else:
+            first_by_text[key] = i
+
+    if threshold < 1.0:
+        unique = sorted(first_by_text.values())
+        shingle_sets = {i: shingles(texts[i]) for i in unique}
+        hasher = MinHasher()
+        rows = NUM_PERM // LSH_BANDS
+        buckets = defaultdict(list)
+        for i in unique:
+            signature = hasher.signature(shingle_sets[i])
+            for band in range(LSH_BANDS):
+                buckets[(band, signature[band * rows:(band + 1) * rows].tobytes())].append(i)
+
+        checked = set()
+        for members in buckets.values():
+            for pos, i in enumerate(members):
+                for j in members[pos + 1:]:
+                    if (i, j) in checked or find(i) == find(j):
+                        continue
+                    checked.add((i, j))
+                    a, b = shingle_sets[i], shingle_sets[j]
+                    overlap = len(a & b)
+                    if overlap / (len(a) + len(b) - overlap) >= threshold:
+                        union(i, j)
+
+    return {i: find(i) for i in range(len(texts))}
+
+
+def _read_csv(path):
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        return header, list(reader)
+
+
+def _write_csv(path, header, rows):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+    os.replace(tmp_path, path)
+
+
+def _short_hash(text):
+    return hashlib.md5(text.encode("utf-8")).hexdigest()[:12]
+
+
+def export_files(csv_dir):
+    """The node and relationship files of an export"""
+    return sorted(
+        name for name in os.listdir(csv_dir)
+        if name.endswith(".csv") and (name.startswith("nodes_") or name.startswith("rels_"))
+    )
+
+
+def normalized_dir(csv_dir=None):
+    return os.path.join(csv_dir or settings.GRAPH_CSV_DIR, NORMALIZED_DIR)
+
+
+def _source_stamp(csv_dir, threshold, repeat_limit):
+    files = {}
+    for name in export_files(csv_dir):
+        with open(os.path.join(csv_dir, name), "rb") as f:
+            files[name] = hashlib.sha256(f.read()).hexdigest()
+    return {"version": STAMP_VERSION, "threshold": threshold, "repeat_limit": repeat_limit, "files": files}
+
+
+def _write_stamp(out_dir, stamp):
+    tmp_path = os.path.join(out_dir, f"{STAMP_FILE}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(stamp, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, os.path.join(out_dir, STAMP_FILE))
+
+
+def is_normalized(csv_dir=None, out_dir=None):
+    """Whether out_dir holds the normalized copy of the export as it is now, under the current settings"""
+    csv_dir = csv_dir or settings.GRAPH_CSV_DIR
+    out_dir = out_dir or normalized_dir(csv_dir)
+    try:
+        with open(os.path.join(out_dir, STAMP_FILE), encoding="utf-8") as f:
+            stamp = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return stamp == _source_stamp(csv_dir, settings.CLAUSE_DEDUP_THRESHOLD, settings.CLAUSE_REPEAT_LIMIT)
+
+
+def ensure_normalized(csv_dir=None):
+    """Directory of the normalized copy of the export in csv_dir, written first when missing or stale"""
+    csv_dir = csv_dir or settings.GRAPH_CSV_DIR
+    out_dir = normalized_dir(csv_dir)
+    if not is_normalized(csv_dir, out_dir):
+        logger.info("Normalized copy of %s is missing or stale, writing it to %s", csv_dir, out_dir)
+        normalize_export(csv_dir, out_dir)
+    return out_dir
+
+
+def normalize_export(csv_dir=None, out_dir=None, threshold=None, repeat_limit=None):
+    """
+    Write a copy of a csv/ export with cleaned Clause nodes to out_dir (default: its
+    normalized/ subdirectory), for indexing and loading; the export itself is left as is.
+
+    Clause text is normalized; empty, table-of-contents and form-field clauses are dropped,
+    as are running headers/footers repeated at least repeat_limit times in one policy.
+    Identical and near-identical clauses are collapsed into one canonical Clause whose
+    relationships are the union of the duplicates', so it links back to every source
+    policy and section; one merged across policies gets a policy-neutral cl_shared_ id.
+    Clauses that define, exclude or cover something are never dropped.
+
+    Returns:
+        dict: Counts of what was dropped and merged
+    """
+    csv_dir = csv_dir or settings.GRAPH_CSV_DIR
+    out_dir = out_dir or normalized_dir(csv_dir)
+    threshold = settings.CLAUSE_DEDUP_THRESHOLD if threshold is None else threshold
+    repeat_limit = settings.CLAUSE_REPEAT_LIMIT if repeat_limit is None else repeat_limit
+    start = time.perf_counter()
+    # Stamped from the files as read, so a change while this runs makes the copy stale
+    stamp = _source_stamp(csv_dir, threshold, repeat_limit)
+    os.makedirs(out_dir, exist_ok=True)
+
+    clause_header, clause_rows = _read_csv(os.path.join(csv_dir, CLAUSE_FILE))
+    id_col = clause_header.index(CLAUSE_ID_COLUMN)
+    text_col = clause_header.index("text")
+
+    # Every relationship file with a Clause at either end, and the clauses with semantic links
+    rel_files = {}
+    clause_policies = defaultdict(set)
+    protected = set()
+    for name in export_files(csv_dir):
+        if not name.startswith("rels_"):
+            continue
+        header, rows = _read_csv(os.path.join(csv_dir, name))
+        clause_ends = [pos for pos, column in enumerate(header[:2]) if column.endswith("(Clause)")]
+        if not clause_ends:
+            continue
+        rel_files[name] = (header, rows, clause_ends)
+        for row in rows:
+            if header[0] == ":START_ID(Policy)":
+                clause_policies[row[1]].add(row[0])
+            elif header[0] == ":START_ID(Clause)":
+                protected.add(row[0])
+
+    report = Counter(input_clauses=len(clause_rows))
+    kept_rows = []
+    raw_texts = []
+    for row in clause_rows:
+        raw_text = row[text_col]
+        row[text_col] = normalize_clause_text(raw_text)
+        reason = boilerplate_reason(raw_text, row[text_col])
+        if reason and row[id_col] not in protected:
+            report[f"dropped_{reason}"] += 1
+            continue
+        kept_rows.append(row)
+        raw_texts.append(raw_text)
+
+    if repeat_limit:
+        per_policy = Counter(
+            (policy_id, row[text_col].lower())
+            for row in kept_rows
+            for policy_id in clause_policies.get(row[id_col], ())
+        )
+        repeated = []
+        for row in kept_rows:
+            is_repeated = any(
+                per_policy[(policy_id, row[text_col].lower())] >= repeat_limit
+                for policy_id in clause_policies.get(row[id_col], ())
+            )
+            if is_repeated and row[id_col] not in protected:
+                report["dropped_repeated"] += 1
+            else:
+                repeated.append(row)
+        kept_rows = repeated
+
+    canonical_of = near_duplicate_groups([row[text_col] for row in kept_rows], threshold)
+    group_policies = defaultdict(set)
+    for i, row in enumerate(kept_rows):
+        group_policies[canonical_of[i]].update(clause_policies.get(row[id_col], ()))
+
+    # A clause merged across policies gets an id owned by none of them, so reloading one
+    # policy with graph_loader.py neither skips nor prunes it
+    new_id = {}
+    used_ids = set()
+    for canonical, policies in group_policies.items():
+        row = kept_rows[canonical]
+        if len(policies) < 2:
+            new_id[canonical] = row[id_col]
+            continue
+        key = row[text_col].lower()
+        shared_id = f"{SHARED_CLAUSE_PREFIX}{_short_hash(key)}"
+        counter = 1
+        while shared_id in used_ids:
+            shared_id = f"{SHARED_CLAUSE_PREFIX}{_short_hash(f'{key}#{counter}')}"
+            counter += 1
+        used_ids.add(shared_id)
+        new_id[canonical] = shared_id
+        report["shared_clauses"] += 1
+
+    canonical_id = {}
+    clause_out = []
+    for i, row in enumerate(kept_rows):
+        canonical = canonical_of[i]
+        canonical_id[row[id_col]] = new_id[canonical]
+        if canonical == i:
+            row[id_col] = new_id[canonical]
+            clause_out.append(row)
+        else:
+            report["merged_duplicates"] += 1
+
+    for name, (header, rows, clause_ends) in rel_files.items():
+        seen = set()
+        rel_out = []
+        for row in rows:
+            row = list(row)
+            for pos in clause_ends:
+                row[pos] = canonical_id.get(row[pos])
+            if any(row[pos] is None for pos in clause_ends):
+                continue
+            key = tuple(row)
+            if key not in seen:
+                seen.add(key)
+                rel_out.append(row)
+        report[f"rels_removed:{name}"] = len(rows) - len(rel_out)
+        _write_csv(os.path.join(out_dir, name), header, rel_out)
+
+    _write_csv(os.path.join(out_dir, CLAUSE_FILE), clause_header, clause_out)
+    report["output_clauses"] = len(clause_out)
+    # Files without clauses are copied as they are, so out_dir is a complete export
+    if os.path.abspath(out_dir) != os.path.abspath(csv_dir):
+        for name in export_files(csv_dir):
+            if name != CLAUSE_FILE and name not in rel_files:
+                shutil.copyfile(os.path.join(csv_dir, name), os.path.join(out_dir, name))
+    _write_stamp(out_dir, stamp)
+
+    logger.info("Normalized clauses of %s into %s: %d -> %d in %.1f ms", csv_dir, out_dir,
+                report["input_clauses"], len(clause_out), (time.perf_counter() - start) * 1000)
+    return dict(report)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s - %(name)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Write a copy of a csv/ export with normalized, filtered and deduplicated Clause nodes")
+    parser.add_argument("--csv-dir", default=settings.GRAPH_CSV_DIR)
+    parser.add_argument("--out-dir", help=f"Where to write the copy (default: <csv-dir>/{NORMALIZED_DIR})")
+    parser.add_argument("--threshold", type=float, default=settings.CLAUSE_DEDUP_THRESHOLD,
+                        help="Shingle Jaccard similarity at which clauses are merged (1.0 = exact duplicates only)")
+    parser.add_argument("--repeat-limit", type=int, default=settings.CLAUSE_REPEAT_LIMIT,
+                        help="Drop clauses repeated this many times within one policy (0 disables)")
+    args = parser.parse_args()
+    for key, value in normalize_export(args.csv_dir, args.out_dir, args.threshold, args.repeat_limit).items():
+        print(f"{key}: {value}")
@@ -5,15 +5,117 @@ class Settings(BaseSettings):
     # RAGFlow configuration
     RAGFLOW_API_URL: str = os.environ.get("RAGFLOW_API_URL", "http://localhost:9380")
     RAGFLOW_API_KEY: str = os.environ.get("RAGFLOW_API_KEY", "ragflow-I4NTJhODhlMGFhZDExZjBiNzE2MzI1ZT")
+    # Pooled keep-alive connections (and concurrent requests) per process, and chunks per retrieval page
+    RAGFLOW_MAX_CONNECTIONS: int = int(os.environ.get("RAGFLOW_MAX_CONNECTIONS", "16"))
+    RAGFLOW_PAGE_SIZE: int = int(os.environ.get("RAGFLOW_PAGE_SIZE", "200"))
     
     # App configuration
     APP_HOST: str = os.environ.get("APP_HOST", "0.0.0.0")
     APP_PORT: int = int(os.environ.get("APP_PORT", "5000"))
     APP_DEBUG: bool = os.environ.get("APP_DEBUG", "True").lower() == "true"
+    # Flask/Quart session signing key; set it when running more than one worker so they all accept the cookie
+    SECRET_KEY: str = os.environ.get("SECRET_KEY", "")
+    # Level of the app's log output; DEBUG traces every request, INFO or WARNING for production
+    LOG_LEVEL: str = os.environ.get("LOG_LEVEL", "DEBUG" if APP_DEBUG else "INFO").upper()
+    # Record latency/row/token histograms and serve them on /metrics in the Prometheus text format
+    METRICS_ENABLED: bool = os.environ.get("METRICS_ENABLED", "True").lower() == "true"
+    # Server-side conversation store (session_store.py): SQLite file, idle seconds before a
+    # conversation expires (0 never) and the most conversations kept, least recently used evicted first
+    SESSION_DB_PATH: str = os.environ.get("SESSION_DB_PATH", "sessions.sqlite3")
+    SESSION_TTL: int = int(os.environ.get("SESSION_TTL", "86400"))
+    SESSION_MAX_THREADS: int = int(os.environ.get("SESSION_MAX_THREADS", "10000"))
     
     # LLM configuration
     LLM_MODEL: str = os.environ.get("LLM_MODEL", "deepseek-r1:latest")
     LLM_API_BASE: str = os.environ.get("LLM_API_BASE", "http://localhost:11434")
+    # Per-node models, defaulting to LLM_MODEL: a small model keeps question turns fast while
+    # recommendations use the strong one
+    QUESTION_LLM_MODEL: str = os.environ.get("QUESTION_LLM_MODEL", "") or LLM_MODEL
+    PROFILE_LLM_MODEL: str = os.environ.get("PROFILE_LLM_MODEL", "") or LLM_MODEL
+    RECOMMENDATION_LLM_MODEL: str = os.environ.get("RECOMMENDATION_LLM_MODEL", "") or LLM_MODEL
+    # Per-node thinking for reasoning models: "false" makes the model answer without a <think>
+    # block, "true" keeps it, empty leaves the model default (required for models without thinking)
+    QUESTION_LLM_THINK: str = os.environ.get("QUESTION_LLM_THINK", "")
+    PROFILE_LLM_THINK: str = os.environ.get("PROFILE_LLM_THINK", "")
+    RECOMMENDATION_LLM_THINK: str = os.environ.get("RECOMMENDATION_LLM_THINK", "")
+    # Disk-backed memo of deterministic LLM calls (company profile); an empty path disables it
+    LLM_CACHE_PATH: str = os.environ.get("LLM_CACHE_PATH", "llm_cache.sqlite3")
+    LLM_CACHE_MAX_ENTRIES: int = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", "1000"))
+    
+    # Retrieval configuration
+    # RETRIEVAL_BACKEND is one of "neo4j", "local" (in-process BM25 over csv/),
+    # "hybrid" (local BM25 fused with LSA clause embeddings) or "ragflow"
+    RETRIEVAL_BACKEND: str = os.environ.get("RETRIEVAL_BACKEND", "neo4j")
+    GRAPH_CSV_DIR: str = os.environ.get("GRAPH_CSV_DIR", "csv")
+    # Optional path of a persisted local clause index; empty means rebuild from CSV on start-up
+    CLAUSE_INDEX_PATH: str = os.environ.get("CLAUSE_INDEX_PATH", "")
+    # Directory holding the memory-mapped clause embeddings built by `python vector_index.py`
+    VECTOR_INDEX_DIR: str = os.environ.get("VECTOR_INDEX_DIR", "csv/vector_index")
+    VECTOR_DIM: int = int(os.environ.get("VECTOR_DIM", "128"))
+    # LRU + TTL cache in front of document_retrieval; a size of 0 disables it
+    RETRIEVAL_CACHE_SIZE: int = int(os.environ.get("RETRIEVAL_CACHE_SIZE", "256"))
+    RETRIEVAL_CACHE_TTL: int = int(os.environ.get("RETRIEVAL_CACHE_TTL", "300"))
+    # Seconds between background refreshes of the in-memory policy catalog; 0 disables them
+    POLICY_CATALOG_REFRESH: int = int(os.environ.get("POLICY_CATALOG_REFRESH", "600"))
+    # Seconds between checks of the graph version graph_loader.py stamps on every load; a new version
+    # clears the retrieval caches and the policy catalog (0 disables the check)
+    GRAPH_VERSION_CHECK_INTERVAL: int = int(os.environ.get("GRAPH_VERSION_CHECK_INTERVAL", "10"))
+    # What refine_question retrieves each turn to decide whether to keep asking. TURN_RETRIEVAL is
+    # "count" (the default: only the match count and score histogram per policy, clause texts are
+    # fetched once, for the recommendation), "incremental" (clauses for the newest answers only,
+    # fused with earlier turns) or "full" (clauses for every answer, every turn). The two clause
+    # modes keep the older rule that counts fetched chunks and leave them in state["retrieved_chunks"]
+    TURN_RETRIEVAL: str = os.environ.get("TURN_RETRIEVAL", "count")
+    RRF_K: int = int(os.environ.get("RRF_K", "60"))
+    # retrieve_relevant_policies adds one sub-query per answered category to the profile query and
+    # fuses them by reciprocal rank (RRF_K) in a single retrieval call
+    MULTI_QUERY_RETRIEVAL: bool = os.environ.get("MULTI_QUERY_RETRIEVAL", "True").lower() == "true"
+    # Recommendation context assembly: estimated token budget, per-policy chunk quota (0 = none)
+    # and MMR diversity trade-off (0 = rank by relevance only)
+    CONTEXT_TOKEN_BUDGET: int = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "6000"))
+    CONTEXT_MAX_CHUNKS_PER_POLICY: int = int(os.environ.get("CONTEXT_MAX_CHUNKS_PER_POLICY", "0"))
+    CONTEXT_DIVERSITY: float = float(os.environ.get("CONTEXT_DIVERSITY", "0.3"))
+    # Represent matched policies by their coverage digest (`python policy_digest.py`, stored in
+    # GRAPH_CSV_DIR) instead of raw clauses; policies without a current digest keep their clauses
+    POLICY_DIGESTS: bool = os.environ.get("POLICY_DIGESTS", "True").lower() == "true"
+    
+    # Concurrency configuration
+    # Threads shared by the per-turn question and profile branches of /update_requirements
+    PIPELINE_WORKERS: int = int(os.environ.get("PIPELINE_WORKERS", "8"))
+    # Seconds /update_requirements waits for its branches before returning partial results
+    UPDATE_REQUIREMENTS_DEADLINE: float = float(os.environ.get("UPDATE_REQUIREMENTS_DEADLINE", "60"))
+    # Background recommendation jobs (job_queue.py): worker threads running the pipeline, jobs that
+    # may wait for a worker before the recommendation routes answer 429, and seconds a finished
+    # job's result is kept for polling
+    RECOMMENDATION_WORKERS: int = int(os.environ.get("RECOMMENDATION_WORKERS", "2"))
+    RECOMMENDATION_QUEUE_DEPTH: int = int(os.environ.get("RECOMMENDATION_QUEUE_DEPTH", "32"))
+    RECOMMENDATION_RESULT_TTL: int = int(os.environ.get("RECOMMENDATION_RESULT_TTL", "600"))
+    # Seconds after which an unfinished job is reported failed, e.g. when the process running it died
+    RECOMMENDATION_JOB_TIMEOUT: int = int(os.environ.get("RECOMMENDATION_JOB_TIMEOUT", "900"))
+    # SQLite file holding the job state, shared by every worker process so any of them can answer
+    # /jobs/<id> and the queue limits hold across all of them; defaults to the session store's file
+    JOB_DB_PATH: str = os.environ.get("JOB_DB_PATH", "") or SESSION_DB_PATH
+    # Longest GET /jobs/<id>?wait= long poll, in seconds
+    JOB_POLL_MAX_WAIT: float = float(os.environ.get("JOB_POLL_MAX_WAIT", "30"))
+    # Neo4j driver connection pool and the number of rows pulled per round trip by streamed reads
+    NEO4J_MAX_POOL_SIZE: int = int(os.environ.get("NEO4J_MAX_POOL_SIZE", "50"))
+    NEO4J_ACQUISITION_TIMEOUT: float = float(os.environ.get("NEO4J_ACQUISITION_TIMEOUT", "30"))
+    NEO4J_FETCH_SIZE: int = int(os.environ.get("NEO4J_FETCH_SIZE", "1000"))
+    # graph_loader.py: rows per UNWIND transaction and CSV files loaded in parallel
+    GRAPH_LOAD_BATCH_SIZE: int = int(os.environ.get("GRAPH_LOAD_BATCH_SIZE", "500"))
+    GRAPH_LOAD_WORKERS: int = int(os.environ.get("GRAPH_LOAD_WORKERS", "4"))
+    # document_processor.py bulk ingestion: concurrent uploads and files per RAGFlow index call
+    INGEST_CONCURRENCY: int = int(os.environ.get("INGEST_CONCURRENCY", "8"))
+    INGEST_INDEX_BATCH: int = int(os.environ.get("INGEST_INDEX_BATCH", "20"))
+    # pdf_extractor.py worker processes; 0 uses every core
+    EXTRACT_WORKERS: int = int(os.environ.get("EXTRACT_WORKERS", "0"))
+    # Load and index the clauses from a normalized copy of the csv/ export (clause_normalizer.py),
+    # written to csv/normalized/ whenever it is missing or older than the export; csv/ is not modified
+    NORMALIZE_CLAUSES: bool = os.environ.get("NORMALIZE_CLAUSES", "True").lower() == "true"
+    # clause_normalizer.py: shingle Jaccard at which clauses are merged, and the number of
+    # repeats within one policy that marks a running header/footer (0 keeps them)
+    CLAUSE_DEDUP_THRESHOLD: float = float(os.environ.get("CLAUSE_DEDUP_THRESHOLD", "0.9"))
+    CLAUSE_REPEAT_LIMIT: int = int(os.environ.get("CLAUSE_REPEAT_LIMIT", "5"))
     
     # Path configuration
     TEMPLATES_DIR: str = os.environ.get("TEMPLATES_DIR", "templates")
@@ -0,0 +1,162 @@
+import hashlib
+import re
+from config import settings
+
+_WORD_PATTERN = re.compile(r"[a-z0-9]+")
+_LEADER_DOTS = re.compile(r"\.{3,}")
+_PAGE_MARKER = re.compile(r"(?:\s*-{3,})+\s*$")
+_WHITESPACE = re.compile(r"\s+")
+
+# Only the best-scoring candidates take part in the diversity selection; the rest
+# could never fit in a prompt budget anyway and would make MMR quadratic in fan-out
+MAX_MMR_CANDIDATES = 256
+
+
+def estimate_tokens(text):
+    """Rough token count (about four characters per token for English wording)"""
+    return max(1, len(text) // 4)
+
+
+def normalize_for_dedup(text):
+    """Canonical form used to spot duplicate clauses regardless of case, spacing, leader dots or page-break markers"""
+    text = _LEADER_DOTS.sub(" ", _PAGE_MARKER.sub("", text.lower()))
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def clause_key(text):
+    """Short hash of a clause's dedup form, how a digest records the clauses it summarises"""
+    return hashlib.sha1(normalize_for_dedup(text).encode("utf-8")).hexdigest()[:16]
+
+
+def format_chunk(chunk):
+    return f"Policy: {chunk.get('source', 'Unknown Policy')}\nContent: {chunk.get('content', '').strip()}\n"
+
+
+def _jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    overlap = len(a & b)
+    return overlap / (len(a) + len(b) - overlap)
+
+
+def build_policy_context(chunks, token_budget=None, max_chunks_per_policy=None, diversity=None, digests=None,
+                         digest_clauses=None):
+    """
+    Assemble the recommendation context from retrieved chunks within a token budget.
+
+    Policies that have a digest get it as one entry, in the order their best chunk was
+    retrieved, and their clauses the digest summarises are left out; clauses it does not
+    cover (e.g. an exclusion when the digest lists none) stay. For the remaining chunks duplicates are dropped
+    first, then chunks are picked by maximal marginal relevance (relevance from the
+    retrieval score, redundancy from word overlap with chunks already picked), optionally
+    capped per policy, until the budget is spent.
+
+    Args:
+        chunks: Retrieved chunks, best first, with "content", "source" and "score"
+        token_budget: Maximum estimated tokens of context (default: settings.CONTEXT_TOKEN_BUDGET)
+        max_chunks_per_policy: Per-policy quota, 0 for none (default: settings.CONTEXT_MAX_CHUNKS_PER_POLICY)
+        diversity: MMR trade-off in [0, 1], 0 ranks by relevance only (default: settings.CONTEXT_DIVERSITY)
+        digests: Optional {source: formatted policy digest} (see policy_digest.py)
+        digest_clauses: {source: set of clause_key()} of the clauses each digest covers
+
+    Returns:
+        tuple: (context text, report dict describing what was kept and trimmed)
+    """
+    token_budget = settings.CONTEXT_TOKEN_BUDGET if token_budget is None else token_budget
+    max_chunks_per_policy = settings.CONTEXT_MAX_CHUNKS_PER_POLICY if max_chunks_per_policy is None else max_chunks_per_policy
+    diversity = settings.CONTEXT_DIVERSITY if diversity is None else diversity
+
+    # Matched policies with a digest take one compact entry each, ahead of the raw clauses
+    digests = digests or {}
+    digest_clauses = digest_clauses or {}
+    matched = [chunk.get("source", "") for chunk in chunks or [] if chunk.get("source", "") in digests]
+    digest_sources = []
+    tokens_used = 0
+    dropped_digests = 0
+    for source in dict.fromkeys(matched):
+        cost = estimate_tokens(digests[source])
+        if tokens_used + cost > token_budget:
+            dropped_digests += 1
+            continue
+        digest_sources.append(source)
+        tokens_used += cost
+
+    # Drop empty, digested and duplicate clauses, keeping the first (best ranked) occurrence
+    included = set(digest_sources)
+    seen = set()
+    candidates = []
+    duplicates = 0
+    digested = 0
+    for chunk in chunks or []:
+        content = (chunk.get("content") or "").strip()
+        if not content:
+            continue
+        source = chunk.get("source", "")
+        if source in included and clause_key(content) in digest_clauses.get(source, ()):
+            digested += 1
+            continue
+        key = normalize_for_dedup(content)
+        if key in seen:
+            duplicates += 1
+            continue
+        seen.add(key)
+        candidates.append(chunk)
+    unique_count = len(candidates)
+    candidates = candidates[:MAX_MMR_CANDIDATES]
+
+    max_score = max((chunk.get("score") or 0 for chunk in candidates), default=0) or 1.0
+    relevance = [(chunk.get("score") or 0) / max_score for chunk in candidates]
+    words = [set(_WORD_PATTERN.findall(chunk["content"].lower())) for chunk in candidates]
+    texts = [format_chunk(chunk) for chunk in candidates]
+    costs = [estimate_tokens(text) for text in texts]
+
+    selected = []
+    policy_counts = {}
+    max_similarity = [0.0] * len(candidates)
+    remaining = set(range(len(candidates)))
+    dropped_budget = 0
+    dropped_quota = 0
+    min_cost = min(costs, default=0)
+    while remaining:
+        # Nothing left can fit once the unused budget is below the cheapest chunk
+        if token_budget - tokens_used < min_cost:
+            dropped_budget += len(remaining)
+            break
+        best = max(remaining, key=lambda i: (1 - diversity) * relevance[i] - diversity * max_similarity[i])
+        remaining.discard(best)
+
+        source = candidates[best].get("source", "")
+        if max_chunks_per_policy and policy_counts.get(source, 0) >= max_chunks_per_policy:
+            dropped_quota += 1
+            continue
+        if tokens_used + costs[best] > token_budget:
+            dropped_budget += 1
+            continue
+
+        selected.append(best)
+        tokens_used += costs[best]
+        policy_counts[source] = policy_counts.get(source, 0) + 1
+        if diversity <= 0:
+            continue
+        for i in remaining:
+            similarity = _jaccard(words[best], words[i])
+            if similarity > max_similarity[i]:
+                max_similarity[i] = similarity
+
+    # Present the picked chunks in retrieval order so the strongest evidence comes first
+    selected.sort()
+    context = "\n".join([digests[source] for source in digest_sources] + [texts[i] for i in selected])
+
+    report = {
+        "input_chunks": len(chunks or []),
+        "duplicates_dropped": duplicates,
+        "selected_chunks": len(selected),
+        "digest_policies": digest_sources,
+        "digested_chunks": digested,
+        "dropped_for_budget": dropped_budget + dropped_digests + (unique_count - len(candidates)),
+        "dropped_for_quota": dropped_quota,
+        "tokens_used": tokens_used,
+        "token_budget": token_budget,
+        "policies": policy_counts
+    }
+    return context, report
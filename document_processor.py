@@ -1,23 +1,194 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import requests
+from requests.adapters import HTTPAdapter
 from config import settings
 
-def upload_and_index_pdf(file_path: str, knowledge_base_id: str):
+logger = logging.getLogger(__name__)
+
+# Default manifest file written into the ingested directory
+MANIFEST_FILE = ".ingest_manifest.json"
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Shared RAGFlow session whose connection pool is sized for concurrent uploads"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(settings.INGEST_CONCURRENCY, 1))
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+            _session.headers["Authorization"] = f"Bearer {settings.RAGFLOW_API_KEY}"
+        return _session
+
+
+def file_sha256(file_path, block_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def upload_file(file_path):
+    """Upload one file to RAGFlow and return its file id"""
     url = f"{settings.RAGFLOW_API_URL}/api/v1/files"
-    headers = {"Authorization": f"Bearer {settings.RAGFLOW_API_KEY}"}
-    
     with open(file_path, "rb") as file:
-        files = {"file": file}
-        response = requests.post(url, headers=headers, files=files)
-    
-    if response.status_code == 200:
-        file_id = response.json()["id"]
-        index_url = f"{settings.RAGFLOW_API_URL}/api/v1/knowledge_bases/{knowledge_base_id}/index"
-        index_data = {"file_ids": [file_id]}
-        index_response = requests.post(index_url, headers=headers, json=index_data)
-        
-        if index_response.status_code == 200:
-            print(f"File uploaded and indexed successfully: {file_id}")
-        else:
-            print(f"Error indexing file: {index_response.text}")
-    else:
-        print(f"Error uploading file: {response.text}")
+        response = get_session().post(url, files={"file": file}, timeout=300)
+    if response.status_code != 200:
+        raise RuntimeError(f"Error uploading file: {response.text}")
+    return response.json()["id"]
+
+
+def index_files(knowledge_base_id, file_ids):
+    """Ask RAGFlow to index already uploaded files in one call"""
+    index_url = f"{settings.RAGFLOW_API_URL}/api/v1/knowledge_bases/{knowledge_base_id}/index"
+    response = get_session().post(index_url, json={"file_ids": file_ids}, timeout=300)
+    if response.status_code != 200:
+        raise RuntimeError(f"Error indexing files: {response.text}")
+
+
+def upload_and_index_pdf(file_path: str, knowledge_base_id: str):
+    try:
+        file_id = upload_file(file_path)
+        index_files(knowledge_base_id, [file_id])
+        logger.info("File uploaded and indexed successfully: %s", file_id)
+    except Exception as e:
+        logger.error("Exception uploading %s: %s", file_path, e)
+
+
+class IngestManifest:
+    """Per-file ingestion state (hash, file id, status, error) persisted as JSON after every change"""
+
+    def __init__(self, path):
+        self.path = path
+        self.files = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    self.files = json.load(f).get("files", {})
+            except (OSError, ValueError) as e:
+                logger.warning("Ignoring unreadable ingest manifest %s: %s", path, e)
+
+    def get(self, name):
+        with self._lock:
+            return dict(self.files.get(name, {}))
+
+    def update(self, name, **fields):
+        with self._lock:
+            entry = self.files.setdefault(name, {})
+            entry.update(fields, updated_at=time.time())
+            self._save()
+
+    def _save(self):
+        counts = {}
+        for entry in self.files.values():
+            counts[entry.get("status")] = counts.get(entry.get("status"), 0) + 1
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"progress": counts, "files": self.files}, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def ingest_directory(directory, knowledge_base_id, concurrency=None, index_batch_size=None, manifest_path=None):
+    """
+    Upload and index every PDF under a directory, resuming from the manifest of earlier runs.
+
+    Files whose content hash was already indexed into the same knowledge base are skipped,
+    files uploaded but not yet indexed are only indexed. Uploads run concurrently over one
+    pooled session and their file ids are indexed index_batch_size at a time.
+
+    Returns:
+        dict: Counts of indexed, skipped and failed files
+    """
+    concurrency = concurrency or settings.INGEST_CONCURRENCY
+    index_batch_size = index_batch_size or settings.INGEST_INDEX_BATCH
+    manifest = IngestManifest(manifest_path or os.path.join(directory, MANIFEST_FILE))
+    start = time.perf_counter()
+
+    pdf_files = sorted(
+        os.path.join(root, name)
+        for root, _, names in os.walk(directory)
+        for name in names
+        if name.lower().endswith(".pdf")
+    )
+    summary = {"indexed": 0, "skipped": 0, "failed": 0}
+    pending_index = []  # (manifest name, file id)
+
+    def flush_index():
+        if not pending_index:
+            return
+        batch = pending_index[:]
+        del pending_index[:]
+        try:
+            index_files(knowledge_base_id, [file_id for _, file_id in batch])
+            for name, _ in batch:
+                manifest.update(name, status="indexed", error=None)
+            summary["indexed"] += len(batch)
+        except Exception as e:
+            logger.warning("Index batch of %s files failed: %s", len(batch), e)
+            for name, _ in batch:
+                manifest.update(name, status="uploaded", error=str(e))
+            summary["failed"] += len(batch)
+
+    def upload(file_path, name):
+        sha256 = file_sha256(file_path)
+        entry = manifest.get(name)
+        if entry.get("sha256") == sha256 and entry.get("knowledge_base_id") == knowledge_base_id:
+            if entry.get("status") == "indexed":
+                return None
+            if entry.get("status") == "uploaded" and entry.get("file_id"):
+                return entry["file_id"]
+        manifest.update(name, sha256=sha256, knowledge_base_id=knowledge_base_id, status="uploading", error=None)
+        file_id = upload_file(file_path)
+        manifest.update(name, file_id=file_id, status="uploaded")
+        return file_id
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="pdf-ingest") as executor:
+        futures = {}
+        for file_path in pdf_files:
+            name = os.path.relpath(file_path, directory)
+            futures[executor.submit(upload, file_path, name)] = name
+
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                file_id = future.result()
+            except Exception as e:
+                logger.warning("Failed to upload %s: %s", name, e)
+                manifest.update(name, status="failed", error=str(e))
+                summary["failed"] += 1
+                continue
+            if file_id is None:
+                summary["skipped"] += 1
+                continue
+            pending_index.append((name, file_id))
+            if len(pending_index) >= index_batch_size:
+                flush_index()
+        flush_index()
+
+    logger.info("Ingested %s PDFs from %s in %.1f s: %s", len(pdf_files), directory, time.perf_counter() - start, summary)
+    return summary
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s - %(name)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Upload and index a directory of policy PDFs into RAGFlow")
+    parser.add_argument("directory")
+    parser.add_argument("knowledge_base_id")
+    parser.add_argument("--concurrency", type=int, default=settings.INGEST_CONCURRENCY)
+    parser.add_argument("--index-batch", type=int, default=settings.INGEST_INDEX_BATCH)
+    parser.add_argument("--manifest", default=None, help=f"Manifest path (default: <directory>/{MANIFEST_FILE})")
+    args = parser.parse_args()
+    ingest_directory(args.directory, args.knowledge_base_id, args.concurrency, args.index_batch, args.manifest)
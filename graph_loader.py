@@ -0,0 +1,314 @@
+import argparse
+import csv
+import glob
+import logging
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from config import settings
+from policy_digest import PolicyDigestStore
+from clause_normalizer import SHARED_CLAUSE_PREFIX, ensure_normalized
+from vector_search_neo4j import Neo4jConnection, write_graph_version
+
+logger = logging.getLogger(__name__)
+
+# Unique key property of every node label in the csv/ export
+KEY_PROPERTIES = {
+    "Policy": "policyId",
+    "Section": "sectionId",
+    "Clause": "clauseId",
+    "Definition": "term",
+    "Exclusion": "exclusionId",
+    "Coverage": "coverageId"
+}
+
+# Full-text indexes queried by the retrieval backends
+FULLTEXT_INDEXES = {
+    "clause_text_idx": ("Clause", "text"),
+    "definition_text_idx": ("Definition", "definitionText"),
+    "exclusion_text_idx": ("Exclusion", "exclusionText"),
+    "coverage_text_idx": ("Coverage", "coverageText")
+}
+
+ID_COLUMN = re.compile(r"^(\w+):ID\((\w+)\)$")
+START_COLUMN = re.compile(r"^:START_ID\((\w+)\)$")
+END_COLUMN = re.compile(r"^:END_ID\((\w+)\)$")
+IDENTIFIER = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+csv.field_size_limit(10 * 1024 * 1024)
+
+
+def _identifier(name):
+    """Labels and relationship types cannot be query parameters, so only plain identifiers are interpolated"""
+    if not IDENTIFIER.match(name or ""):
+        raise ValueError(f"Unexpected label or relationship type in CSV header: {name!r}")
+    return name
+
+
+def policy_matcher(policy_ids):
+    """
+    Return a predicate telling whether a node id belongs to one of policy_ids, or None for all.
+
+    Every id in the export is either the policyId itself or "<type>_<policyId>_<suffix>",
+    e.g. cl_pol_chubb_672aec9c_bc48910a belongs to pol_chubb_672aec9c.
+    """
+    if not policy_ids:
+        return None
+    policy_ids = set(policy_ids)
+    prefixes = tuple(f"{policy_id}_" for policy_id in policy_ids)
+
+    def matches(entity_id):
+        if entity_id in policy_ids:
+            return True
+        return entity_id.partition("_")[2].startswith(prefixes)
+
+    return matches
+
+
+def with_linked_ids(matches, csv_dir):
+    """
+    Extend a policy matcher with the nodes its policies link to but do not own.
+
+    Canonical clauses merged across policies have a policy-neutral id (clause_normalizer.py),
+    so they are picked up through the relationships of the matched policies and sections.
+    """
+    if matches is None:
+        return None
+    linked = set()
+    for path in glob.glob(os.path.join(csv_dir, "rels_*.csv")):
+        with open(path, newline="", encoding="utf-8") as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            for row in reader:
+                if matches(row[0]) and not matches(row[1]):
+                    linked.add(row[1])
+    return lambda entity_id: matches(entity_id) or entity_id in linked
+
+
+def _batches(rows, batch_size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class GraphLoader:
+    """Load the csv/ export into Neo4j with batched UNWIND upserts, optionally one policy at a time"""
+
+    def __init__(self, csv_dir=None, batch_size=None, workers=None):
+        self.csv_dir = csv_dir or settings.GRAPH_CSV_DIR
+        self.batch_size = batch_size or settings.GRAPH_LOAD_BATCH_SIZE
+        self.workers = workers or settings.GRAPH_LOAD_WORKERS
+        self.connection = Neo4jConnection()
+
+    def write_batch(self, query, rows):
+        """Run one batch in a managed write transaction; the driver retries transient errors and deadlocks"""
+        with self.connection.driver.session() as session:
+            return session.execute_write(lambda tx: tx.run(query, rows=rows).consume())
+
+    def ensure_schema(self):
+        """Create the key constraints MERGE relies on and the full-text indexes, if missing"""
+        with self.connection.driver.session() as session:
+            for label, key in KEY_PROPERTIES.items():
+                session.run(
+                    f"CREATE CONSTRAINT {label.lower()}_{key.lower()}_unique IF NOT EXISTS "
+                    f"FOR (n:{label}) REQUIRE n.{key} IS UNIQUE"
+                ).consume()
+            for name, (label, prop) in FULLTEXT_INDEXES.items():
+                session.run(
+                    f"CREATE FULLTEXT INDEX {name} IF NOT EXISTS FOR (n:{label}) ON EACH [n.{prop}]"
+                ).consume()
+
+    def load_nodes(self, path, matches=None):
+        """Upsert the nodes of one nodes_*.csv file; returns (label, key property, loaded ids)"""
+        loaded = []
+        with open(path, newline="", encoding="utf-8") as f:
+            reader = csv.DictReader(f)
+            id_column = next(column for column in reader.fieldnames if ID_COLUMN.match(column))
+            key, label = ID_COLUMN.match(id_column).groups()
+            label = _identifier(label)
+            key = _identifier(key)
+            properties = [column for column in reader.fieldnames if column != id_column and not column.startswith(":")]
+
+            query = (
+                f"UNWIND $rows AS row "
+                f"MERGE (n:{label} {{{key}: row.id}}) "
+                f"SET n += row.properties"
+            )
+
+            def rows():
+                for row in reader:
+                    entity_id = row[id_column]
+                    if matches is not None and not matches(entity_id):
+                        continue
+                    loaded.append(entity_id)
+                    yield {"id": entity_id, "properties": {name: row.get(name) or "" for name in properties}}
+
+            for batch in _batches(rows(), self.batch_size):
+                self.write_batch(query, batch)
+
+        logger.debug("Upserted %s %s nodes from %s", len(loaded), label, os.path.basename(path))
+        return label, key, loaded
+
+    def load_relationships(self, path, matches=None):
+        """Upsert the relationships of one rels_*.csv file; returns the number written"""
+        count = 0
+        with open(path, newline="", encoding="utf-8") as f:
+            reader = csv.DictReader(f)
+            start_column = next(column for column in reader.fieldnames if START_COLUMN.match(column))
+            end_column = next(column for column in reader.fieldnames if END_COLUMN.match(column))
+            start_label = _identifier(START_COLUMN.match(start_column).group(1))
+            end_label = _identifier(END_COLUMN.match(end_column).group(1))
+
+            queries = {}
+            for batch in _batches(reader, self.batch_size):
+                # Relationship types cannot be parameterized, so each type gets its own UNWIND
+                by_type = {}
+                for row in batch:
+                    if matches is not None and not (matches(row[start_column]) or matches(row[end_column])):
+                        continue
+                    by_type.setdefault(row[":TYPE"], []).append({"start": row[start_column], "end": row[end_column]})
+
+                for rel_type, rows in by_type.items():
+                    if rel_type not in queries:
+                        queries[rel_type] = (
+                            f"UNWIND $rows AS row "
+                            f"MATCH (a:{start_label} {{{KEY_PROPERTIES[start_label]}: row.start}}) "
+                            f"MATCH (b:{end_label} {{{KEY_PROPERTIES[end_label]}: row.end}}) "
+                            f"MERGE (a)-[:{_identifier(rel_type)}]->(b)"
+                        )
+                    self.write_batch(queries[rel_type], rows)
+                    count += len(rows)
+
+        logger.debug("Upserted %s relationships from %s", count, os.path.basename(path))
+        return count
+
+    def prune(self, label, key, policy_ids, keep_ids):
+        """Delete nodes of the reloaded policies that are no longer in the export"""
+        query = (
+            f"MATCH (n:{label}) "
+            f"WHERE any(policy_id IN $policy_ids WHERE n.{key} = policy_id "
+            f"OR substring(n.{key}, size(split(n.{key}, '_')[0]) + 1) STARTS WITH policy_id + '_') "
+            f"AND NOT n.{key} IN $keep_ids "
+            f"DETACH DELETE n"
+        )
+        with self.connection.driver.session() as session:
+            summary = session.execute_write(
+                lambda tx: tx.run(query, policy_ids=policy_ids, keep_ids=keep_ids).consume()
+            )
+        deleted = summary.counters.nodes_deleted
+        if deleted:
+            logger.info("Pruned %s stale %s nodes", deleted, label)
+        return deleted
+
+    def prune_shared_links(self, policy_ids, keep_links):
+        """Delete links from the reloaded policies and their sections to shared clauses they no longer contain"""
+        query = (
+            "MATCH (a)-[r:CONTAINS_CLAUSE]->(n:Clause) "
+            "WHERE n.clauseId STARTS WITH $shared_prefix "
+            "WITH a, r, n, coalesce(a.policyId, a.sectionId) AS start_id "
+            "WHERE any(policy_id IN $policy_ids WHERE start_id = policy_id "
+            "OR substring(start_id, size(split(start_id, '_')[0]) + 1) STARTS WITH policy_id + '_') "
+            "AND NOT [start_id, n.clauseId] IN $keep_links "
+            "DELETE r"
+        )
+        orphans = (
+            "MATCH (n:Clause) WHERE n.clauseId STARTS WITH $shared_prefix "
+            "AND NOT ()-[:CONTAINS_CLAUSE]->(n) "
+            "DETACH DELETE n"
+        )
+        with self.connection.driver.session() as session:
+            removed = session.execute_write(lambda tx: tx.run(
+                query, shared_prefix=SHARED_CLAUSE_PREFIX, policy_ids=policy_ids, keep_links=keep_links
+            ).consume()).counters.relationships_deleted
+            deleted = session.execute_write(lambda tx: tx.run(
+                orphans, shared_prefix=SHARED_CLAUSE_PREFIX
+            ).consume()).counters.nodes_deleted
+        if removed or deleted:
+            logger.info("Pruned %d stale shared clause links and %d orphaned shared clauses", removed, deleted)
+        return removed, deleted
+
+    def shared_links(self, csv_dir=None):
+        """[start id, clause id] of every CONTAINS_CLAUSE link to a shared clause in the export"""
+        links = []
+        for name in ("rels_contains_clause.csv", "rels_policy_contains_clause.csv"):
+            path = os.path.join(csv_dir or self.csv_dir, name)
+            if not os.path.exists(path):
+                continue
+            with open(path, newline="", encoding="utf-8") as f:
+                reader = csv.reader(f)
+                next(reader, None)
+                links.extend([row[0], row[1]] for row in reader if row[1].startswith(SHARED_CLAUSE_PREFIX))
+        return links
+
+    def policy_ids(self):
+        """Every policyId in the export"""
+        with open(os.path.join(self.csv_dir, "nodes_policy.csv"), newline="", encoding="utf-8") as f:
+            return [row["policyId:ID(Policy)"] for row in csv.DictReader(f)]
+
+    def load(self, policy_ids=None, prune=True, digests=True, normalize=None):
+        """
+        Upsert the export (or only the given policies) into Neo4j.
+
+        Nodes are MERGEd in place and stale nodes are removed only after the new ones
+        are linked, so clause_text_idx keeps answering queries for the whole reload.
+        Node files load in parallel, then relationship files, since those need both ends.
+        Nodes and relationships come from the normalized copy of the export, written first
+        when missing or stale (normalize defaults to settings.NORMALIZE_CLAUSES); the export
+        itself is never modified. Afterwards the coverage digests of new and changed policies
+        are rebuilt.
+        """
+        start = time.perf_counter()
+        normalize = settings.NORMALIZE_CLAUSES if normalize is None else normalize
+        source_dir = ensure_normalized(self.csv_dir) if normalize else self.csv_dir
+        if not self.connection.driver and not self.connection.connect():
+            raise RuntimeError("Could not connect to Neo4j")
+
+        self.ensure_schema()
+        matches = with_linked_ids(policy_matcher(policy_ids), source_dir)
+        node_files = sorted(glob.glob(os.path.join(source_dir, "nodes_*.csv")))
+        rel_files = sorted(glob.glob(os.path.join(source_dir, "rels_*.csv")))
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="graph-loader") as executor:
+            loaded_nodes = list(executor.map(lambda path: self.load_nodes(path, matches), node_files))
+            rel_count = sum(executor.map(lambda path: self.load_relationships(path, matches), rel_files))
+
+        if prune:
+            pruned_policies = list(policy_ids) if policy_ids else self.policy_ids()
+            for label, key, loaded in loaded_nodes:
+                if label != "Policy":
+                    self.prune(label, key, pruned_policies, loaded)
+            self.prune_shared_links(pruned_policies, self.shared_links(source_dir))
+
+        # Running apps poll this stamp and drop the retrievals and policy list they cached
+        version = write_graph_version(self.connection)
+        logger.info("Graph version is now %s", version)
+        if digests:
+            PolicyDigestStore(self.csv_dir).build()
+
+        node_count = sum(len(loaded) for _, _, loaded in loaded_nodes)
+        logger.info("Graph load finished: %s nodes, %s relationships in %.1f ms",
+                    node_count, rel_count, (time.perf_counter() - start) * 1000)
+        return node_count, rel_count
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s - %(name)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Load the csv/ graph export into Neo4j")
+    parser.add_argument("--csv-dir", default=settings.GRAPH_CSV_DIR)
+    parser.add_argument("--policy", action="append", dest="policy_ids",
+                        help="Only upsert this policyId (repeatable); default loads every policy")
+    parser.add_argument("--batch-size", type=int, default=settings.GRAPH_LOAD_BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=settings.GRAPH_LOAD_WORKERS)
+    parser.add_argument("--no-prune", action="store_true", help="Keep nodes that are no longer in the export")
+    parser.add_argument("--no-digests", action="store_true", help="Do not rebuild the policy coverage digests")
+    parser.add_argument("--no-normalize", action="store_true", help="Load the clauses without normalizing the export first")
+    args = parser.parse_args()
+    GraphLoader(args.csv_dir, args.batch_size, args.workers).load(
+        args.policy_ids, prune=not args.no_prune, digests=not args.no_digests, normalize=False if args.no_normalize else None
+    )
@@ -0,0 +1,61 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class GraphVersionWatcher:
+    """
+    Polls the version stamp graph_loader.py writes after every load and calls on_change when it moves.
+
+    The loader runs in its own process, so this is how a reload reaches the retrieval caches and
+    the policy catalog of the running app instead of waiting out their TTL / refresh interval.
+    """
+
+    def __init__(self, reader, on_change, interval=10):
+        """
+        Args:
+            reader: Callable returning the current version, or None when it is unknown
+            on_change: Called without arguments when the version differs from the last one seen
+            interval: Seconds between checks, 0 disables the watcher
+        """
+        self.reader = reader
+        self.on_change = on_change
+        self.interval = interval
+        self.version = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def check(self):
+        """Read the version once; returns True if it changed since the previous read"""
+        try:
+            version = self.reader()
+        except Exception as e:
+            logger.warning("Exception reading the graph version: %s", e)
+            return False
+        if version is None:
+            return False
+
+        with self._lock:
+            previous, self.version = self.version, version
+        if previous is None or previous == version:
+            return False
+        logger.info("Graph version changed from %s to %s, invalidating cached retrievals", previous, version)
+        self.on_change()
+        return True
+
+    def start(self):
+        """Start the background check thread once; the first check only records the current version"""
+        if self.interval <= 0 or self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._watch_loop, name="graph-version-watch", daemon=True)
+            self._thread.start()
+
+    def _watch_loop(self):
+        while True:
+            self.check()
+            time.sleep(self.interval)
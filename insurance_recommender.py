@@ -1,13 +1,30 @@
 from langchain_ollama import OllamaLLM
 from langgraph.graph import Graph, START, END
 from prompts import question_refinement_template, recommendation_template, profile_template
-from langgraph.checkpoint.memory import MemorySaver
-from vector_search_neo4j import document_retrieval, get_datasets
+from retrieval import document_match_stats, document_retrieval, document_retrieval_multi, policy_catalog
+from context_builder import build_policy_context
+from policy_digest import policy_digests
+from llm_cache import llm_cache
+from slot_extractor import SlotExtractor
+from session_store import SQLiteCheckpointSaver, session_store
+from metrics import LLMMetricsCallback, NODE_SECONDS, timed
+from match_stats import empty_match_stats
+from rank_fusion import chunk_key
 import re
+import logging
 from config import settings
 
-# Initialize the LLM
-llm = OllamaLLM(model="deepseek-r1:latest")
+logger = logging.getLogger(__name__)
+
+def make_llm(model, think=""):
+    """Ollama LLM for one graph node; think is "true", "false" or "" for the model default"""
+    reasoning = {"true": True, "false": False}.get((think or "").strip().lower())
+    return OllamaLLM(model=model, base_url=settings.LLM_API_BASE, reasoning=reasoning, callbacks=[LLMMetricsCallback(model)])
+
+# Initialize one LLM per node so each can run on the model it needs
+question_llm = make_llm(settings.QUESTION_LLM_MODEL, settings.QUESTION_LLM_THINK)
+profile_llm = make_llm(settings.PROFILE_LLM_MODEL, settings.PROFILE_LLM_THINK)
+recommendation_llm = make_llm(settings.RECOMMENDATION_LLM_MODEL, settings.RECOMMENDATION_LLM_THINK)
 
 # Define all_categories globally
 ALL_CATEGORIES = [
@@ -28,12 +45,52 @@ SUGGESTED_ANSWERS = {
     "Preferred grace period (days) for new subsidiary cover": ["30 days", "60 days", "90 days", "No preference"]
 }
 
+# Questions asked without the LLM when the next missing category is clear
+QUESTION_TEMPLATES = {
+    "Company size/employee count": "How many employees does your company have?",
+    "Industry/business type": "Which industry does your company operate in?",
+    "Annual revenue": "What is your company's approximate annual revenue?",
+    "Risk profile/concerns": "What are the main risks or liability concerns you want covered?",
+    "Budget constraints": "What is your annual budget for this insurance?",
+    "Country of the company": "In which country is your company based?",
+    "Crypto coverage needs": "Do you need coverage for cryptocurrency or digital asset activities?",
+    "Preferred grace period (days) for new subsidiary cover": "How many days of automatic cover do you need for newly acquired subsidiaries?"
+}
+
+slot_extractor = SlotExtractor(ALL_CATEGORIES, SUGGESTED_ANSWERS)
+
+# Retrieval sub-query per answered category, phrased the way policy wordings talk about it
+CATEGORY_QUERIES = {
+    "Company size/employee count": "{value} employees company size",
+    "Industry/business type": "{value} industry professional services business activities",
+    "Annual revenue": "annual revenue turnover {value}",
+    "Risk profile/concerns": "{value} claims coverage",
+    "Budget constraints": "premium limit of liability retention {value}",
+    "Country of the company": "{value} jurisdiction territory",
+    "Crypto coverage needs": "cryptocurrency digital assets virtual currency",
+    "Preferred grace period (days) for new subsidiary cover": "newly acquired subsidiary automatic cover {value}"
+}
+# Answers that give a sub-query nothing to search for ("No", "No preference", "Other Non-US"),
+# e.g. the crypto template would otherwise search crypto clauses for a company that needs none
+NO_QUERY_ANSWER = re.compile(r"^(?:no|none|nope|not|n/a|other)\b")
+
+# Maximum number of fused candidates kept in the state between turns
+MAX_RETRIEVAL_CANDIDATES = 1024
+# Turns an answer whose retrieval returned nothing is retried before it counts as retrieved
+MAX_RETRIEVAL_ATTEMPTS = 3
+
+# Matching clauses after which questioning stops, and the number needed once every category is answered
+MIN_MATCHES_TO_STOP = 400
+MIN_MATCHES_WHEN_COMPLETE = 600
+
+@timed(NODE_SECONDS, node="get_initial_input")
 def get_initial_input(state):
     state["company_info"] = []
     state["collected_categories"] = []
     state["question_attempts"] = 0
     return state
 
+@timed(NODE_SECONDS, node="refine_question")
 def refine_question(state):
     if state.get("question_attempts", 0) >= 5:
         state["next_step"] = "COMPLETE"
@@ -41,94 +98,281 @@ def refine_question(state):
     
     # Check if we have enough information to retrieve policies
     if len(state.get("company_info", [])) > 0:
-        # Generate a temporary company profile for policy retrieval
-        current_info_text = "\n".join(state.get("company_info", []))
-        
-        # Create a temporary state for policy retrieval
-        temp_state = state.copy()
-        temp_state["company_profile"] = current_info_text
-        
-        # Retrieve relevant policies based on current information
-        temp_state = retrieve_relevant_policies(temp_state)
-        
-        # Get the number of retrieved chunks
-        retrieved_chunks = temp_state.get("retrieved_chunks", [])
-        num_chunks = len(retrieved_chunks)
-        print(f"DEBUG - retrieved_chunks {num_chunks}")
-        
-        # Store the retrieved chunks in the main state for future reference
-        state["retrieved_chunks"] = retrieved_chunks
-        
-        # If we have a sufficient number of relevant policies, move to recommendation
-        if num_chunks >= 400:  # Updated threshold to 600 chunks
-            state["next_step"] = "COMPLETE"
+        if settings.TURN_RETRIEVAL == "count":
+            # Only the number of matching clauses is needed to decide whether to keep asking
+            enough = record_match_stats(state, retrieve_match_stats(state))
+        else:
+            enough = record_retrieved_chunks(state, retrieve_turn_chunks(state))
+        if enough:
             return state
     
+    question_inputs = build_question_inputs(state)
+    if question_inputs is None:
+        return state
+    
+    next_question = templated_question(state)
+    if next_question is None:
+        question_chain = question_refinement_template | question_llm
+        next_question = question_chain.invoke(question_inputs)
+    record_question(state, next_question)
+    return state
+
+def update_slots(state):
+    """Extract the category slots from company_info, once per new answer"""
+    company_info = state.get("company_info", [])
+    if state.get("slots_info_count") == len(company_info) and "slots" in state:
+        return state
+    slots, unmatched = slot_extractor.extract(company_info, state.get("asked_categories"))
+    state["slots"] = slots
+    state["unmatched_answers"] = unmatched
+    state["slots_info_count"] = len(company_info)
+    # A topic mentioned without a value ("our industry is ...") is not collected yet
+    state["collected_categories"] = [category for category, value in slots.items() if value is not None]
+    return state
+
+def templated_question(state):
+    """The next question without an LLM call, or None when the LLM should phrase it
+    
+    Only used while every answer so far was understood by the slot extractor; free text
+    it could not place may already answer something, which the LLM can still pick up.
+    """
+    if state.get("unmatched_answers"):
+        return None
+    category = slot_extractor.next_missing(state.get("slots", {}))
+    if category is None or category not in QUESTION_TEMPLATES:
+        return None
+    options = ", ".join(SUGGESTED_ANSWERS[category])
+    return f"CATEGORY: {category}\nQUESTION: {QUESTION_TEMPLATES[category]} (e.g., {options})"
+
+def record_question(state, next_question):
+    """Store the question and remember which category the next answer is expected to fill"""
+    state["next_question"] = next_question
+    state["question_attempts"] = state.get("question_attempts", 0) + 1
+    
+    match = re.search(r"CATEGORY:\s*(.+)", next_question or "")
+    category = None
+    if match:
+        asked = match.group(1).strip().strip("[]*").lower()
+        category = next((cat for cat in ALL_CATEGORIES if cat.lower() == asked), None)
+    # asked_categories[i] is the category the i-th answer replies to
+    answer_index = len(state.get("company_info", []))
+    asked_categories = list(state.get("asked_categories", []))[:answer_index]
+    asked_categories += [None] * (answer_index - len(asked_categories))
+    state["asked_categories"] = asked_categories + [category]
+    return state
+
+def record_match_count(state, match_count):
+    """Store how many clauses match the answers so far; returns True once there are enough to recommend"""
+    logger.debug("matching clauses %s", match_count)
+    state["match_count"] = match_count
+    
+    # If we have a sufficient number of relevant policies, move to recommendation
+    if match_count >= MIN_MATCHES_TO_STOP:
+        state["next_step"] = "COMPLETE"
+        return True
+    return False
+
+def record_retrieved_chunks(state, retrieved_chunks):
+    """Store this turn's chunks in the state; returns True once there are enough to recommend"""
+    # Store the retrieved chunks in the main state for future reference
+    state["retrieved_chunks"] = retrieved_chunks
+    return record_match_count(state, len(retrieved_chunks))
+
+def record_match_stats(state, match_stats):
+    """Store this turn's match count and score histogram per policy; returns True once there are enough to recommend"""
+    state["match_stats"] = match_stats
+    return record_match_count(state, match_stats["total"])
+
+def build_question_inputs(state):
+    """Inputs for question_refinement_template, or None when no question is needed (next_step is set)"""
+    update_slots(state)
     # If we don't have enough policies yet, continue gathering information
     missing_info = [cat for cat in ALL_CATEGORIES if cat not in state.get("collected_categories", [])]
     if not missing_info:
         # Even if we have all categories, we still need enough chunks
-        if state.get("retrieved_chunks", []) and len(state["retrieved_chunks"]) >= 600:
+        if state.get("match_count", 0) >= MIN_MATCHES_WHEN_COMPLETE:
             state["next_step"] = "COMPLETE"
         else:
             # We have all categories but not enough chunks, continue with more specific questions
             state["next_step"] = "CONTINUE"
-        return state
+        return None
     
     current_info_text = "\n".join(state.get("company_info", [])) if state.get("company_info") else "No information yet."
     
     # Include information about retrieved policies if available
     policy_context = ""
-    if "retrieved_chunks" in state and state["retrieved_chunks"]:
-        num_chunks = len(state["retrieved_chunks"])
-        policy_context = f"\nCurrently found {num_chunks} chunks. We need at least 600 chunk to make a recommendation."
+    if state.get("match_count"):
+        num_chunks = state["match_count"]
+        policy_context = f"\nCurrently found {num_chunks} chunks. We need at least {MIN_MATCHES_WHEN_COMPLETE} chunk to make a recommendation."
     
     missing_with_suggestions = [f"Note: You have a maximum of 5 attempts to gather missing information. This is attempt {state['question_attempts'] + 1}."]
     for cat in missing_info:
         options = ", ".join(SUGGESTED_ANSWERS[cat])
         missing_with_suggestions.append(f"{cat} (e.g., {options})")
     
-    question_chain = question_refinement_template | llm
-    state["next_question"] = question_chain.invoke({
+    return {
         "current_info": current_info_text,
         "missing_info": "\n".join(missing_with_suggestions),
         "policy_context": policy_context
-    })
-    state["question_attempts"] = state.get("question_attempts", 0) + 1
-    return state
+    }
 
+@timed(NODE_SECONDS, node="process_user_input")
 def process_user_input(state):
     if "user_input" in state and state["user_input"]:
         state["company_info"] = state.get("company_info", []) + [state["user_input"]]
-        for category in ALL_CATEGORIES:
-            if category not in state.get("collected_categories", []):
-                state["collected_categories"] = state.get("collected_categories", []) + [category]
-                break
         state["user_input"] = ""  # Clear input after processing
+        update_slots(state)
     return state
 
+def retrieve_turn_chunks(state):
+    """Clauses for the answers so far, when the stopping rule counts fetched chunks"""
+    if settings.TURN_RETRIEVAL == "incremental":
+        # Only the answers added since the last turn are retrieved and fused into the candidates
+        return retrieve_incremental(state)
+    
+    # Generate a temporary company profile for policy retrieval
+    current_info_text = "\n".join(state.get("company_info", []))
+    
+    # Create a temporary state for policy retrieval
+    temp_state = state.copy()
+    temp_state["company_profile"] = current_info_text
+    
+    # Retrieve relevant policies based on current information
+    temp_state = retrieve_relevant_policies(temp_state)
+    return temp_state.get("retrieved_chunks", [])
+
+def retrieve_match_stats(state):
+    """Match count and score histogram per policy for all answers so far, without fetching clause texts"""
+    dataset_ids = policy_catalog.dataset_ids()
+    if not dataset_ids:
+        logger.warning("No datasets found for retrieval.")
+        return empty_match_stats()
+    return document_match_stats(dataset_ids, "\n".join(state.get("company_info", [])))
+
+def retrieve_incremental(state):
+    """Retrieve for the answers not yet searched and merge them into the candidates by reciprocal rank fusion
+    
+    The state keeps "retrieval_candidates" (chunk key -> {"chunk", "rrf_score"}), "retrieved_info"
+    (the answers already considered) and "retrieval_retries" (those whose retrieval found nothing),
+    so each turn costs one retrieval for the new answer only.
+    """
+    candidates, pending = pending_answers(state)
+    results = None
+    if pending:
+        dataset_ids = policy_catalog.dataset_ids()
+        if not dataset_ids:
+            logger.warning("No datasets found for retrieval.")
+        else:
+            results = [document_retrieval(dataset_ids, answer) or [] for _, answer, _ in pending]
+    return fuse_incremental_results(state, candidates, pending, results)
+
+def pending_answers(state):
+    """Return (previous candidates, [(position, answer, failed attempts), ...] still to retrieve)
+    
+    Pending answers are the new ones plus earlier answers whose retrieval returned nothing, which
+    the backends also return when a query failed.
+    """
+    company_info = state.get("company_info", [])
+    retrieved_info = state.get("retrieved_info", [])
+    candidates = state.get("retrieval_candidates") or {}
+    retries = state.get("retrieval_retries") or []
+    
+    # Start over if the conversation no longer extends what was retrieved before
+    if company_info[:len(retrieved_info)] != retrieved_info:
+        logger.debug("Conversation changed, resetting incremental retrieval")
+        retrieved_info = []
+        candidates = {}
+        retries = []
+    
+    pending = [(position, company_info[position], attempts) for position, attempts in retries]
+    pending += [
+        (position, company_info[position], 0)
+        for position in range(len(retrieved_info), len(company_info))
+        if company_info[position] and company_info[position].strip()
+    ]
+    return candidates, pending
+
+def fuse_incremental_results(state, candidates, pending, results):
+    """Merge one ranked chunk list per pending answer into the candidates and return them best first
+    
+    results is None when retrieval did not run (no datasets); its answers stay pending. An answer
+    whose retrieval came back empty is retried on the next turns, up to MAX_RETRIEVAL_ATTEMPTS times.
+    """
+    candidates = dict(candidates)
+    retries = []
+    for index, (position, answer, attempts) in enumerate(pending):
+        if results is None:
+            retries.append([position, attempts])
+            continue
+        chunks = results[index]
+        if not chunks:
+            if attempts + 1 < MAX_RETRIEVAL_ATTEMPTS:
+                retries.append([position, attempts + 1])
+            continue
+        for rank, chunk in enumerate(chunks):
+            key = chunk_key(chunk)
+            entry = candidates.get(key)
+            if entry is None:
+                entry = candidates[key] = {"chunk": chunk, "rrf_score": 0.0}
+            entry["rrf_score"] += 1.0 / (settings.RRF_K + rank + 1)
+    
+    # Keep the candidate set bounded so the state does not grow with the conversation
+    if len(candidates) > MAX_RETRIEVAL_CANDIDATES:
+        ranked = sorted(candidates.items(), key=lambda item: item[1]["rrf_score"], reverse=True)
+        candidates = dict(ranked[:MAX_RETRIEVAL_CANDIDATES])
+    
+    state["retrieval_candidates"] = candidates
+    state["retrieved_info"] = list(state.get("company_info", []))
+    state["retrieval_retries"] = retries
+    
+    ranked = sorted(candidates.values(), key=lambda entry: entry["rrf_score"], reverse=True)
+    logger.debug("Incremental retrieval: %d pending answers, %d to retry, %d fused candidates",
+                 len(pending), len(retries), len(ranked))
+    return [dict(entry["chunk"], rrf_score=entry["rrf_score"]) for entry in ranked]
+
+@timed(NODE_SECONDS, node="generate_company_profile")
 def generate_company_profile(state):
     if not state.get("company_info"):
         state["company_profile"] = "No company information available."
     else:
         collected_info = "\n".join(state["company_info"])
-        profile_chain = profile_template | llm
-        company_profile = profile_chain.invoke({"collected_info": collected_info})
-        import re
-        state["company_profile"] = re.sub(r'<think>.*?</think>', '', company_profile, flags=re.DOTALL).strip()
+        company_profile = llm_cache.invoke(profile_template, profile_llm, {"collected_info": collected_info})
+        state["company_profile"] = strip_think(company_profile)
     return state
 
+def strip_think(text):
+    """Remove the model's <think> blocks from a complete response"""
+    return re.sub(r'<think>.*?</think>', '', text, flags=re.DOTALL).strip()
+
+def category_queries(state):
+    """One retrieval sub-query per category the slot extractor has a searchable value for"""
+    update_slots(state)
+    queries = []
+    for category, value in state.get("slots", {}).items():
+        template = CATEGORY_QUERIES.get(category)
+        if template is None or value is None or NO_QUERY_ANSWER.match(value.strip().lower()):
+            continue
+        queries.append(template.format(value=value))
+    return queries
+
+def policy_queries(state, search_query):
+    """The profile query followed by the category sub-queries fused with it, if enabled"""
+    if not settings.MULTI_QUERY_RETRIEVAL:
+        return [search_query]
+    return [search_query] + category_queries(state)
+
+@timed(NODE_SECONDS, node="retrieve_relevant_policies")
 def retrieve_relevant_policies(state):
     """Retrieve relevant policy information from RAGFlow using the company profile"""
-    print("\nDEBUG - Starting retrieve_relevant_policies function")
+    logger.debug("Starting retrieve_relevant_policies function")
     
     # Log company info from state
-    print(f"DEBUG - Company info in state: {state.get('company_info', [])}")
+    logger.debug("Company info in state: %s answers", len(state.get('company_info', [])))
     
     company_profile = state.get("company_profile", "")
     
     if not company_profile or company_profile == "No company information available.":
-        print("DEBUG - No company profile available")
+        logger.debug("No company profile available")
         state["retrieved_chunks"] = []
         state["policy_context"] = "No specific policy information available."
         return state
@@ -137,8 +381,8 @@ def retrieve_relevant_policies(state):
     search_query = f"{company_profile}"
     
     try:
-        # Get all available datasets
-        datasets = get_datasets()
+        # Get all available datasets from the in-memory catalog
+        datasets = policy_catalog.get_datasets()
         
         # Extract dataset IDs
         dataset_ids = []
@@ -150,59 +394,142 @@ def retrieve_relevant_policies(state):
                 elif isinstance(dataset, str):
                     dataset_ids.append(dataset)
         
-        print(f"DEBUG - Final dataset_ids: {dataset_ids}")
+        logger.debug("Final dataset_ids: %s datasets", len(dataset_ids))
         
         # If no datasets are found, return no results
         if not dataset_ids:
-            print("WARNING: No datasets found for retrieval.")
+            logger.warning("No datasets found for retrieval.")
             state["retrieved_chunks"] = []
             state["policy_context"] = "No policy information found. Please check if datasets are available."
             return state
         
-        # Retrieve relevant chunks from RAGFlow
-        chunks = document_retrieval(dataset_ids, search_query)
-        
-        # Store retrieved chunks in state
-        state["retrieved_chunks"] = chunks if chunks else []
-        
-        # Also build a formatted context string for the recommendation
-        policy_texts = []
-        if chunks:
-            for chunk in chunks:
-                content = chunk.get("content", "").strip()
-                source = chunk.get("source", "Unknown Policy")
-                if content:
-                    policy_texts.append(f"Policy: {source}\nContent: {content}\n")
-        
-        if policy_texts:
-            state["policy_context"] = "\n".join(policy_texts)
+        # Retrieve relevant chunks, fusing the category sub-queries in one call when there are any
+        queries = policy_queries(state, search_query)
+        if len(queries) > 1:
+            chunks = document_retrieval_multi(dataset_ids, queries)
         else:
-            state["policy_context"] = "No policy information found matching your company profile."
+            chunks = document_retrieval(dataset_ids, search_query)
+        
+        record_policy_context(state, chunks)
         
     except Exception as e:
-        print(f"ERROR retrieving policy information: {e}")
+        logger.error("Error retrieving policy information: %s", e)
         state["retrieved_chunks"] = []
         state["policy_context"] = "Error retrieving policy information."
     
     return state
 
-def generate_recommendation(state):
+def record_policy_context(state, chunks):
+    """Store the retrieved chunks and the formatted context string for the recommendation"""
+    # Store retrieved chunks in state
+    state["retrieved_chunks"] = chunks if chunks else []
+    
+    # Also build a deduplicated, token-budgeted context string for the recommendation
+    if settings.POLICY_DIGESTS:
+        digests, digest_clauses = policy_digests.by_source(), policy_digests.clauses_by_source()
+    else:
+        digests, digest_clauses = None, None
+    policy_context, context_report = build_policy_context(
+        state["retrieved_chunks"], digests=digests, digest_clauses=digest_clauses
+    )
+    state["context_report"] = context_report
+    logger.debug("Policy context: %s policy digests, %s/%s chunks, %s/%s tokens, %s duplicates dropped",
+          len(context_report['digest_policies']), context_report['selected_chunks'], context_report['input_chunks'],
+          context_report['tokens_used'], context_report['token_budget'], context_report['duplicates_dropped'])
+    
+    if policy_context:
+        state["policy_context"] = policy_context
+    else:
+        state["policy_context"] = "No policy information found matching your company profile."
+    return state
+
+def recommendation_inputs(state):
     company_profile = state.get("company_profile", "\n".join(state.get("company_info", [])))
     
     # Use retrieved policy information if available, otherwise use generic text
     policy_info = state.get("policy_context", "No specific policy information available.")
     
-    recommendation_chain = recommendation_template | llm
-    recommendation = recommendation_chain.invoke({
+    return {
         "company_profile": company_profile,
         "relevant_policies": policy_info
-    })
+    }
+
+@timed(NODE_SECONDS, node="generate_recommendation")
+def generate_recommendation(state):
+    recommendation_chain = recommendation_template | recommendation_llm
+    recommendation = recommendation_chain.invoke(recommendation_inputs(state))
     
     state["recommendation"] = recommendation
     return state
 
+class ThinkTagFilter:
+    """Drop <think>...</think> blocks from a token stream, even when a tag is split across tokens"""
+    
+    OPEN_TAG = "<think>"
+    CLOSE_TAG = "</think>"
+    
+    def __init__(self):
+        self.buffer = ""
+        self.in_think = False
+        self.started = False
+    
+    @staticmethod
+    def _partial_tag_length(text, tag):
+        """Length of the longest suffix of text that is a prefix of tag"""
+        for length in range(min(len(tag) - 1, len(text)), 0, -1):
+            if text.endswith(tag[:length]):
+                return length
+        return 0
+    
+    def _emit(self, text):
+        # Drop the whitespace the model leaves between the think block and the answer
+        if not self.started:
+            text = text.lstrip()
+            self.started = bool(text)
+        return text
+    
+    def feed(self, text):
+        """Add a token and return the part of the stream that is safe to show"""
+        self.buffer += text
+        visible = []
+        while True:
+            tag = self.CLOSE_TAG if self.in_think else self.OPEN_TAG
+            index = self.buffer.find(tag)
+            if index >= 0:
+                if not self.in_think:
+                    visible.append(self._emit(self.buffer[:index]))
+                self.buffer = self.buffer[index + len(tag):]
+                self.in_think = not self.in_think
+                continue
+            
+            keep = self._partial_tag_length(self.buffer, tag)
+            ready, self.buffer = self.buffer[:len(self.buffer) - keep], self.buffer[len(self.buffer) - keep:]
+            if not self.in_think:
+                visible.append(self._emit(ready))
+            return "".join(visible)
+    
+    def flush(self):
+        """Return whatever is left once the stream has ended"""
+        remaining = "" if self.in_think else self._emit(self.buffer)
+        self.buffer = ""
+        return remaining
+
+def stream_recommendation(state):
+    """Yield the recommendation text token by token, with <think> blocks removed"""
+    recommendation_chain = recommendation_template | recommendation_llm
+    think_filter = ThinkTagFilter()
+    for token in recommendation_chain.stream(recommendation_inputs(state)):
+        visible = think_filter.feed(token)
+        if visible:
+            yield visible
+    
+    remaining = think_filter.flush()
+    if remaining:
+        yield remaining
+
 # Define and compile the LangGraph workflow
-checkpointer = MemorySaver()
+# Checkpoints are persisted per thread_id in the bounded server-side session store
+checkpointer = SQLiteCheckpointSaver(session_store)
 workflow = Graph()
 
 workflow.add_node("get_initial_input", get_initial_input)
@@ -0,0 +1,115 @@
+import asyncio
+import logging
+from prompts import question_refinement_template, profile_template
+from retrieval import document_match_stats_async, document_retrieval_async, document_retrieval_multi_async, policy_catalog
+from insurance_recommender import (
+    question_llm, profile_llm, build_question_inputs, fuse_incremental_results, pending_answers,
+    policy_queries, record_match_stats, record_policy_context, record_question, record_retrieved_chunks,
+    strip_think, templated_question
+)
+from llm_cache import llm_cache
+from metrics import NODE_SECONDS, timed
+from match_stats import empty_match_stats
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# Async counterparts of the insurance_recommender nodes for the ASGI app. They share the
+# state-handling helpers with the sync nodes and only differ in awaiting LLM and retrieval I/O.
+# The recommendation itself runs on the sync pipeline in a recommendation_jobs worker thread.
+
+@timed(NODE_SECONDS, node="refine_question")
+async def refine_question_async(state):
+    if state.get("question_attempts", 0) >= 5:
+        state["next_step"] = "COMPLETE"
+        return state
+    
+    # Check if we have enough information to retrieve policies
+    if len(state.get("company_info", [])) > 0:
+        if settings.TURN_RETRIEVAL == "count":
+            enough = record_match_stats(state, await retrieve_match_stats_async(state))
+        else:
+            enough = record_retrieved_chunks(state, await retrieve_turn_chunks_async(state))
+        if enough:
+            return state
+    
+    question_inputs = build_question_inputs(state)
+    if question_inputs is None:
+        return state
+    
+    next_question = templated_question(state)
+    if next_question is None:
+        question_chain = question_refinement_template | question_llm
+        next_question = await question_chain.ainvoke(question_inputs)
+    record_question(state, next_question)
+    return state
+
+async def retrieve_turn_chunks_async(state):
+    """Async retrieve_turn_chunks"""
+    if settings.TURN_RETRIEVAL == "incremental":
+        return await retrieve_incremental_async(state)
+    temp_state = state.copy()
+    temp_state["company_profile"] = "\n".join(state.get("company_info", []))
+    temp_state = await retrieve_relevant_policies_async(temp_state)
+    return temp_state.get("retrieved_chunks", [])
+
+async def retrieve_match_stats_async(state):
+    """Async retrieve_match_stats"""
+    dataset_ids = await policy_catalog.dataset_ids_async()
+    if not dataset_ids:
+        logger.warning("No datasets found for retrieval.")
+        return empty_match_stats()
+    return await document_match_stats_async(dataset_ids, "\n".join(state.get("company_info", [])))
+
+async def retrieve_incremental_async(state):
+    """Async retrieve_incremental: the new answers are retrieved concurrently"""
+    candidates, pending = pending_answers(state)
+    results = None
+    if pending:
+        dataset_ids = await policy_catalog.dataset_ids_async()
+        if not dataset_ids:
+            logger.warning("No datasets found for retrieval.")
+        else:
+            results = await asyncio.gather(*(document_retrieval_async(dataset_ids, answer) for _, answer, _ in pending))
+            results = [chunks or [] for chunks in results]
+    return fuse_incremental_results(state, candidates, pending, results)
+
+@timed(NODE_SECONDS, node="generate_company_profile")
+async def generate_company_profile_async(state):
+    if not state.get("company_info"):
+        state["company_profile"] = "No company information available."
+    else:
+        company_profile = await llm_cache.ainvoke(profile_template, profile_llm, {"collected_info": "\n".join(state["company_info"])})
+        state["company_profile"] = strip_think(company_profile)
+    return state
+
+@timed(NODE_SECONDS, node="retrieve_relevant_policies")
+async def retrieve_relevant_policies_async(state):
+    company_profile = state.get("company_profile", "")
+    
+    if not company_profile or company_profile == "No company information available.":
+        state["retrieved_chunks"] = []
+        state["policy_context"] = "No specific policy information available."
+        return state
+    
+    try:
+        dataset_ids = await policy_catalog.dataset_ids_async()
+        if not dataset_ids:
+            logger.warning("No datasets found for retrieval.")
+            state["retrieved_chunks"] = []
+            state["policy_context"] = "No policy information found. Please check if datasets are available."
+            return state
+        
+        queries = policy_queries(state, company_profile)
+        if len(queries) > 1:
+            chunks = await document_retrieval_multi_async(dataset_ids, queries)
+        else:
+            chunks = await document_retrieval_async(dataset_ids, company_profile)
+        record_policy_context(state, chunks)
+    
+    except Exception as e:
+        logger.error("Error retrieving policy information: %s", e)
+        state["retrieved_chunks"] = []
+        state["policy_context"] = "Error retrieving policy information."
+    
+    return state
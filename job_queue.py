@@ -0,0 +1,327 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from config import settings
+from metrics import JOB_SECONDS, JOBS
+
+logger = logging.getLogger(__name__)
+
+# Job statuses; a job moves queued -> running -> done or failed
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+FINISHED = (DONE, FAILED)
+
+# Seconds between reads of a job run by another worker process
+REMOTE_POLL_INTERVAL = 0.2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    queue TEXT NOT NULL,
+    key TEXT NOT NULL,
+    status TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_queue_status ON jobs (queue, status, created);
+CREATE TABLE IF NOT EXISTS job_events (
+    job_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    event TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (job_id, seq)
+);
+"""
+
+
+def job_key(*parts):
+    """Deduplication key of a job from its JSON-serializable inputs"""
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class Job:
+    """One queued pipeline run, the events it published and, once finished, its result or error"""
+
+    def __init__(self, key, job_id=None, created=None):
+        self.id = job_id or uuid.uuid4().hex
+        self.key = key
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.created = time.time() if created is None else created
+        self.started = None
+        self.finished = None
+        self.events = []  # (event, data) in publish order
+
+
+class JobQueue:
+    """
+    Bounded background queue in front of a fixed pool of worker threads.
+
+    At most max_depth jobs wait for a worker; submit() refuses more so the caller can answer
+    429 instead of piling requests onto the LLM. A job submitted with the key of a queued or
+    running one is not queued again, the caller gets the existing job. Finished jobs are kept
+    result_ttl seconds for clients to collect.
+
+    Job state and published events live in the SQLite file at db_path. Worker processes that
+    share the file share the depth limit and the deduplication, and any of them can report or
+    relay any job. A job runs in the process that queued it; one still unfinished after
+    lost_after seconds (e.g. because that process died) is reported failed.
+    """
+
+    def __init__(self, name, workers=2, max_depth=32, result_ttl=600, db_path=":memory:", lost_after=900):
+        self.name = name
+        self.max_depth = max_depth
+        self.result_ttl = result_ttl
+        self.lost_after = lost_after
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)  # notified on every change of a local job
+        self._jobs = {}  # job id -> Job run by this process
+        self._current = threading.local()
+
+        directory = os.path.dirname(db_path) if db_path != ":memory:" else ""
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def submit(self, key, func, *args):
+        """
+        Queue func(*args) as a job unless an identical one is in flight.
+
+        Returns:
+            tuple: (job, deduplicated), or (None, False) when max_depth jobs are already waiting
+        """
+        with self._lock:
+            # Take the write lock up front so two processes cannot both admit the same key
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._prune()
+                row = self._conn.execute(
+                    "SELECT job_id FROM jobs WHERE queue = ? AND key = ? AND status IN (?, ?) ORDER BY created LIMIT 1",
+                    (self.name, key, QUEUED, RUNNING)
+                ).fetchone()
+                waiting = self._conn.execute(
+                    "SELECT count(*) FROM jobs WHERE queue = ? AND status = ?", (self.name, QUEUED)
+                ).fetchone()[0]
+                job = None
+                if row is None and waiting < self.max_depth:
+                    job = Job(key)
+                    self._conn.execute(
+                        "INSERT INTO jobs (job_id, queue, key, status, created) VALUES (?, ?, ?, ?, ?)",
+                        (job.id, self.name, key, job.status, job.created)
+                    )
+                    self._jobs[job.id] = job
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            if row is not None:
+                JOBS.inc(queue=self.name, result="deduplicated")
+                return self._jobs.get(row[0]) or self._load(row[0]), True
+        if job is None:
+            JOBS.inc(queue=self.name, result="rejected")
+            return None, False
+        JOBS.inc(queue=self.name, result="queued")
+        self._executor.submit(self._run, job, func, args)
+        logger.debug("Queued %s job %s, %s waiting", self.name, job.id, waiting + 1)
+        return job, False
+
+    def _run(self, job, func, args):
+        self._current.job = job
+        try:
+            with self._changed:
+                job.status = RUNNING
+                job.started = time.time()
+                self._changed.notify_all()
+                self._save(job)
+            JOB_SECONDS.observe(job.started - job.created, queue=self.name, stage="wait")
+            result, error, status = func(*args), None, DONE
+        except Exception as e:
+            logger.exception("%s job %s failed: %s", self.name, job.id, e)
+            result, error, status = None, str(e), FAILED
+        finally:
+            self._current.job = None
+        self._finish(job, result, error, status)
+
+    def _finish(self, job, result, error, status):
+        """Record the outcome of a job; one that cannot be stored (e.g. a result that is not JSON) fails the job"""
+        with self._changed:
+            job.result, job.error, job.status = result, error, status
+            job.finished = time.time()
+            try:
+                self._save(job)
+            except Exception as e:
+                logger.exception("Could not store %s job %s: %s", self.name, job.id, e)
+                job.result, job.error, job.status = None, f"Could not store the job result: {e}", FAILED
+                try:
+                    self._save(job)
+                except Exception:
+                    # Left to _prune, which fails it once lost_after has passed
+                    logger.exception("Could not mark %s job %s failed", self.name, job.id)
+            finally:
+                self._changed.notify_all()
+        JOB_SECONDS.observe(job.finished - job.started, queue=self.name, stage="run")
+        JOBS.inc(queue=self.name, result=job.status)
+
+    def publish(self, event, data):
+        """Record a progress event (e.g. a streamed token) of the job running on the calling worker thread"""
+        job = getattr(self._current, "job", None)
+        if job is None:
+            return
+        with self._changed:
+            self._conn.execute(
+                "INSERT INTO job_events (job_id, seq, event, data) VALUES (?, ?, ?, ?)",
+                (job.id, len(job.events), event, json.dumps(data))
+            )
+            job.events.append((event, data))
+            self._changed.notify_all()
+
+    def _save(self, job):
+        """Write a local job's status to the database; the caller holds the lock"""
+        self._conn.execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, started = ?, finished = ? WHERE job_id = ?",
+            (job.status, json.dumps(job.result), job.error, job.started, job.finished, job.id)
+        )
+
+    def _load(self, job_id, job=None):
+        """A job as stored, refreshed into job if given, or None when unknown; the caller holds the lock"""
+        row = self._conn.execute(
+            "SELECT key, status, result, error, created, started, finished FROM jobs WHERE job_id = ? AND queue = ?",
+            (job_id, self.name)
+        ).fetchone()
+        if row is None:
+            return None
+        key, status, result, error, created, started, finished = row
+        job = job or Job(key, job_id, created)
+        job.status, job.error, job.started, job.finished = status, error, started, finished
+        job.result = json.loads(result) if result else None
+        return job
+
+    def _load_events(self, job, after):
+        """Stored events of a job from position after on; the caller holds the lock"""
+        rows = self._conn.execute(
+            "SELECT event, data FROM job_events WHERE job_id = ? AND seq >= ? ORDER BY seq", (job.id, after)
+        ).fetchall()
+        return [(event, json.loads(data)) for event, data in rows]
+
+    def _prune(self):
+        """Fail lost jobs and forget finished ones older than result_ttl; the caller holds the lock"""
+        now = time.time()
+        self._conn.execute(
+            "UPDATE jobs SET status = ?, error = ?, finished = ? WHERE queue = ? AND status IN (?, ?) AND created < ?",
+            (FAILED, "The job did not finish in time", now, self.name, QUEUED, RUNNING, now - self.lost_after)
+        )
+        cutoff = now - self.result_ttl
+        self._conn.execute(
+            "DELETE FROM job_events WHERE job_id IN "
+            "(SELECT job_id FROM jobs WHERE queue = ? AND status IN (?, ?) AND finished < ?)",
+            (self.name, DONE, FAILED, cutoff)
+        )
+        self._conn.execute(
+            "DELETE FROM jobs WHERE queue = ? AND status IN (?, ?) AND finished < ?", (self.name, DONE, FAILED, cutoff)
+        )
+        expired = [job_id for job_id, job in self._jobs.items() if job.status in FINISHED and job.finished < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        with self._lock:
+            self._prune()
+            return self._jobs.get(job_id) or self._load(job_id)
+
+    def wait(self, job, seen_status=None, timeout=None):
+        """Block until the job's status differs from seen_status (default: until it finishes) or timeout; returns the status"""
+        return self.wait_events(job, None, seen_status, timeout)[1]
+
+    def wait_events(self, job, after=None, seen_status=None, timeout=None):
+        """
+        Block until the job has published more than after events, its status differs from
+        seen_status (default: until it finishes) or timeout; timeout 0 only looks.
+
+        Returns:
+            tuple: (the (event, data) pairs published from position after on, [] when after is None; status)
+        """
+        def changed():
+            if after is not None and len(job.events) > after:
+                return True
+            return job.status in FINISHED if seen_status is None else job.status != seen_status
+
+        def result():
+            return (job.events[after:] if after is not None else []), job.status
+
+        with self._changed:
+            if self._jobs.get(job.id) is job:
+                self._changed.wait_for(changed, timeout)
+                return result()
+
+        # Run by another process (or no longer retained here): poll the database
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                if self._load(job.id, job) is None:
+                    job.status, job.error = FAILED, "Unknown or expired job"
+                if after is not None:
+                    job.events[after:] = self._load_events(job, after)
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if changed() or (remaining is not None and remaining <= 0):
+                return result()
+            time.sleep(REMOTE_POLL_INTERVAL if remaining is None else min(REMOTE_POLL_INTERVAL, remaining))
+
+    def snapshot(self, job):
+        """JSON-serializable view of a job for the polling endpoints"""
+        with self._lock:
+            if self._jobs.get(job.id) is not job:
+                self._load(job.id, job)
+            view = {
+                "job_id": job.id,
+                "status": job.status,
+                "created": job.created,
+                "started": job.started,
+                "finished": job.finished
+            }
+            if job.status == QUEUED:
+                view["position"] = self._conn.execute(
+                    "SELECT count(*) FROM jobs WHERE queue = ? AND status = ? AND created <= ?",
+                    (self.name, QUEUED, job.created)
+                ).fetchone()[0]
+            if job.status == DONE:
+                view["result"] = job.result
+            if job.status == FAILED:
+                view["error"] = job.error
+            return view
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._conn.execute(
+                "SELECT status, count(*) FROM jobs WHERE queue = ? GROUP BY status", (self.name,)
+            ).fetchall())
+            return {
+                "waiting": counts.get(QUEUED, 0),
+                "in_flight": counts.get(QUEUED, 0) + counts.get(RUNNING, 0),
+                "retained": sum(counts.values()),
+                "local": len(self._jobs),
+                "max_depth": self.max_depth
+            }
+
+
+# Recommendation pipeline runs behind POST /generate_recommendation and /generate_recommendation_stream
+recommendation_jobs = JobQueue(
+    "recommendation", settings.RECOMMENDATION_WORKERS, settings.RECOMMENDATION_QUEUE_DEPTH,
+    settings.RECOMMENDATION_RESULT_TTL, settings.JOB_DB_PATH, settings.RECOMMENDATION_JOB_TIMEOUT
+)
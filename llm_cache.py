@@ -0,0 +1,137 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from config import settings
+from metrics import CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"[ \t\r\f\v]+")
+
+
+def normalize_input(value):
+    """Whitespace-insensitive form of a prompt input, so trivially different answers share an entry"""
+    if isinstance(value, str):
+        lines = (_WHITESPACE.sub(" ", line).strip() for line in value.splitlines())
+        return "\n".join(line for line in lines if line)
+    if isinstance(value, (list, tuple)):
+        return [normalize_input(item) for item in value]
+    return value
+
+
+def model_name(llm):
+    return getattr(llm, "model", None) or type(llm).__name__
+
+
+class LLMMemoCache:
+    """Disk-backed LRU memo of LLM responses, keyed on model, prompt template and normalized inputs"""
+
+    def __init__(self, path, max_entries=1000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS memo (key TEXT PRIMARY KEY, value TEXT NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS memo_last_used ON memo (last_used)")
+            self._conn.commit()
+
+    @property
+    def enabled(self):
+        return self._conn is not None and self.max_entries > 0
+
+    @staticmethod
+    def make_key(prompt, llm, inputs):
+        payload = {
+            "model": model_name(llm),
+            "template": getattr(prompt, "template", str(prompt)),
+            "inputs": {name: normalize_input(value) for name, value in sorted(inputs.items())}
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM memo WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                CACHE_REQUESTS.inc(cache="llm", result="miss")
+                return None
+            self._conn.execute("UPDATE memo SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self.hits += 1
+            CACHE_REQUESTS.inc(cache="llm", result="hit")
+            return row[0]
+
+    def put(self, key, value):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO memo (key, value, last_used) VALUES (?, ?, ?)",
+                (key, value, time.time())
+            )
+            # Evict the least recently used entries beyond the size limit
+            self._conn.execute(
+                "DELETE FROM memo WHERE key IN (SELECT key FROM memo ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self._conn.commit()
+
+    def invoke(self, prompt, llm, inputs):
+        """(prompt | llm).invoke(inputs), answered from the memo when the same call was made before"""
+        if not self.enabled:
+            return (prompt | llm).invoke(inputs)
+        key = self.make_key(prompt, llm, inputs)
+        cached = self.get(key)
+        if cached is not None:
+            logger.debug("LLM memo hit (%s)", model_name(llm))
+            return cached
+        response = (prompt | llm).invoke(inputs)
+        if response:
+            self.put(key, response)
+        return response
+
+    async def ainvoke(self, prompt, llm, inputs):
+        """Async variant of invoke; the SQLite lookups run off the event loop"""
+        if not self.enabled:
+            return await (prompt | llm).ainvoke(inputs)
+        key = self.make_key(prompt, llm, inputs)
+        cached = await asyncio.to_thread(self.get, key)
+        if cached is not None:
+            logger.debug("LLM memo hit (%s)", model_name(llm))
+            return cached
+        response = await (prompt | llm).ainvoke(inputs)
+        if response:
+            await asyncio.to_thread(self.put, key, response)
+        return response
+
+    def clear(self):
+        if self._conn is not None:
+            with self._lock:
+                self._conn.execute("DELETE FROM memo")
+                self._conn.commit()
+
+    def stats(self):
+        size = 0
+        if self._conn is not None:
+            with self._lock:
+                size = self._conn.execute("SELECT COUNT(*) FROM memo").fetchone()[0]
+        return {"path": self.path, "size": size, "max_entries": self.max_entries, "hits": self.hits, "misses": self.misses}
+
+
+# Shared by app.py and insurance_recommender.py, so a profile generated during the
+# conversation is reused when the recommendation is requested
+llm_cache = LLMMemoCache(settings.LLM_CACHE_PATH, settings.LLM_CACHE_MAX_ENTRIES)
@@ -0,0 +1,51 @@
+# Count-only retrieval results: how many clauses match a query and how their scores are
+# distributed per policy, without the clause texts.
+#
+#   {"total": 512, "bins": [0.5, 1.0, ...],
+#    "policies": {"Chubb - Chubb Elite V ...": {"matches": 130, "max_score": 7.9, "histogram": [12, 40, ...]}}}
+#
+# histogram[0] counts scores below bins[0], histogram[i] scores in [bins[i-1], bins[i]) and the
+# last entry scores of at least bins[-1].
+
+# Lucene's full-text index and the local index both score with BM25, so one set of edges fits both
+SCORE_BINS = (0.5, 1.0, 2.0, 4.0, 8.0, 16.0)
+
+
+def empty_match_stats(bins=SCORE_BINS):
+    return {"total": 0, "bins": list(bins), "policies": {}}
+
+
+def histogram_index(score, bins=SCORE_BINS):
+    for i, edge in enumerate(bins):
+        if score < edge:
+            return i
+    return len(bins)
+
+
+def summarize_scores(pairs, bins=SCORE_BINS):
+    """Match stats from (source, score) pairs"""
+    stats = empty_match_stats(bins)
+    policies = stats["policies"]
+    for source, score in pairs:
+        policy = policies.get(source)
+        if policy is None:
+            policy = policies[source] = {"matches": 0, "max_score": score, "histogram": [0] * (len(bins) + 1)}
+        policy["matches"] += 1
+        policy["max_score"] = max(policy["max_score"], score)
+        policy["histogram"][histogram_index(score, bins)] += 1
+        stats["total"] += 1
+    return stats
+
+
+def stats_from_rows(rows, bins=SCORE_BINS):
+    """Match stats from (source, matches, max_score, histogram) rows aggregated by the backend"""
+    stats = empty_match_stats(bins)
+    for source, matches, max_score, histogram in rows:
+        stats["policies"][source] = {"matches": matches, "max_score": max_score, "histogram": list(histogram)}
+        stats["total"] += matches
+    return stats
+
+
+def stats_from_chunks(chunks, bins=SCORE_BINS):
+    """Match stats of already retrieved chunks, for backends without a count-only query"""
+    return summarize_scores(((chunk.get("source", ""), chunk.get("score") or 0.0) for chunk in chunks or []), bins)
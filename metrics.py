@@ -0,0 +1,240 @@
+import functools
+import inspect
+import threading
+import time
+from langchain_core.callbacks import BaseCallbackHandler
+from config import settings
+from context_builder import estimate_tokens
+
+# Histogram buckets: seconds for latencies, counts for rows and tokens
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+ROW_BUCKETS = (0, 1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+TOKEN_BUCKETS = (16, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+            lines.extend(self._render_series(key, value) for key, value in items)
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        if not settings.METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _render_series(self, key, value):
+        return f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Histogram(Metric):
+    """Cumulative-bucket histogram in the Prometheus text exposition format"""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        if not settings.METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def time(self, **labels):
+        """Context manager observing the seconds spent in its block"""
+        return _Timer(self, labels)
+
+    def _render_series(self, key, series):
+        bucket_counts, total, count = series
+        lines = []
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), bucket_counts + [count]):
+            le = 'le="{}"'.format("+Inf" if bound == float("inf") else _format_value(bound))
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {bucket_count}")
+        lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+        lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return "\n".join(lines)
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(name, documentation, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        return "\n".join(metric.render() for metric in self.metrics) + "\n"
+
+
+registry = Registry()
+
+REQUEST_SECONDS = registry.histogram(
+    "http_request_duration_seconds", "Latency of the Flask/Quart routes", ("method", "route", "status"))
+NODE_SECONDS = registry.histogram(
+    "graph_node_duration_seconds", "Latency of each LangGraph node", ("node",))
+LLM_SECONDS = registry.histogram(
+    "llm_request_duration_seconds", "Latency of each LLM invocation", ("model", "status"))
+LLM_TOKENS = registry.histogram(
+    "llm_tokens", "Prompt and completion tokens per LLM invocation", ("model", "kind"), TOKEN_BUCKETS)
+RETRIEVAL_SECONDS = registry.histogram(
+    "retrieval_duration_seconds", "Latency of each Bolt/HTTP retrieval round trip or local search", ("backend", "operation"))
+RETRIEVAL_ROWS = registry.histogram(
+    "retrieval_rows", "Rows or chunks returned per retrieval", ("backend", "operation"), ROW_BUCKETS)
+RETRIEVAL_ERRORS = registry.counter(
+    "retrieval_errors_total", "Retrievals that failed after every retry", ("backend", "operation"))
+CACHE_REQUESTS = registry.counter(
+    "cache_requests_total", "Lookups in the LLM memo and retrieval caches", ("cache", "result"))
+JOBS = registry.counter(
+    "jobs_total", "Background jobs queued, deduplicated, rejected, done or failed", ("queue", "result"))
+JOB_SECONDS = registry.histogram(
+    "job_duration_seconds", "Time background jobs wait for a worker and run", ("queue", "stage"))
+
+
+def timed(histogram, **labels):
+    """Decorate a sync or async function so each call is observed in histogram"""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with histogram.time(**labels):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with histogram.time(**labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_retrieval(backend, operation, seconds, rows):
+    RETRIEVAL_SECONDS.observe(seconds, backend=backend, operation=operation)
+    RETRIEVAL_ROWS.observe(rows, backend=backend, operation=operation)
+
+
+def observe_stream(rows, backend, operation):
+    """Pass rows through, recording the time until the stream ends and how many rows it had"""
+    start = time.perf_counter()
+    count = 0
+    try:
+        for row in rows:
+            count += 1
+            yield row
+    except Exception:
+        RETRIEVAL_ERRORS.inc(backend=backend, operation=operation)
+        raise
+    finally:
+        record_retrieval(backend, operation, time.perf_counter() - start, count)
+
+
+def route_label(request):
+    """The route pattern rather than the raw path, so the label set stays bounded"""
+    rule = getattr(request, "url_rule", None)
+    return rule.rule if rule is not None else "unmatched"
+
+
+class LLMMetricsCallback(BaseCallbackHandler):
+    """
+    LangChain callback timing each invocation of one LLM and counting its tokens.
+
+    Ollama reports prompt_eval_count / eval_count in the generation info; other models
+    (and streams that end early) fall back to the four-characters-per-token estimate.
+    """
+
+    # Only records numbers, so it is safe to run on the event loop for ainvoke/astream
+    run_inline = True
+
+    def __init__(self, model):
+        self.model = model
+        self._runs = {}
+        self._lock = threading.Lock()
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        with self._lock:
+            self._runs[run_id] = (time.perf_counter(), sum(estimate_tokens(prompt) for prompt in prompts))
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        with self._lock:
+            start, prompt_estimate = self._runs.pop(run_id, (None, 0))
+        if start is None:
+            return
+        LLM_SECONDS.observe(time.perf_counter() - start, model=self.model, status="ok")
+
+        generations = [generation for batch in response.generations for generation in batch]
+        info = (generations[0].generation_info or {}) if generations else {}
+        completion = "".join(generation.text for generation in generations)
+        LLM_TOKENS.observe(info.get("prompt_eval_count") or prompt_estimate, model=self.model, kind="prompt")
+        LLM_TOKENS.observe(info.get("eval_count") or estimate_tokens(completion), model=self.model, kind="completion")
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        with self._lock:
+            start, _ = self._runs.pop(run_id, (None, 0))
+        if start is not None:
+            LLM_SECONDS.observe(time.perf_counter() - start, model=self.model, status="error")
@@ -0,0 +1,338 @@
+import argparse
+import csv
+import hashlib
+import logging
+import os
+import re
+import time
+from multiprocessing import Pool
+from config import settings
+from clause_normalizer import ensure_normalized
+
+logger = logging.getLogger(__name__)
+
+# Output files and their headers, identical to the csv/ export loaded into Neo4j
+NODE_HEADERS = {
+    "nodes_policy.csv": ["policyId:ID(Policy)", "insurer", "policyName", "fileName", "jurisdiction", "versionDate", ":LABEL"],
+    "nodes_section.csv": ["sectionId:ID(Section)", "title", "sectionNumber", ":LABEL"],
+    "nodes_clause.csv": ["clauseId:ID(Clause)", "text", "clauseNumber", ":LABEL"],
+    "nodes_definition.csv": ["term:ID(Definition)", "definitionText", ":LABEL"],
+    "nodes_exclusion.csv": ["exclusionId:ID(Exclusion)", "exclusionText", "exclusionType", ":LABEL"],
+    "nodes_coverage.csv": ["coverageId:ID(Coverage)", "coverageName", "coverageText", ":LABEL"]
+}
+REL_HEADERS = {
+    "rels_has_section.csv": ["Policy", "Section"],
+    "rels_contains_clause.csv": ["Section", "Clause"],
+    "rels_policy_contains_clause.csv": ["Policy", "Clause"],
+    "rels_defines.csv": ["Clause", "Definition"],
+    "rels_has_definition.csv": ["Policy", "Definition"],
+    "rels_states_exclusion.csv": ["Clause", "Exclusion"],
+    "rels_has_exclusion.csv": ["Policy", "Exclusion"],
+    "rels_provides_coverage.csv": ["Clause", "Coverage"],
+    "rels_has_coverage.csv": ["Policy", "Coverage"]
+}
+REL_TYPES = {
+    "rels_has_section.csv": "HAS_SECTION",
+    "rels_contains_clause.csv": "CONTAINS_CLAUSE",
+    "rels_policy_contains_clause.csv": "CONTAINS_CLAUSE",
+    "rels_defines.csv": "DEFINES",
+    "rels_has_definition.csv": "HAS_DEFINITION",
+    "rels_states_exclusion.csv": "STATES_EXCLUSION",
+    "rels_has_exclusion.csv": "HAS_EXCLUSION",
+    "rels_provides_coverage.csv": "PROVIDES_COVERAGE",
+    "rels_has_coverage.csv": "HAS_COVERAGE"
+}
+
+# Insurer detected from the file name, first match wins
+INSURER_PATTERNS = [
+    ("agcs", "Allianz (AGCS)"),
+    ("allianz", "Allianz (AGCS)"),
+    ("chubb", "Chubb"),
+    ("qbe", "QBE"),
+    ("liberty", "Liberty"),
+    ("dragonshield", "AIG"),
+    ("aig", "AIG")
+]
+
+SOURCE_SUFFIXES = (".pdf.md", ".md", ".pdf")
+
+HEADING = re.compile(r"^\s{0,3}#{1,6}\s+(.*?)\s*#*\s*$")
+BOLD_LINE = re.compile(r"^\s*\*\*(.+?)\*\*:?\s*$")
+NUMBERING = re.compile(r"^\(?(\d+(?:\.\d+)*|[a-z]|[ivxlc]+)[.)]\s+", re.IGNORECASE)
+DEFINITION = re.compile(r"^[\"“']?([A-Z][A-Za-z0-9 ()/&\-’']{1,80}?)[\"”']?\s+(?:means|shall mean|includes)\b")
+WHITESPACE = re.compile(r"\s+")
+TERM_WORD = re.compile(r"[^\w()]+")
+
+# A PDF line is taken as a heading when it is short and has no sentence punctuation
+PDF_HEADING = re.compile(r"^(?:\d+(?:\.\d+)*\.?\s+)?[A-Z][^.;:,]{2,70}$")
+
+
+def short_hash(text):
+    return hashlib.md5(text.encode("utf-8")).hexdigest()[:8]
+
+
+def policy_name_for(file_name):
+    for suffix in SOURCE_SUFFIXES:
+        if file_name.lower().endswith(suffix):
+            return file_name[:-len(suffix)]
+    return file_name
+
+
+def insurer_for(file_name):
+    lowered = file_name.lower()
+    for pattern, insurer in INSURER_PATTERNS:
+        if pattern in lowered:
+            return insurer
+    return "Unknown"
+
+
+def policy_id_for(insurer, file_name, known_ids=None):
+    """
+    The policy's id in the existing export, looked up by policy name, else a new one in the same format.
+
+    The export's ids are not derived from the file or policy name, so a re-extraction must reuse
+    them to upsert the same Policy nodes instead of loading every policy a second time.
+    """
+    known = (known_ids or {}).get(policy_name_for(file_name))
+    if known:
+        return known
+    return f"pol_{insurer.lower().replace(' ', '')}_{short_hash(file_name)}"
+
+
+def read_policy_ids(csv_dir):
+    """{policy name: policyId} of the export in csv_dir; names come from fileName so .pdf and .pdf.md renditions agree"""
+    path = os.path.join(csv_dir, "nodes_policy.csv")
+    if not os.path.exists(path):
+        return {}
+    with open(path, newline="", encoding="utf-8") as f:
+        return {
+            policy_name_for(row["fileName"]): row["policyId:ID(Policy)"]
+            for row in csv.DictReader(f)
+            if row.get("fileName")
+        }
+
+
+def leading_number(text):
+    match = NUMBERING.match(text)
+    return match.group(1) if match else ""
+
+
+def definition_term(text):
+    """Definition key in the export's style: the first three words, upper-cased, joined by underscores"""
+    words = [word for word in TERM_WORD.split(text.upper()) if word]
+    return "_".join(words[:3])
+
+
+def pdf_to_markdown(file_path):
+    """Extract page text from a PDF and mark likely headings, so it parses like a .pdf.md rendition"""
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        raise RuntimeError("Extracting .pdf files requires pypdf (pip install pypdf); .pdf.md renditions do not")
+
+    lines = []
+    for page in PdfReader(file_path).pages:
+        for line in (page.extract_text() or "").splitlines():
+            line = line.strip()
+            if not line:
+                lines.append("")
+            elif PDF_HEADING.match(line) and len(line.split()) <= 10:
+                lines.extend(["", f"## {line}", ""])
+            else:
+                lines.append(line)
+        # Page boundary, rendered the same way as in the .pdf.md files
+        lines.extend(["", "---", ""])
+    return "\n".join(lines)
+
+
+def parse_blocks(markdown):
+    """Yield ("section", title) and ("clause", text) items in document order"""
+    block = []
+
+    def flush():
+        text = WHITESPACE.sub(" ", " ".join(block)).strip()
+        block.clear()
+        return text
+
+    for line in markdown.splitlines():
+        heading = HEADING.match(line) or BOLD_LINE.match(line)
+        if heading:
+            text = flush()
+            if text:
+                yield "clause", text
+            title = WHITESPACE.sub(" ", heading.group(1).strip("* ")).strip()
+            if title:
+                yield "section", title
+        elif not line.strip():
+            text = flush()
+            if text:
+                yield "clause", text
+        else:
+            # List items directly after their lead-in sentence stay in the same clause
+            block.append(line.strip())
+    text = flush()
+    if text:
+        yield "clause", text
+
+
+def extract_policy(args):
+    """
+    Turn one policy document into CSV rows.
+
+    Runs in a worker process; returns {csv file name: [row, ...]} for this policy only,
+    so the parent can stream them to disk and drop them.
+    """
+    file_path, jurisdiction, known_ids = args
+    file_name = os.path.basename(file_path)
+    if file_name.lower().endswith(".pdf") and not file_name.lower().endswith(".pdf.md"):
+        markdown = pdf_to_markdown(file_path)
+    else:
+        with open(file_path, encoding="utf-8") as f:
+            markdown = f.read()
+
+    insurer = insurer_for(file_name)
+    policy_name = policy_name_for(file_name)
+    policy_id = policy_id_for(insurer, file_name, known_ids)
+    rows = {name: [] for name in list(NODE_HEADERS) + list(REL_HEADERS)}
+    rows["nodes_policy.csv"].append([policy_id, insurer, policy_name, file_name, jurisdiction, "", "Policy"])
+
+    seen_ids = set()
+
+    def unique_id(prefix, key):
+        entity_id = f"{prefix}_{policy_id}_{short_hash(key)}"
+        counter = 1
+        while entity_id in seen_ids:
+            entity_id = f"{prefix}_{policy_id}_{short_hash(f'{key}#{counter}')}"
+            counter += 1
+        seen_ids.add(entity_id)
+        return entity_id
+
+    def add_relationship(csv_name, start, end):
+        rows[csv_name].append([start, end, REL_TYPES[csv_name]])
+
+    section_id = None
+    section_title = ""
+    clauses_in_section = 0
+    for kind, text in parse_blocks(markdown):
+        if kind == "section" or section_id is None:
+            section_title = text if kind == "section" else policy_name
+            section_id = unique_id("sec", section_title)
+            clauses_in_section = 0
+            rows["nodes_section.csv"].append([section_id, section_title, leading_number(section_title), "Section"])
+            add_relationship("rels_has_section.csv", policy_id, section_id)
+            if kind == "section":
+                continue
+
+        clause_id = unique_id("cl", f"{section_id}\n{text}")
+        rows["nodes_clause.csv"].append([clause_id, text, leading_number(text), "Clause"])
+        add_relationship("rels_contains_clause.csv", section_id, clause_id)
+        add_relationship("rels_policy_contains_clause.csv", policy_id, clause_id)
+        clauses_in_section += 1
+
+        lowered_title = section_title.lower()
+        definition = DEFINITION.match(text)
+        if "definition" in lowered_title and (definition or clauses_in_section == 1):
+            term_id = f"def_{policy_id}_{definition_term(text)}"
+            if term_id not in seen_ids:
+                seen_ids.add(term_id)
+                rows["nodes_definition.csv"].append([term_id, text, "Definition"])
+                add_relationship("rels_defines.csv", clause_id, term_id)
+                add_relationship("rels_has_definition.csv", policy_id, term_id)
+        elif "exclusion" in lowered_title and clauses_in_section == 1:
+            # The lead-in clause of an exclusions section states the exclusion
+            exclusion_id = unique_id("ex", text)
+            rows["nodes_exclusion.csv"].append([exclusion_id, text, "General", "Exclusion"])
+            add_relationship("rels_states_exclusion.csv", clause_id, exclusion_id)
+            add_relationship("rels_has_exclusion.csv", policy_id, exclusion_id)
+        elif "insuring" in lowered_title and clauses_in_section == 1:
+            coverage_id = unique_id("cov", text)
+            coverage_name = " ".join(text.split()[:5]) + "..."
+            rows["nodes_coverage.csv"].append([coverage_id, coverage_name, text, "Coverage"])
+            add_relationship("rels_provides_coverage.csv", clause_id, coverage_id)
+            add_relationship("rels_has_coverage.csv", policy_id, coverage_id)
+
+    return file_name, rows
+
+
+def find_sources(source_dir):
+    """Policy documents under source_dir, preferring the .pdf.md rendition when both exist"""
+    sources = {}
+    for root, _, names in os.walk(source_dir):
+        for name in sorted(names):
+            lowered = name.lower()
+            if not lowered.endswith(SOURCE_SUFFIXES):
+                continue
+            key = os.path.join(root, policy_name_for(name))
+            if key not in sources or lowered.endswith(".md"):
+                sources[key] = os.path.join(root, name)
+    return sorted(sources.values())
+
+
+def extract_directory(source_dir, out_dir=None, jurisdiction="Hong Kong SAR", workers=None, normalize=True):
+    """
+    Extract every policy document in source_dir into the csv/ node and relationship files.
+
+    Documents are parsed in a process pool; each finished policy is appended to the output
+    files straight away, so memory stays bounded by the largest single policy. The files
+    are written next to their targets and renamed into place only when every policy succeeded.
+    Policies already in out_dir keep their policyId, matched by file name.
+    Unless normalize is False, the cleaned copy that indexing and loading read is then written
+    to out_dir/normalized by clause_normalizer; the extracted files are left as they are.
+    """
+    out_dir = out_dir or settings.GRAPH_CSV_DIR
+    workers = workers or settings.EXTRACT_WORKERS or os.cpu_count() or 1
+    os.makedirs(out_dir, exist_ok=True)
+    start = time.perf_counter()
+
+    sources = find_sources(source_dir)
+    known_ids = read_policy_ids(out_dir)
+    handles = {}
+    writers = {}
+    counts = {}
+    try:
+        for name in list(NODE_HEADERS) + list(REL_HEADERS):
+            handles[name] = open(os.path.join(out_dir, f"{name}.tmp"), "w", newline="", encoding="utf-8")
+            writers[name] = csv.writer(handles[name])
+            if name in NODE_HEADERS:
+                writers[name].writerow(NODE_HEADERS[name])
+            else:
+                start_label, end_label = REL_HEADERS[name]
+                writers[name].writerow([f":START_ID({start_label})", f":END_ID({end_label})", ":TYPE"])
+            counts[name] = 0
+
+        with Pool(processes=workers) as pool:
+            for file_name, rows in pool.imap_unordered(extract_policy, [(path, jurisdiction, known_ids) for path in sources]):
+                for name, file_rows in rows.items():
+                    writers[name].writerows(file_rows)
+                    counts[name] += len(file_rows)
+                logger.debug("Extracted %s clauses from %s", len(rows['nodes_clause.csv']), file_name)
+    except Exception:
+        # Leave the previous export untouched
+        for name, handle in handles.items():
+            handle.close()
+            os.remove(os.path.join(out_dir, f"{name}.tmp"))
+        raise
+    finally:
+        for handle in handles.values():
+            handle.close()
+
+    for name in handles:
+        os.replace(os.path.join(out_dir, f"{name}.tmp"), os.path.join(out_dir, name))
+
+    logger.info("Extracted %s policies into %s in %.1f s: %s",
+                len(sources), out_dir, time.perf_counter() - start, counts)
+    if normalize:
+        ensure_normalized(out_dir)
+    return counts
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s - %(name)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Extract policy PDFs or .pdf.md renditions into the csv/ graph export")
+    parser.add_argument("source_dir")
+    parser.add_argument("--out-dir", default=settings.GRAPH_CSV_DIR)
+    parser.add_argument("--jurisdiction", default="Hong Kong SAR")
+    parser.add_argument("--workers", type=int, default=settings.EXTRACT_WORKERS)
+    parser.add_argument("--no-normalize", action="store_true", help="Do not write the normalized copy of the clauses")
+    args = parser.parse_args()
+    extract_directory(args.source_dir, args.out_dir, args.jurisdiction, args.workers, normalize=not args.no_normalize)
@@ -0,0 +1,90 @@
+import asyncio
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class PolicyCatalog:
+    """In-memory list of available policies, loaded once and refreshed in the background"""
+
+    def __init__(self, loader, refresh_interval=600):
+        """
+        Args:
+            loader: Callable returning a list of policy dicts (at least "id" and "name")
+            refresh_interval: Seconds between background refreshes, 0 disables the refresh thread
+        """
+        self.loader = loader
+        self.refresh_interval = refresh_interval
+        self._policies = []
+        self._loaded_at = None
+        self._lock = threading.Lock()
+        self._refresh_thread = None
+
+    def refresh(self):
+        """Reload the catalog from the backend; keeps the previous list if the load fails or is empty"""
+        start = time.perf_counter()
+        try:
+            policies = self.loader()
+        except Exception as e:
+            logger.warning("Exception refreshing policy catalog: %s", e)
+            return False
+
+        if not policies:
+            logger.debug("Policy catalog refresh returned no policies, keeping previous list")
+            return False
+
+        with self._lock:
+            self._policies = [
+                {
+                    "id": policy.get("id"),
+                    "name": policy.get("name", ""),
+                    "insurer": policy.get("insurer", ""),
+                    "jurisdiction": policy.get("jurisdiction", "")
+                }
+                for policy in policies
+                if isinstance(policy, dict) and policy.get("id")
+            ]
+            self._loaded_at = time.time()
+        logger.debug("Policy catalog loaded %s policies in %.1f ms",
+              len(self._policies), (time.perf_counter() - start) * 1000)
+        return True
+
+    def invalidate(self):
+        """Force a reload on next access, e.g. after the graph has been reloaded"""
+        with self._lock:
+            self._loaded_at = None
+
+    def _ensure_loaded(self):
+        if self._loaded_at is None:
+            self.refresh()
+        if self.refresh_interval > 0 and self._refresh_thread is None:
+            with self._lock:
+                if self._refresh_thread is None:
+                    self._refresh_thread = threading.Thread(target=self._refresh_loop, name="policy-catalog-refresh", daemon=True)
+                    self._refresh_thread.start()
+
+    def _refresh_loop(self):
+        while True:
+            time.sleep(self.refresh_interval)
+            self.refresh()
+
+    def get_datasets(self, name=None):
+        """Same shape as the backend get_datasets, served from memory"""
+        self._ensure_loaded()
+        with self._lock:
+            policies = self._policies
+        return [dict(policy) for policy in policies if name is None or name in (policy["name"] or "")]
+
+    def dataset_ids(self):
+        self._ensure_loaded()
+        with self._lock:
+            return [policy["id"] for policy in self._policies]
+
+    async def dataset_ids_async(self):
+        """dataset_ids() for the event loop: a load (a blocking backend query with retries) runs in a thread"""
+        if self._loaded_at is None or (self.refresh_interval > 0 and self._refresh_thread is None):
+            return await asyncio.to_thread(self.dataset_ids)
+        with self._lock:
+            return [policy["id"] for policy in self._policies]
@@ -0,0 +1,417 @@
+import argparse
+import csv
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from config import settings
+from context_builder import clause_key, estimate_tokens, normalize_for_dedup
+
+logger = logging.getLogger(__name__)
+
+# Digests are built from the same CSV export the graph is loaded from and stored next to it
+POLICY_FILE = "nodes_policy.csv"
+CLAUSE_FILE = "nodes_clause.csv"
+DIGEST_FILE = "policy_digests.json"
+
+# Digest section -> (node file, Policy relationship file, text column, Clause relationship file)
+DIGEST_SECTIONS = {
+    "coverages": ("nodes_coverage.csv", "rels_has_coverage.csv", "coverageText", "rels_provides_coverage.csv"),
+    "exclusions": ("nodes_exclusion.csv", "rels_has_exclusion.csv", "exclusionText", "rels_states_exclusion.csv"),
+    "definitions": ("nodes_definition.csv", "rels_has_definition.csv", "definitionText", "rels_defines.csv")
+}
+
+# Bump when the digest layout or the extraction rules change; older digests are then ignored
+DIGEST_VERSION = 3
+
+MAX_ITEMS = 25
+MAX_ITEM_CHARS = 160
+# A digest with fewer items, or without any coverage, is not built; its policy keeps its clauses
+MIN_ITEMS = 5
+
+_TABLE_ROW = re.compile(r"\|\s+\|")
+_TABLE_RULE = re.compile(r"^-{3,}$")
+_PAGE_BREAK = re.compile(r"\s*-{3,}\s*")
+_LEADER_DOTS = re.compile(r"\.{3,}")
+_WHITESPACE = re.compile(r"\s+")
+_SENTENCE = re.compile(r"(?<=[.;])\s+(?=(?:\d+\.\s+)?(?:[A-Z]\.\s+)?[A-Z(])")
+_NUMBERING = re.compile(r"^(?:[-•]\s*|(?:\d+(?:\.\d+)*\.?|\((?:[ivx]+|[a-z])\)|[A-Z]\.)(?:\s+|$))")
+_PAGE_NUMBER = re.compile(r"^[\d.()ivx]+$")
+_DEFINED_TERM = re.compile(r"^(.{2,60}?)\s+means\b:?\s*(.*)$")
+
+csv.field_size_limit(10 * 1024 * 1024)
+
+
+def _id_column(fieldnames, suffix):
+    return next(column for column in fieldnames if column.startswith(suffix) or f"{suffix}(" in column)
+
+
+def read_policy_sources(csv_dir):
+    """
+    Every policy with the texts of its Coverage, Exclusion and Definition nodes.
+
+    Follows the HAS_COVERAGE, HAS_EXCLUSION and HAS_DEFINITION relationship files, so the
+    result matches what `MATCH (p:Policy)-[:HAS_COVERAGE]->(c)` etc. return once loaded.
+    The clauses behind those nodes (PROVIDES_COVERAGE, STATES_EXCLUSION, DEFINES) are listed
+    with the positions of the nodes they state, so a digest knows which clauses it summarises.
+
+    Returns:
+        dict: {policyId: {"policy": {...}, "coverages": [text, ...], "exclusions": [...], "definitions": [...],
+               "clauses": {section: [[clause text, [node position, ...]], ...]}}}
+    """
+    sources = {}
+    with open(os.path.join(csv_dir, POLICY_FILE), newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            policy_id = row["policyId:ID(Policy)"]
+            sources[policy_id] = {
+                "policy": {
+                    "id": policy_id,
+                    "name": row.get("policyName", ""),
+                    "insurer": row.get("insurer", ""),
+                    "jurisdiction": row.get("jurisdiction", ""),
+                    "version_date": row.get("versionDate", "")
+                },
+                **{section: [] for section in DIGEST_SECTIONS},
+                "clauses": {section: [] for section in DIGEST_SECTIONS}
+            }
+
+    node_positions = {}  # (section, node id) -> [(policyId, position in its section list), ...]
+    for section, (node_file, rel_file, text_column, _) in DIGEST_SECTIONS.items():
+        node_path = os.path.join(csv_dir, node_file)
+        rel_path = os.path.join(csv_dir, rel_file)
+        if not (os.path.exists(node_path) and os.path.exists(rel_path)):
+            continue
+
+        owners = defaultdict(list)
+        with open(rel_path, newline="", encoding="utf-8") as f:
+            reader = csv.DictReader(f)
+            start_column = _id_column(reader.fieldnames, ":START_ID")
+            end_column = _id_column(reader.fieldnames, ":END_ID")
+            for row in reader:
+                if row[start_column] in sources:
+                    owners[row[end_column]].append(row[start_column])
+
+        # Node file order is document order, which the digest keeps
+        with open(node_path, newline="", encoding="utf-8") as f:
+            reader = csv.DictReader(f)
+            id_column = _id_column(reader.fieldnames, ":ID")
+            for row in reader:
+                for policy_id in owners.get(row[id_column], ()):
+                    node_positions.setdefault((section, row[id_column]), []).append(
+                        (policy_id, len(sources[policy_id][section]))
+                    )
+                    sources[policy_id][section].append(row.get(text_column) or "")
+
+    clause_nodes = defaultdict(list)  # clause id -> [(section, node id), ...]
+    for section, (_, _, _, clause_rel_file) in DIGEST_SECTIONS.items():
+        clause_rel_path = os.path.join(csv_dir, clause_rel_file)
+        if not os.path.exists(clause_rel_path):
+            continue
+        with open(clause_rel_path, newline="", encoding="utf-8") as f:
+            reader = csv.DictReader(f)
+            start_column = _id_column(reader.fieldnames, ":START_ID")
+            end_column = _id_column(reader.fieldnames, ":END_ID")
+            for row in reader:
+                if (section, row[end_column]) in node_positions:
+                    clause_nodes[row[start_column]].append((section, row[end_column]))
+
+    clause_path = os.path.join(csv_dir, CLAUSE_FILE)
+    if clause_nodes and os.path.exists(clause_path):
+        with open(clause_path, newline="", encoding="utf-8") as f:
+            reader = csv.DictReader(f)
+            id_column = _id_column(reader.fieldnames, ":ID")
+            for row in reader:
+                stated = defaultdict(list)  # (policyId, section) -> node positions
+                for section, node_id in clause_nodes.get(row[id_column], ()):
+                    for policy_id, position in node_positions[(section, node_id)]:
+                        stated[(policy_id, section)].append(position)
+                for (policy_id, section), positions in stated.items():
+                    sources[policy_id]["clauses"][section].append([row.get("text") or "", positions])
+    return sources
+
+
+def source_hash(source):
+    """Hash of everything a digest is built from; a changed policy gets a new hash"""
+    payload = json.dumps(source, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def _clean(text):
+    text = _LEADER_DOTS.sub(" ", text or "")
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def _strip_numbering(text):
+    previous = None
+    while text != previous:
+        previous = text
+        text = _NUMBERING.sub("", text).strip()
+    return text
+
+
+def _shorten(text, limit=MAX_ITEM_CHARS):
+    if len(text) <= limit:
+        return text
+    return text[:limit].rsplit(" ", 1)[0].rstrip(",;:") + "..."
+
+
+def _items(text):
+    """
+    Split one node's text into short statements.
+
+    Markdown tables (the insuring agreement and extension lists) give one statement per row
+    with page and clause numbers dropped; prose gives one statement per sentence.
+    Lead-in sentences ending in ":" only introduce a list and are left out.
+    """
+    text = _clean(text)
+    if "|" in text:
+        items = []
+        for row in _TABLE_ROW.split(text):
+            cells = []
+            for cell in row.split("|"):
+                cell = _strip_numbering(_PAGE_BREAK.sub(" ", cell).strip())
+                if cell and not _PAGE_NUMBER.match(cell) and not _TABLE_RULE.match(cell) and cell not in cells:
+                    cells.append(cell)
+            if cells:
+                items.append(" - ".join(cells))
+    else:
+        items = [_strip_numbering(sentence) for sentence in _SENTENCE.split(_PAGE_BREAK.sub(" ", text))]
+    return [item for item in items if item and not item.endswith(":")]
+
+
+def _definition(text):
+    """'TERM means ...' as 'TERM: ...', or None for fragments that continue an earlier definition"""
+    match = _DEFINED_TERM.match(_strip_numbering(_clean(text)))
+    if not match or not match.group(2) or match.group(2).endswith(":"):
+        return None
+    return f"{match.group(1)}: {match.group(2)}"
+
+
+def build_digest(source):
+    """
+    Compact structured digest of one policy, or None if its graph nodes yield too little.
+
+    "clauses" holds the clause_key() of every clause whose Coverage, Exclusion or Definition
+    node made it into the digest; only those clauses are replaced by the digest in a prompt.
+    """
+    policy = source["policy"]
+    # Running headers repeat the policy name (e.g. "QBE Commercial ... policy | DOLCML001-Q-0416 ---")
+    policy_name = policy["name"].lower()
+
+    digest = {
+        "version": DIGEST_VERSION,
+        "policy_id": policy["id"],
+        "source": f"{policy['insurer']} - {policy['name']}",
+        "jurisdiction": policy["jurisdiction"],
+        "source_hash": source_hash(source)
+    }
+    clauses = set()
+    for section in DIGEST_SECTIONS:
+        items = []
+        seen = {}  # dedup key -> position in items
+        kept_nodes = set()
+        for position, text in enumerate(source[section]):
+            candidates = [_definition(text)] if section == "definitions" else _items(text)
+            for item in candidates:
+                if not item or item.lower() in policy_name:
+                    continue
+                key = normalize_for_dedup(item)
+                if key not in seen:
+                    seen[key] = len(items)
+                    items.append(_shorten(item))
+                if seen[key] < MAX_ITEMS:
+                    kept_nodes.add(position)
+        digest[section] = items[:MAX_ITEMS]
+        for text, positions in source.get("clauses", {}).get(section, ()):
+            if kept_nodes.intersection(positions):
+                clauses.add(clause_key(text))
+    digest["clauses"] = sorted(clauses)
+
+    if not digest["coverages"] or sum(len(digest[section]) for section in DIGEST_SECTIONS) < MIN_ITEMS:
+        return None
+    return digest
+
+
+def format_digest(digest):
+    """Render a digest as the recommendation prompt sees it"""
+    lines = [f"Policy: {digest['source']}"]
+    if digest.get("jurisdiction"):
+        lines.append(f"Jurisdiction: {digest['jurisdiction']}")
+    for section, heading in (("coverages", "Coverage"), ("exclusions", "Exclusions"), ("definitions", "Key definitions")):
+        if digest.get(section):
+            lines.append(f"{heading}:")
+            lines.extend(f"- {item}" for item in digest[section])
+    return "\n".join(lines) + "\n"
+
+
+class PolicyDigestStore:
+    """
+    Versioned per-policy coverage digests in DIGEST_FILE next to the CSV export.
+
+    `build()` is the offline batch job; readers get the formatted digests keyed by chunk
+    source ("insurer - policy name"). A digest whose policy changed since it was built
+    (different source hash) is dropped on read, so stale wording never reaches a prompt.
+    """
+
+    def __init__(self, csv_dir):
+        self.csv_dir = csv_dir
+        self.path = os.path.join(csv_dir, DIGEST_FILE)
+        self._stamp = None
+        self._by_source = {}
+        self._clauses = {}
+        self._lock = threading.Lock()
+
+    def source_files(self):
+        files = [POLICY_FILE]
+        for node_file, rel_file, _, clause_rel_file in DIGEST_SECTIONS.values():
+            files.extend((node_file, rel_file, clause_rel_file))
+        files.append(CLAUSE_FILE)
+        return [os.path.join(self.csv_dir, name) for name in files]
+
+    def stamp_sources(self):
+        """Size and mtime of every source CSV, used to spot an export changed after the build"""
+        stamp = {}
+        for path in self.source_files():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            stamp[os.path.basename(path)] = [stat.st_size, int(stat.st_mtime)]
+        return stamp
+
+    def _read(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                payload = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.debug("No policy digests loaded from %s: %s", self.path, e)
+            return None
+        if payload.get("version") != DIGEST_VERSION:
+            logger.warning("Policy digests in %s are version %s, expected %s; run `python policy_digest.py` to rebuild them",
+                           self.path, payload.get("version"), DIGEST_VERSION)
+            return None
+        return payload
+
+    def build(self, force=False):
+        """
+        Rebuild the digests of new and changed policies and write DIGEST_FILE.
+
+        Args:
+            force: Rebuild every digest, even when its policy is unchanged
+
+        Returns:
+            tuple: (digests rebuilt, digests kept unchanged, policies without a usable digest)
+        """
+        start = time.perf_counter()
+        sources = read_policy_sources(self.csv_dir)
+        previous = {} if force else (self._read() or {}).get("digests", {})
+
+        digests = {}
+        rebuilt = kept = empty = 0
+        for policy_id, source in sources.items():
+            existing = previous.get(policy_id)
+            if existing and existing.get("source_hash") == source_hash(source):
+                digests[policy_id] = existing
+                kept += 1
+                continue
+            digest = build_digest(source)
+            if digest is None:
+                empty += 1
+                continue
+            digest["built_at"] = int(time.time())
+            digests[policy_id] = digest
+            rebuilt += 1
+
+        payload = {
+            "version": DIGEST_VERSION,
+            "source_stamp": self.stamp_sources(),
+            "digests": digests
+        }
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.path)
+        self.invalidate()
+
+        logger.info("Policy digests: %s rebuilt, %s unchanged, %s without usable nodes in %.1f ms",
+                    rebuilt, kept, empty, (time.perf_counter() - start) * 1000)
+        return rebuilt, kept, empty
+
+    def invalidate(self):
+        """Force a reload on next access"""
+        with self._lock:
+            self._stamp = None
+
+    def _load(self):
+        payload = self._read()
+        if payload is None:
+            return {}, {}
+        digests = payload.get("digests", {})
+
+        # The export changed after the build: keep only digests of policies that did not
+        if payload.get("source_stamp") != self.stamp_sources():
+            current = {policy_id: source_hash(source) for policy_id, source in read_policy_sources(self.csv_dir).items()}
+            fresh = {
+                policy_id: digest for policy_id, digest in digests.items()
+                if current.get(policy_id) == digest.get("source_hash")
+            }
+            if len(fresh) < len(digests):
+                logger.warning("%s policy digests are stale and will not be used; run `python policy_digest.py` to rebuild them",
+                               len(digests) - len(fresh))
+            digests = fresh
+
+        return (
+            {digest["source"]: format_digest(digest) for digest in digests.values()},
+            {digest["source"]: frozenset(digest.get("clauses", ())) for digest in digests.values()}
+        )
+
+    def _refresh(self):
+        """Reload the digests when the export or DIGEST_FILE changed; the caller holds the lock"""
+        stamp = self.stamp_sources()
+        try:
+            stat = os.stat(self.path)
+            stamp[DIGEST_FILE] = [stat.st_size, stat.st_mtime_ns]
+        except OSError:
+            stamp[DIGEST_FILE] = None
+
+        if stamp != self._stamp:
+            try:
+                self._by_source, self._clauses = self._load() if stamp[DIGEST_FILE] else ({}, {})
+            except Exception as e:
+                logger.warning("Exception loading policy digests: %s", e)
+                self._by_source, self._clauses = {}, {}
+            self._stamp = stamp
+
+    def by_source(self):
+        """{chunk source: formatted digest} of every current digest; empty when none were built"""
+        with self._lock:
+            self._refresh()
+            return self._by_source
+
+    def clauses_by_source(self):
+        """{chunk source: set of clause_key()} of the clauses each current digest covers"""
+        with self._lock:
+            self._refresh()
+            return self._clauses
+
+
+policy_digests = PolicyDigestStore(settings.GRAPH_CSV_DIR)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s - %(name)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Build the per-policy coverage digests used by recommendations")
+    parser.add_argument("--csv-dir", default=settings.GRAPH_CSV_DIR)
+    parser.add_argument("--force", action="store_true", help="Rebuild every digest, not only changed policies")
+    parser.add_argument("--show", action="store_true", help="Print each digest as the recommendation prompt sees it")
+    args = parser.parse_args()
+
+    store = PolicyDigestStore(args.csv_dir)
+    store.build(force=args.force)
+    if args.show:
+        for text in store.by_source().values():
+            print(f"{text}({estimate_tokens(text)} tokens)\n")
@@ -0,0 +1,46 @@
+from config import settings
+
+
+def chunk_key(chunk):
+    """Identity of a retrieved chunk across queries: the same clause text of the same policy"""
+    return f"{chunk.get('source', '')}\x1f{chunk.get('content', '')}"
+
+
+def fuse_ranks(ranked_lists, k=None, limit=None):
+    """
+    Reciprocal rank fusion of best-first lists of hashable keys.
+
+    Each key scores the sum of 1 / (k + rank + 1) over the lists it appears in, so a key
+    ranked well by several sub-queries beats one ranked first by a single sub-query.
+
+    Returns:
+        list: (key, fused score, [indexes of the lists containing the key]) tuples, best first
+    """
+    k = settings.RRF_K if k is None else k
+    scores = {}
+    matched = {}
+    for list_index, keys in enumerate(ranked_lists):
+        for rank, key in enumerate(keys):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank + 1)
+            matched.setdefault(key, []).append(list_index)
+    ranked = sorted(scores, key=scores.get, reverse=True)
+    if limit is not None:
+        ranked = ranked[:limit]
+    return [(key, scores[key], matched[key]) for key in ranked]
+
+
+def fuse_chunks(ranked_chunks, k=None, limit=None):
+    """Fuse best-first chunk lists, one per sub-query; "score" becomes the fused score"""
+    chunks = {}
+    ranked_keys = []
+    for result in ranked_chunks:
+        keys = []
+        for chunk in result or []:
+            key = chunk_key(chunk)
+            chunks.setdefault(key, chunk)
+            keys.append(key)
+        ranked_keys.append(keys)
+    return [
+        dict(chunks[key], score=score, rrf_score=score, matched_queries=matched)
+        for key, score, matched in fuse_ranks(ranked_keys, k, limit)
+    ]
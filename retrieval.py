@@ -0,0 +1,29 @@
+from config import settings
+
+# Select the retrieval backend once at import time so callers stay backend-agnostic
+if settings.RETRIEVAL_BACKEND == "local":
+    from vector_search_local import document_retrieval, document_retrieval_multi, document_match_stats, get_datasets, policy_catalog
+elif settings.RETRIEVAL_BACKEND == "hybrid":
+    from vector_index import document_retrieval, document_retrieval_multi, document_match_stats
+    from vector_search_local import get_datasets, policy_catalog
+elif settings.RETRIEVAL_BACKEND == "ragflow":
+    from vector_search import (
+        document_retrieval, document_retrieval_async, document_retrieval_multi, document_retrieval_multi_async,
+        document_match_stats, document_match_stats_async, get_datasets, policy_catalog
+    )
+else:
+    from vector_search_neo4j import (
+        document_retrieval, document_retrieval_async, document_retrieval_multi, document_retrieval_multi_async,
+        document_match_stats, document_match_stats_async, get_datasets, policy_catalog
+    )
+
+if settings.RETRIEVAL_BACKEND in ("local", "hybrid"):
+    async def document_retrieval_async(*args, **kwargs):
+        # The in-process indexes do no I/O and score in about a millisecond, so they run inline
+        return document_retrieval(*args, **kwargs)
+
+    async def document_retrieval_multi_async(*args, **kwargs):
+        return document_retrieval_multi(*args, **kwargs)
+
+    async def document_match_stats_async(*args, **kwargs):
+        return document_match_stats(*args, **kwargs)
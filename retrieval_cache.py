@@ -0,0 +1,159 @@
+import functools
+import inspect
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from metrics import CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+
+# Every cache created in this process, so a graph reload can clear them all at once
+_caches = []
+
+
+def normalize_query(query):
+    """Case- and whitespace-insensitive form of a query, used as part of the cache key"""
+    return _WHITESPACE.sub(" ", (query or "").lower()).strip()
+
+
+def copy_chunks(chunks):
+    """Copies of retrieved chunk dicts (and their list values), so callers that edit a result never change the cached one"""
+    return [{key: list(value) if isinstance(value, list) else value for key, value in chunk.items()} for chunk in chunks]
+
+
+class RetrievalCache:
+    """Thread-safe LRU cache with per-entry TTL for document_retrieval results"""
+
+    def __init__(self, name, max_size=256, ttl=300):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, chunks)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        _caches.append(self)
+
+    @staticmethod
+    def make_key(dataset_ids, query, similarity_threshold, vector_similarity_weight, top_k):
+        if isinstance(dataset_ids, str):
+            dataset_ids = [dataset_ids]
+        return (
+            normalize_query(query),
+            tuple(sorted(dataset_ids or [])),
+            float(similarity_threshold),
+            float(vector_similarity_weight),
+            int(top_k)
+        )
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, chunks = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return chunks
+
+    def put(self, key, chunks):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, chunks)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self):
+        """Drop every cached result, e.g. after the graph has been reloaded"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "name": self.name,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations
+            }
+
+    def cached(self, func):
+        """Decorate a document_retrieval(dataset_ids, query, ...) function, sync or async, with this cache"""
+        signature = inspect.signature(func)
+
+        def key_for(args, kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            params = bound.arguments
+            return self.make_key(
+                params["dataset_ids"], params["query"], params["similarity_threshold"],
+                params["vector_similarity_weight"], params["top_k"]
+            )
+
+        def lookup(key):
+            chunks = self.get(key)
+            CACHE_REQUESTS.inc(cache=self.name, result="miss" if chunks is None else "hit")
+            if chunks is not None:
+                logger.debug("Retrieval cache hit (%s): %s chunks", self.name, len(chunks))
+                return copy_chunks(chunks)
+            return None
+
+        def store(key, chunks):
+            # Empty results are not cached: backends also return [] when the query failed
+            if chunks:
+                self.put(key, copy_chunks(chunks))
+            return chunks
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if self.max_size <= 0:
+                    return await func(*args, **kwargs)
+                key = key_for(args, kwargs)
+                chunks = lookup(key)
+                if chunks is not None:
+                    return chunks
+                return store(key, await func(*args, **kwargs))
+
+            async_wrapper.cache = self
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if self.max_size <= 0:
+                return func(*args, **kwargs)
+            key = key_for(args, kwargs)
+            chunks = lookup(key)
+            if chunks is not None:
+                return chunks
+            return store(key, func(*args, **kwargs))
+
+        wrapper.cache = self
+        return wrapper
+
+
+def invalidate_all():
+    """Clear every retrieval cache in this process"""
+    for cache in _caches:
+        cache.invalidate()
+
+
+def cache_stats():
+    return [cache.stats() for cache in _caches]
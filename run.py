@@ -9,7 +9,8 @@ if __name__ == "__main__":
     
     print(f"Starting Insurance Recommendation System...")
     print(f"RAGFlow API URL: {settings.RAGFLOW_API_URL}")
-    print(f"LLM Model: {settings.LLM_MODEL}")
+    print(f"LLM Models: question={settings.QUESTION_LLM_MODEL}, profile={settings.PROFILE_LLM_MODEL}, "
+          f"recommendation={settings.RECOMMENDATION_LLM_MODEL}")
     print(f"Running on {settings.APP_HOST}:{settings.APP_PORT} (Debug: {settings.APP_DEBUG})")
     
     # Check if RAGFlow is accessible
@@ -0,0 +1,289 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP, BaseCheckpointSaver, CheckpointTuple, get_checkpoint_id, get_checkpoint_metadata
+)
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# Checkpoints kept per conversation; older ones (and their pending writes) are pruned
+MAX_CHECKPOINTS_PER_THREAD = 20
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS threads (
+    thread_id TEXT PRIMARY KEY,
+    state TEXT NOT NULL DEFAULT '{}',
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS threads_last_used ON threads (last_used);
+CREATE TABLE IF NOT EXISTS checkpoints (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    parent_checkpoint_id TEXT,
+    type TEXT,
+    checkpoint BLOB,
+    metadata_type TEXT,
+    metadata BLOB,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+);
+CREATE TABLE IF NOT EXISTS writes (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    channel TEXT NOT NULL,
+    type TEXT,
+    value BLOB,
+    task_path TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+);
+"""
+
+
+class SessionStore:
+    """
+    Server-side conversation state keyed by the Flask thread_id, persisted in SQLite.
+
+    Each thread holds a JSON state (company_info, retrieval progress, asked categories) and
+    the LangGraph checkpoints written through SQLiteCheckpointSaver. Threads idle for longer
+    than ttl seconds expire, and beyond max_threads the least recently used are evicted.
+    The file can be shared by several worker processes.
+    """
+
+    def __init__(self, path, max_threads=10000, ttl=86400):
+        self.path = path
+        self.max_threads = max_threads
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    def _cutoff(self):
+        return time.time() - self.ttl if self.ttl > 0 else 0
+
+    def _touch(self, thread_id):
+        self._conn.execute(
+            "INSERT INTO threads (thread_id, last_used) VALUES (?, ?) "
+            "ON CONFLICT (thread_id) DO UPDATE SET last_used = excluded.last_used",
+            (thread_id, time.time())
+        )
+
+    def _evict(self):
+        """Drop expired threads and the least recently used ones beyond max_threads"""
+        evicted = [row[0] for row in self._conn.execute(
+            "SELECT thread_id FROM threads WHERE last_used < ? "
+            "UNION SELECT thread_id FROM (SELECT thread_id FROM threads ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self._cutoff(), self.max_threads if self.max_threads > 0 else -1)
+        )]
+        if evicted:
+            self._delete(evicted)
+            logger.debug("Evicted %s conversation(s) from the session store", len(evicted))
+
+    def _delete(self, thread_ids):
+        params = [(thread_id,) for thread_id in thread_ids]
+        for table in ("threads", "checkpoints", "writes"):
+            self._conn.executemany(f"DELETE FROM {table} WHERE thread_id = ?", params)
+
+    def load(self, thread_id):
+        """State of a conversation, or {} when it is unknown or has expired"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT state FROM threads WHERE thread_id = ? AND last_used >= ?", (thread_id, self._cutoff())
+            ).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def update(self, thread_id, fields):
+        """Merge fields into the state of a conversation and mark it as recently used"""
+        with self._lock:
+            # Take the write lock up front so concurrent workers do not lose each other's fields
+            self._conn.execute("BEGIN IMMEDIATE")
+            row = self._conn.execute(
+                "SELECT state FROM threads WHERE thread_id = ? AND last_used >= ?", (thread_id, self._cutoff())
+            ).fetchone()
+            state = json.loads(row[0]) if row else {}
+            state.update(fields)
+            self._conn.execute(
+                "INSERT INTO threads (thread_id, state, last_used) VALUES (?, ?, ?) "
+                "ON CONFLICT (thread_id) DO UPDATE SET state = excluded.state, last_used = excluded.last_used",
+                (thread_id, json.dumps(state), time.time())
+            )
+            self._evict()
+            self._conn.commit()
+        return state
+
+    def delete(self, thread_id):
+        with self._lock:
+            self._delete([thread_id])
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            threads = self._conn.execute("SELECT COUNT(*) FROM threads").fetchone()[0]
+            checkpoints = self._conn.execute("SELECT COUNT(*) FROM checkpoints").fetchone()[0]
+        return {"path": self.path, "threads": threads, "checkpoints": checkpoints,
+                "max_threads": self.max_threads, "ttl": self.ttl}
+
+
+class SQLiteCheckpointSaver(BaseCheckpointSaver):
+    """LangGraph checkpointer over a SessionStore, a bounded drop-in replacement for MemorySaver"""
+
+    def __init__(self, store, max_checkpoints=MAX_CHECKPOINTS_PER_THREAD, serde=None):
+        super().__init__(serde=serde)
+        self.store = store
+        self.max_checkpoints = max_checkpoints
+
+    def _tuple(self, conn, row):
+        thread_id, checkpoint_ns, checkpoint_id, parent_id, type_, checkpoint, metadata_type, metadata = row
+        writes = conn.execute(
+            "SELECT task_id, channel, type, value FROM writes "
+            "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ? ORDER BY task_id, idx",
+            (thread_id, checkpoint_ns, checkpoint_id)
+        ).fetchall()
+        return CheckpointTuple(
+            config={"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint_id}},
+            checkpoint=self.serde.loads_typed((type_, checkpoint)),
+            metadata=self.serde.loads_typed((metadata_type, metadata)),
+            parent_config=(
+                {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": parent_id}}
+                if parent_id else None
+            ),
+            pending_writes=[(task_id, channel, self.serde.loads_typed((w_type, value)))
+                            for task_id, channel, w_type, value in writes]
+        )
+
+    def get_tuple(self, config):
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        query = ("SELECT thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type, checkpoint, "
+                 "metadata_type, metadata FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?")
+        params = [thread_id, checkpoint_ns]
+        if checkpoint_id := get_checkpoint_id(config):
+            query += " AND checkpoint_id = ?"
+            params.append(checkpoint_id)
+        else:
+            query += " ORDER BY checkpoint_id DESC LIMIT 1"
+        store = self.store
+        with store._lock:
+            row = store._conn.execute(query, params).fetchone()
+            return self._tuple(store._conn, row) if row else None
+
+    def list(self, config, *, filter=None, before=None, limit=None):
+        query = ("SELECT thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type, checkpoint, "
+                 "metadata_type, metadata FROM checkpoints WHERE 1 = 1")
+        params = []
+        if config:
+            query += " AND thread_id = ?"
+            params.append(config["configurable"]["thread_id"])
+            if (checkpoint_ns := config["configurable"].get("checkpoint_ns")) is not None:
+                query += " AND checkpoint_ns = ?"
+                params.append(checkpoint_ns)
+            if checkpoint_id := get_checkpoint_id(config):
+                query += " AND checkpoint_id = ?"
+                params.append(checkpoint_id)
+        if before and (before_id := get_checkpoint_id(before)):
+            query += " AND checkpoint_id < ?"
+            params.append(before_id)
+        query += " ORDER BY checkpoint_id DESC"
+
+        store = self.store
+        with store._lock:
+            rows = store._conn.execute(query, params).fetchall()
+            tuples = []
+            for row in rows:
+                if limit is not None and len(tuples) >= limit:
+                    break
+                checkpoint_tuple = self._tuple(store._conn, row)
+                if filter and not all(checkpoint_tuple.metadata.get(k) == v for k, v in filter.items()):
+                    continue
+                tuples.append(checkpoint_tuple)
+        yield from tuples
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        type_, serialized = self.serde.dumps_typed(checkpoint)
+        metadata_type, serialized_metadata = self.serde.dumps_typed(get_checkpoint_metadata(config, metadata))
+        store = self.store
+        with store._lock:
+            store._conn.execute(
+                "INSERT OR REPLACE INTO checkpoints (thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, "
+                "type, checkpoint, metadata_type, metadata) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (thread_id, checkpoint_ns, checkpoint["id"], config["configurable"].get("checkpoint_id"),
+                 type_, serialized, metadata_type, serialized_metadata)
+            )
+            # Keep only the most recent checkpoints of the thread, with their pending writes
+            stale = store._conn.execute(
+                "SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+                "ORDER BY checkpoint_id DESC LIMIT -1 OFFSET ?",
+                (thread_id, checkpoint_ns, self.max_checkpoints)
+            ).fetchall()
+            for table in ("checkpoints", "writes"):
+                store._conn.executemany(
+                    f"DELETE FROM {table} WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                    [(thread_id, checkpoint_ns, checkpoint_id) for checkpoint_id, in stale]
+                )
+            store._touch(thread_id)
+            store._evict()
+            store._conn.commit()
+        return {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint["id"]}}
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        # Special channels (errors, interrupts) overwrite, regular writes are only recorded once
+        replace, ignore = [], []
+        for idx, (channel, value) in enumerate(writes):
+            type_, serialized = self.serde.dumps_typed(value)
+            (replace if channel in WRITES_IDX_MAP else ignore).append(
+                (thread_id, checkpoint_ns, checkpoint_id, task_id, WRITES_IDX_MAP.get(channel, idx),
+                 channel, type_, serialized, task_path)
+            )
+        store = self.store
+        with store._lock:
+            for verb, rows in (("INSERT OR REPLACE", replace), ("INSERT OR IGNORE", ignore)):
+                store._conn.executemany(
+                    f"{verb} INTO writes (thread_id, checkpoint_ns, checkpoint_id, task_id, idx, channel, type, "
+                    "value, task_path) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    rows
+                )
+            store._conn.commit()
+
+    def delete_thread(self, thread_id):
+        self.store.delete(thread_id)
+
+    # The async variants run the SQLite calls off the event loop
+    async def aget_tuple(self, config):
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        tuples = await asyncio.to_thread(lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        for checkpoint_tuple in tuples:
+            yield checkpoint_tuple
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id, task_path=""):
+        return await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id):
+        return await asyncio.to_thread(self.delete_thread, thread_id)
+
+
+# Shared by app.py, app_async.py and the compiled LangGraph workflow
+session_store = SessionStore(settings.SESSION_DB_PATH, settings.SESSION_MAX_THREADS, settings.SESSION_TTL)
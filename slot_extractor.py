@@ -0,0 +1,216 @@
+import re
+
+# Extra phrases that show a category is being talked about, without giving its value
+CATEGORY_KEYWORDS = {
+    "Company size/employee count": ["employees", "employee", "staff", "headcount", "workforce"],
+    "Industry/business type": ["industry", "sector"],
+    "Annual revenue": ["revenue", "turnover", "annual sales"],
+    "Risk profile/concerns": ["risk", "risks", "concern", "concerns", "worried", "exposure"],
+    "Budget constraints": ["budget", "premium", "afford"],
+    "Crypto coverage needs": ["crypto", "cryptocurrency", "bitcoin", "digital asset", "digital assets", "blockchain"],
+    "Preferred grace period (days) for new subsidiary cover": ["grace period", "new subsidiary", "new subsidiaries"]
+}
+
+# Phrases that are themselves the value of a category, beyond its suggested answers
+CATEGORY_VALUES = {
+    "Industry/business type": [
+        "fintech", "software", "saas", "bank", "banking", "asset management",
+        "investment", "e-commerce", "ecommerce", "logistics", "construction", "real estate",
+        "hospitality", "education", "consulting", "media", "telecom", "pharmaceutical", "biotech",
+        "energy", "mining", "shipping", "trading", "startup", "start-up", "hospital", "clinic", "restaurant"
+    ],
+    "Risk profile/concerns": [
+        "cyber", "data breach", "hacking", "ransomware", "regulatory", "regulators", "investigation",
+        "lawsuit", "lawsuits", "litigation", "employment dispute", "wrongful dismissal", "discrimination",
+        "shareholder claims", "securities", "ipo", "pollution", "environmental"
+    ]
+}
+
+# Countries and common abbreviations, mapped to the name used in the profile
+COUNTRIES = {
+    "hong kong": "Hong Kong", "hk": "Hong Kong", "hksar": "Hong Kong",
+    "united states": "United States", "usa": "United States", "u.s.": "United States", "america": "United States",
+    "united kingdom": "United Kingdom", "uk": "United Kingdom", "britain": "United Kingdom", "england": "United Kingdom",
+    "canada": "Canada", "singapore": "Singapore", "china": "China", "mainland china": "China", "japan": "Japan",
+    "australia": "Australia", "germany": "Germany", "france": "France", "india": "India", "taiwan": "Taiwan",
+    "macau": "Macau", "korea": "South Korea", "south korea": "South Korea", "switzerland": "Switzerland",
+    "puerto rico": "Other US Territory", "guam": "Other US Territory"
+}
+
+# Suggested answers that mean nothing without knowing which question they answer
+CONTEXT_ONLY_ANSWERS = {"other", "yes", "no", "maybe", "no preference", "other non-us", "other us territory"}
+
+_SCALE = {"k": 1e3, "thousand": 1e3, "m": 1e6, "mn": 1e6, "million": 1e6, "b": 1e9, "bn": 1e9, "billion": 1e9}
+_NUMBER = r"(\d[\d,]*(?:\.\d+)?)\s*(k|thousand|mn|m|million|bn|b|billion)?\b"
+_CURRENCY = r"(?:us\$|hk\$|usd|hkd|\$|€|£|eur|gbp|dollars?)"
+
+_EMPLOYEES = re.compile(_NUMBER + r"\s*(?:\+\s*)?(?:full[- ]time\s+)?(?:employees|employee|staff|people|headcount|workers)")
+_MONEY = re.compile(_CURRENCY + r"\s*" + _NUMBER + r"|" + _NUMBER + r"\s*" + _CURRENCY)
+# "around 20k", "5 million": an amount without a currency, only taken next to budget/revenue words
+_SCALED = re.compile(r"(?<![\w$.,])(\d[\d,]*(?:\.\d+)?)\s*(k|thousand|mn|m|million|bn|b|billion)\b")
+_DAYS = re.compile(r"(\d{1,3})\s*(?:-\s*)?days?\b")
+_REVENUE_CONTEXT = re.compile(r"revenue|turnover|sales|income")
+_BUDGET_CONTEXT = re.compile(r"budget|premium|spend|afford|pay")
+# A day count is only the grace period next to these words, "30 days to pay invoices" is not
+_GRACE_CONTEXT = re.compile(r"grace|subsidiar|acquisition|acquire|acquiring")
+# Characters looked at before and after a number for the words that say what it is
+_CONTEXT_BEFORE = 40
+_CONTEXT_AFTER = 25
+
+
+def parse_amount(number, scale):
+    value = float(number.replace(",", ""))
+    return value * _SCALE.get((scale or "").lower(), 1)
+
+
+def context_distance(pattern, text, match):
+    """Characters between match and the nearest word of pattern around it in text, or None when there is none"""
+    before = text[max(0, match.start() - _CONTEXT_BEFORE):match.start()]
+    after = text[match.end():match.end() + _CONTEXT_AFTER]
+    distances = [len(before) - word.end() for word in pattern.finditer(before)]
+    distances += [word.start() for word in pattern.finditer(after)]
+    return min(distances, default=None)
+
+
+def size_bucket(employees):
+    if employees <= 50:
+        return "Small (1-50 employees)"
+    if employees <= 250:
+        return "Medium (51-250 employees)"
+    if employees <= 1000:
+        return "Large (251-1000 employees)"
+    return "Enterprise (1001+ employees)"
+
+
+def format_amount(amount):
+    for scale, suffix in ((1e9, "B"), (1e6, "M"), (1e3, "K")):
+        if amount >= scale:
+            return f"${amount / scale:g}{suffix}"
+    return f"${amount:g}"
+
+
+class SlotExtractor:
+    """
+    Single-pass extraction of ALL_CATEGORIES slots from the user's answers.
+
+    Category names, suggested answers, keywords and countries are compiled into one
+    alternation regex, so each answer is scanned once; numbers, money and day counts are
+    parsed by a few fixed patterns. No LLM is involved.
+    """
+
+    def __init__(self, categories, suggested_answers):
+        self.categories = list(categories)
+        self.suggested_answers = suggested_answers
+        self.phrases = {}  # lower-case phrase -> (category, value)
+
+        for category in self.categories:
+            for keyword in category.lower().split("/"):
+                self.phrases.setdefault(keyword.strip(), (category, None))
+            for keyword in CATEGORY_KEYWORDS.get(category, []):
+                self.phrases.setdefault(keyword, (category, None))
+            for value in CATEGORY_VALUES.get(category, []):
+                self.phrases.setdefault(value, (category, value))
+            for answer in suggested_answers.get(category, []):
+                # Day counts ("30 days") are parsed with their context below instead
+                if answer.lower() not in CONTEXT_ONLY_ANSWERS and not _DAYS.fullmatch(answer.lower()):
+                    self.phrases[answer.lower()] = (category, answer)
+            for part_answer in suggested_answers.get(category, []):
+                # "Cyberattacks/Data Breaches" is also matched by each of its parts
+                if "/" in part_answer:
+                    for part in part_answer.split("/"):
+                        self.phrases.setdefault(part.strip().lower(), (category, part_answer))
+        for name, country in COUNTRIES.items():
+            self.phrases[name] = ("Country of the company", country)
+
+        # Longest phrases first so "hong kong" wins over "hk"-style prefixes
+        alternation = "|".join(re.escape(phrase) for phrase in sorted(self.phrases, key=len, reverse=True))
+        self.pattern = re.compile(r"(?<![\w$])(?:" + alternation + r")(?![\w$])")
+
+    def extract_answer(self, answer, expected_category=None):
+        """Slots found in one answer as {category: value}; value is None when only the topic was recognised"""
+        text = (answer or "").lower()
+        slots = {}
+
+        for match in self.pattern.finditer(text):
+            category, value = self.phrases[match.group(0)]
+            # The first value mentioned in an answer wins, a bare topic keyword never overrides one
+            if slots.get(category) is None:
+                slots[category] = value
+
+        employees = _EMPLOYEES.search(text)
+        if employees:
+            slots["Company size/employee count"] = size_bucket(parse_amount(*employees.groups()))
+
+        amounts = []
+        for match in _MONEY.finditer(text):
+            number, scale = (match.group(1), match.group(2)) if match.group(1) else (match.group(3), match.group(4))
+            amounts.append((match, number, scale))
+        taken = [match.span() for match, _, _ in amounts] + ([employees.span()] if employees else [])
+        for match in _SCALED.finditer(text):
+            if not any(start <= match.start() < end for start, end in taken):
+                amounts.append((match, match.group(1), match.group(2)))
+
+        for match, number, scale in sorted(amounts, key=lambda amount: amount[0].start()):
+            amount = format_amount(parse_amount(number, scale))
+            # The closer word decides: "10m revenue but pay 200k premium" has one of each
+            budget = context_distance(_BUDGET_CONTEXT, text, match)
+            revenue = context_distance(_REVENUE_CONTEXT, text, match)
+            if budget is not None and (revenue is None or budget <= revenue):
+                slots["Budget constraints"] = amount
+            elif revenue is not None:
+                slots["Annual revenue"] = amount
+            elif expected_category in ("Budget constraints", "Annual revenue"):
+                slots[expected_category] = amount
+
+        grace_category = "Preferred grace period (days) for new subsidiary cover"
+        for days in _DAYS.finditer(text):
+            if expected_category == grace_category or context_distance(_GRACE_CONTEXT, text, days) is not None:
+                slots[grace_category] = f"{days.group(1)} days"
+                break
+
+        # A reply to the question that was asked answers it unless it already gave a value:
+        # a leading "Yes"/"No preference" is the value, and so is a bare reply ("Other", "90")
+        # or one that only names the topic ("Our industry is ...")
+        if expected_category and slots.get(expected_category) is None:
+            stripped = text.strip(" .!")
+            choice = self.leading_choice(stripped, expected_category)
+            if choice:
+                slots[expected_category] = choice
+            elif stripped in CONTEXT_ONLY_ANSWERS or not slots or expected_category in slots:
+                slots[expected_category] = answer.strip()
+
+        return slots
+
+    def leading_choice(self, text, category):
+        """The context-only suggested answer of category that text starts with ("yes, we hold ..."), or None"""
+        choices = [answer for answer in self.suggested_answers.get(category, []) if answer.lower() in CONTEXT_ONLY_ANSWERS]
+        for choice in sorted(choices, key=len, reverse=True):
+            if re.match(re.escape(choice.lower()) + r"(?!\w)", text):
+                return choice
+        return None
+
+    def extract(self, answers, expected_categories=None):
+        """
+        Slots from all answers; later answers override earlier ones.
+
+        Returns:
+            tuple: ({category: value}, [indexes of answers that yielded no slot])
+        """
+        slots = {}
+        unmatched = []
+        for i, answer in enumerate(answers):
+            expected = expected_categories[i] if expected_categories and i < len(expected_categories) else None
+            found = self.extract_answer(answer, expected)
+            if not found:
+                unmatched.append(i)
+            for category, value in found.items():
+                if value is not None or category not in slots:
+                    slots[category] = value if value is not None else slots.get(category)
+        # Report slots in ALL_CATEGORIES order
+        return {category: slots[category] for category in self.categories if category in slots}, unmatched
+
+    def next_missing(self, slots):
+        for category in self.categories:
+            if slots.get(category) is None:
+                return category
+        return None
@@ -0,0 +1,58 @@
+import pytest
+from slot_extractor import SlotExtractor
+
+CATEGORIES = [
+    "Industry/business type", "Annual revenue", "Budget constraints",
+    "Crypto coverage needs", "Preferred grace period (days) for new subsidiary cover"
+]
+SUGGESTED_ANSWERS = {
+    "Industry/business type": ["Technology", "Finance", "Manufacturing", "Retail", "Healthcare", "Other"],
+    "Annual revenue": ["< $1M", "$1M - $5M", "$5M - $25M", "$25M - $100M", "> $100M"],
+    "Budget constraints": ["< $10K", "$10K - $50K", "$50K - $100K", "$100K - $500K", "> $500K"],
+    "Crypto coverage needs": ["Yes", "No", "Maybe"],
+    "Preferred grace period (days) for new subsidiary cover": ["30 days", "60 days", "90 days", "No preference"]
+}
+GRACE = "Preferred grace period (days) for new subsidiary cover"
+
+
+@pytest.fixture(scope="module")
+def extractor():
+    return SlotExtractor(CATEGORIES, SUGGESTED_ANSWERS)
+
+
+@pytest.mark.parametrize("answer, value", [
+    ("Yes, we hold crypto assets for clients", "Yes"),
+    ("no, we have no crypto exposure", "No"),
+    ("Maybe", "Maybe")
+])
+def test_leading_choice_answers_the_asked_topic(extractor, answer, value):
+    assert extractor.extract_answer(answer, "Crypto coverage needs") == {"Crypto coverage needs": value}
+
+
+def test_reply_naming_the_asked_topic_fills_it(extractor):
+    slots, unmatched = extractor.extract(["Our industry is hard to describe"], ["Industry/business type"])
+    assert slots == {"Industry/business type": "Our industry is hard to describe"}
+    assert unmatched == []
+    assert extractor.next_missing(slots) == "Annual revenue"
+
+
+def test_topic_without_value_stays_unanswered_when_not_asked(extractor):
+    assert extractor.extract_answer("Our industry is hard to describe") == {"Industry/business type": None}
+
+
+def test_amount_goes_to_the_closest_context_word(extractor):
+    slots = extractor.extract_answer("we expect 10m revenue but pay 200k premium")
+    assert slots["Annual revenue"] == "$10M"
+    assert slots["Budget constraints"] == "$200K"
+
+
+def test_day_count_without_grace_context_is_not_the_grace_period(extractor):
+    assert GRACE not in extractor.extract_answer("we give customers 30 days to pay invoices")
+
+
+def test_day_count_next_to_subsidiary_is_the_grace_period(extractor):
+    assert extractor.extract_answer("new subsidiaries should be covered for 60 days")[GRACE] == "60 days"
+
+
+def test_day_count_answers_the_asked_grace_period(extractor):
+    assert extractor.extract_answer("about 45 days I think", GRACE)[GRACE] == "45 days"
@@ -0,0 +1,469 @@
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+import numpy as np
+from config import settings
+from vector_search_local import get_clause_index, tokenize
+from metrics import record_retrieval
+from match_stats import empty_match_stats, summarize_scores
+from rank_fusion import fuse_ranks
+
+logger = logging.getLogger(__name__)
+
+# Files written to settings.VECTOR_INDEX_DIR
+META_FILE = "meta.json"
+DOC_VECTORS_FILE = "doc_vectors.npy"
+TERM_PROJECTION_FILE = "term_projection.npy"
+IDF_FILE = "idf.npy"
+DOC_POLICY_FILE = "doc_policy.npy"
+TERM_PTR_FILE = "bm25_term_ptr.npy"
+TERM_DOCS_FILE = "bm25_term_docs.npy"
+TERM_WEIGHTS_FILE = "bm25_term_weights.npy"
+
+# Bump when the on-disk layout of the vector index changes
+VECTOR_FORMAT_VERSION = 1
+
+# Number of clauses densified at a time while building, keeps build memory flat
+BUILD_CHUNK_SIZE = 512
+
+# Fused hybrid scores lie in [0, 1], so their match histogram gets its own edges
+HYBRID_SCORE_BINS = (0.3, 0.4, 0.5, 0.6, 0.7, 0.8)
+
+
+def _doc_term_matrix(clause_index, vocabulary):
+    """Doc-term CSR arrays (indptr, indices, sublinear tf) from the keyword index postings"""
+    n_docs = len(clause_index.clause_ids)
+    docs, terms, tfs = [], [], []
+    for term_id, term in enumerate(vocabulary):
+        term_docs, term_tfs = clause_index.postings[term]
+        docs.append(np.asarray(term_docs, dtype=np.int64))
+        terms.append(np.full(len(term_docs), term_id, dtype=np.int64))
+        tfs.append(np.asarray(term_tfs, dtype=np.float32))
+
+    docs = np.concatenate(docs) if docs else np.zeros(0, dtype=np.int64)
+    terms = np.concatenate(terms) if terms else np.zeros(0, dtype=np.int64)
+    tfs = np.concatenate(tfs) if tfs else np.zeros(0, dtype=np.float32)
+
+    order = np.argsort(docs, kind="stable")
+    indptr = np.zeros(n_docs + 1, dtype=np.int64)
+    np.cumsum(np.bincount(docs, minlength=n_docs), out=indptr[1:])
+    return indptr, terms[order], 1 + np.log(tfs[order])
+
+
+class _TfidfMatrix:
+    """Row-normalised TF-IDF matrix that is only ever densified one chunk of rows at a time"""
+
+    def __init__(self, indptr, indices, values, idf):
+        self.indptr = indptr
+        self.indices = indices
+        self.values = values * idf[indices]
+        self.n_docs = len(indptr) - 1
+        self.n_terms = len(idf)
+
+        row_ids = np.repeat(np.arange(self.n_docs), np.diff(indptr))
+        norms = np.sqrt(np.bincount(row_ids, weights=self.values ** 2, minlength=self.n_docs))
+        norms[norms == 0] = 1.0
+        self.values = (self.values / norms[row_ids]).astype(np.float32)
+
+    def chunks(self):
+        for start in range(0, self.n_docs, BUILD_CHUNK_SIZE):
+            stop = min(start + BUILD_CHUNK_SIZE, self.n_docs)
+            lo, hi = self.indptr[start], self.indptr[stop]
+            rows = np.zeros((stop - start, self.n_terms), dtype=np.float32)
+            local_rows = np.repeat(np.arange(stop - start), np.diff(self.indptr[start:stop + 1]))
+            rows[local_rows, self.indices[lo:hi]] = self.values[lo:hi]
+            yield start, stop, rows
+
+    def dot(self, right):
+        """A @ right"""
+        out = np.zeros((self.n_docs, right.shape[1]), dtype=np.float32)
+        for start, stop, rows in self.chunks():
+            out[start:stop] = rows @ right
+        return out
+
+    def tdot(self, right):
+        """A.T @ right"""
+        out = np.zeros((self.n_terms, right.shape[1]), dtype=np.float32)
+        for start, stop, rows in self.chunks():
+            out += rows.T @ right[start:stop]
+        return out
+
+
+def _lsa_projection(matrix, dim, power_iterations=2, oversample=10, seed=42):
+    """Term -> latent projection (n_terms x dim) from a randomized truncated SVD"""
+    rng = np.random.default_rng(seed)
+    width = min(dim + oversample, matrix.n_terms, matrix.n_docs)
+    y = matrix.dot(rng.standard_normal((matrix.n_terms, width)).astype(np.float32))
+    for _ in range(power_iterations):
+        y, _ = np.linalg.qr(y)
+        z, _ = np.linalg.qr(matrix.tdot(y))
+        y = matrix.dot(z)
+    q, _ = np.linalg.qr(y)
+    b = matrix.tdot(q).T
+    _, _, vt = np.linalg.svd(b, full_matrices=False)
+    return np.ascontiguousarray(vt[:dim].T, dtype=np.float32)
+
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32)
+
+
+def build_vector_index(index_dir=None, dim=None):
+    """Compute clause embeddings offline and write them to index_dir as .npy files"""
+    index_dir = index_dir or settings.VECTOR_INDEX_DIR
+    dim = dim or settings.VECTOR_DIM
+    start = time.perf_counter()
+
+    clause_index = get_clause_index()
+    vocabulary = sorted(clause_index.postings)
+    n_docs = len(clause_index.clause_ids)
+    dim = max(1, min(dim, n_docs - 1, len(vocabulary) - 1))
+
+    idf = np.asarray([clause_index.idf(term) for term in vocabulary], dtype=np.float32)
+    indptr, indices, tf_values = _doc_term_matrix(clause_index, vocabulary)
+    tfidf = _TfidfMatrix(indptr, indices, tf_values, idf)
+    projection = _lsa_projection(tfidf, dim)
+    doc_vectors = _normalize_rows(tfidf.dot(projection))
+
+    # Per-term BM25 contributions (without idf) laid out as term-major CSR for vectorized keyword scoring
+    doc_lengths = np.asarray(clause_index.doc_lengths, dtype=np.float32)
+    avg_length = clause_index.avg_doc_length or 1.0
+    term_ptr = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+    term_docs, term_weights = [], []
+    for term_id, term in enumerate(vocabulary):
+        docs, tfs = clause_index.postings[term]
+        docs = np.asarray(docs, dtype=np.int32)
+        tfs = np.asarray(tfs, dtype=np.float32)
+        norm = clause_index.k1 * (1 - clause_index.b + clause_index.b * doc_lengths[docs] / avg_length)
+        term_docs.append(docs)
+        term_weights.append(tfs * (clause_index.k1 + 1) / (tfs + norm))
+        term_ptr[term_id + 1] = term_ptr[term_id] + len(docs)
+
+    os.makedirs(index_dir, exist_ok=True)
+    np.save(os.path.join(index_dir, DOC_VECTORS_FILE), doc_vectors)
+    np.save(os.path.join(index_dir, TERM_PROJECTION_FILE), projection)
+    np.save(os.path.join(index_dir, IDF_FILE), idf)
+    np.save(os.path.join(index_dir, DOC_POLICY_FILE), np.asarray(clause_index.doc_policy, dtype=np.int32))
+    np.save(os.path.join(index_dir, TERM_PTR_FILE), term_ptr)
+    np.save(os.path.join(index_dir, TERM_DOCS_FILE), np.concatenate(term_docs).astype(np.int32))
+    np.save(os.path.join(index_dir, TERM_WEIGHTS_FILE), np.concatenate(term_weights).astype(np.float32))
+    with open(os.path.join(index_dir, META_FILE), "w", encoding="utf-8") as f:
+        json.dump({
+            "version": VECTOR_FORMAT_VERSION,
+            "dim": dim,
+            "source_stamp": clause_index.source_stamp,
+            "vocabulary": vocabulary
+        }, f)
+
+    logger.debug("Built clause vector index: %s clauses x %s dims in %.1f ms",
+          n_docs, dim, (time.perf_counter() - start) * 1000)
+
+
+class ClauseVectorIndex:
+    """Memory-mapped LSA clause embeddings plus vectorized BM25, fused per query"""
+
+    def __init__(self, index_dir):
+        with open(os.path.join(index_dir, META_FILE), encoding="utf-8") as f:
+            meta = json.load(f)
+        self.version = meta["version"]
+        self.source_stamp = meta["source_stamp"]
+        self.term_ids = {term: i for i, term in enumerate(meta["vocabulary"])}
+
+        def load(name):
+            return np.load(os.path.join(index_dir, name), mmap_mode="r")
+
+        self.doc_vectors = load(DOC_VECTORS_FILE)
+        self.projection = load(TERM_PROJECTION_FILE)
+        self.idf = load(IDF_FILE)
+        self.doc_policy = load(DOC_POLICY_FILE)
+        self.term_ptr = load(TERM_PTR_FILE)
+        self.term_docs = load(TERM_DOCS_FILE)
+        self.term_weights = load(TERM_WEIGHTS_FILE)
+
+    def query_terms(self, query):
+        counts = {}
+        for term in tokenize(query):
+            term_id = self.term_ids.get(term)
+            if term_id is not None:
+                counts[term_id] = counts.get(term_id, 0) + 1
+        term_ids = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+        term_counts = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+        return term_ids, term_counts
+
+    def score(self, query, vector_similarity_weight=0.3, policy_positions=None):
+        """Return fused scores for every clause: weight * cosine + (1 - weight) * normalised BM25"""
+        n_docs = self.doc_vectors.shape[0]
+        term_ids, term_counts = self.query_terms(query)
+        if len(term_ids) == 0:
+            return np.zeros(n_docs, dtype=np.float32)
+
+        # Dense part: project the query TF-IDF vector and take one matrix-vector product
+        query_weights = (1 + np.log(term_counts)) * self.idf[term_ids]
+        query_vector = query_weights @ self.projection[term_ids]
+        norm = np.linalg.norm(query_vector)
+        if norm > 0:
+            dense = np.clip(self.doc_vectors @ (query_vector / norm), 0.0, 1.0)
+        else:
+            dense = np.zeros(n_docs, dtype=np.float32)
+
+        # Keyword part: each posting list is added as one slice, one step per distinct query term
+        keyword = np.zeros(n_docs, dtype=np.float32)
+        for term_id, count in zip(term_ids, term_counts):
+            lo, hi = self.term_ptr[term_id], self.term_ptr[term_id + 1]
+            keyword[self.term_docs[lo:hi]] += self.idf[term_id] * count * self.term_weights[lo:hi]
+        keyword_max = keyword.max()
+        if keyword_max > 0:
+            keyword /= keyword_max
+
+        scores = vector_similarity_weight * dense + (1 - vector_similarity_weight) * keyword
+        if policy_positions is not None:
+            scores[~np.isin(self.doc_policy, policy_positions)] = 0.0
+        return scores
+
+    def score_many(self, queries, vector_similarity_weight=0.3, policy_positions=None):
+        """
+        score() for several queries as one (n_queries, n_docs) matrix.
+
+        The dense part is a single doc_vectors @ Q.T product over the memory-mapped embeddings and
+        each distinct query term's posting list is read once for all the queries using it.
+        """
+        n_docs = self.doc_vectors.shape[0]
+        dim = self.doc_vectors.shape[1]
+        query_vectors = np.zeros((len(queries), dim), dtype=np.float32)
+        keyword = np.zeros((len(queries), n_docs), dtype=np.float32)
+        term_queries = {}  # term id -> ([query index, ...], [query term count, ...])
+        for i, query in enumerate(queries):
+            term_ids, term_counts = self.query_terms(query)
+            if len(term_ids) == 0:
+                continue
+            query_weights = (1 + np.log(term_counts)) * self.idf[term_ids]
+            query_vector = query_weights @ self.projection[term_ids]
+            norm = np.linalg.norm(query_vector)
+            if norm > 0:
+                query_vectors[i] = query_vector / norm
+            for term_id, count in zip(term_ids.tolist(), term_counts.tolist()):
+                users, counts = term_queries.setdefault(term_id, ([], []))
+                users.append(i)
+                counts.append(count)
+
+        dense = np.clip(query_vectors @ np.asarray(self.doc_vectors).T, 0.0, 1.0)
+
+        for term_id, (users, counts) in term_queries.items():
+            lo, hi = self.term_ptr[term_id], self.term_ptr[term_id + 1]
+            docs = self.term_docs[lo:hi]
+            weights = self.idf[term_id] * self.term_weights[lo:hi]
+            for i, count in zip(users, counts):
+                keyword[i, docs] += count * weights
+        keyword_max = keyword.max(axis=1, keepdims=True)
+        np.divide(keyword, keyword_max, out=keyword, where=keyword_max > 0)
+
+        scores = vector_similarity_weight * dense + (1 - vector_similarity_weight) * keyword
+        if policy_positions is not None:
+            scores[:, ~np.isin(self.doc_policy, policy_positions)] = 0.0
+        return scores
+
+    def search_many(self, queries, vector_similarity_weight=0.3, policy_positions=None, threshold=0.0, top_k=10):
+        """search() for several queries at once; one list of doc indices per query, best first"""
+        scores = self.score_many(queries, vector_similarity_weight, policy_positions)
+        results = []
+        for row in scores:
+            candidates = np.flatnonzero(row >= max(threshold, np.finfo(np.float32).tiny))
+            if len(candidates) > top_k:
+                candidates = candidates[np.argpartition(-row[candidates], top_k - 1)[:top_k]]
+            results.append(candidates[np.argsort(-row[candidates], kind="stable")].tolist())
+        return results
+
+    def search(self, query, vector_similarity_weight=0.3, policy_positions=None, threshold=0.0, top_k=10):
+        """Return (doc indices, scores) above threshold, best first"""
+        scores = self.score(query, vector_similarity_weight, policy_positions)
+        candidates = np.flatnonzero(scores >= max(threshold, np.finfo(np.float32).tiny))
+        if len(candidates) > top_k:
+            candidates = candidates[np.argpartition(-scores[candidates], top_k - 1)[:top_k]]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return candidates, scores[candidates]
+
+
+_vector_index = None
+_vector_index_lock = threading.Lock()
+
+
+def get_vector_index(rebuild=False):
+    """Return the process-wide vector index, building it if missing or stale"""
+    global _vector_index
+    # Keyed on the clause index's source stamp, so a rebuilt clause index (e.g. from a newly
+    # normalized export) brings a rebuilt vector index with it
+    clause_index = get_clause_index()
+    if _vector_index is not None and not rebuild and _vector_index.source_stamp == clause_index.source_stamp:
+        return _vector_index
+
+    with _vector_index_lock:
+        clause_index = get_clause_index()
+        if _vector_index is not None and not rebuild and _vector_index.source_stamp == clause_index.source_stamp:
+            return _vector_index
+
+        index_dir = settings.VECTOR_INDEX_DIR
+        index = None
+        if not rebuild and os.path.exists(os.path.join(index_dir, META_FILE)):
+            index = ClauseVectorIndex(index_dir)
+            if index.version != VECTOR_FORMAT_VERSION or index.source_stamp != clause_index.source_stamp:
+                logger.debug("Clause vector index is stale, rebuilding")
+                index = None
+
+        if index is None:
+            logger.debug("No usable clause vector index in %s, building it now", index_dir)
+            build_vector_index(index_dir)
+            index = ClauseVectorIndex(index_dir)
+
+        _vector_index = index
+        return _vector_index
+
+
+def document_retrieval(dataset_ids, query, similarity_threshold=0.2, vector_similarity_weight=0.3, top_k=1024, max_retries=3, retry_delay=1):
+    """
+    Retrieve relevant chunks with hybrid dense + keyword scoring over the local clause index.
+
+    Parameters:
+    - query: The user query or query keywords
+    - dataset_ids: List of policy IDs to search (used as filter)
+    - similarity_threshold: Minimum fused similarity in [0, 1] (default: 0.2)
+    - vector_similarity_weight: Weight of the LSA cosine similarity; BM25 gets the rest (default: 0.3)
+    - top_k: Maximum number of results to return (default: 1024)
+    - max_retries, retry_delay: Accepted for signature compatibility, no I/O happens here
+    """
+    logger.debug("Starting document_retrieval function with hybrid vector index")
+
+    # Handle single dataset_id as string
+    if isinstance(dataset_ids, str):
+        dataset_ids = [dataset_ids]
+
+    # Handle empty dataset_ids
+    if not dataset_ids:
+        logger.warning("No dataset_ids provided for retrieval")
+        return []
+
+    try:
+        clause_index = get_clause_index()
+        vector_index = get_vector_index()
+
+        policy_positions = None
+        if dataset_ids[0] != "all":
+            policy_positions = [clause_index.policy_positions[pid] for pid in dataset_ids if pid in clause_index.policy_positions]
+            if not policy_positions:
+                return []
+
+        start = time.perf_counter()
+        docs, scores = vector_index.search(query, vector_similarity_weight, policy_positions, similarity_threshold, top_k)
+        record_retrieval("hybrid", "search", time.perf_counter() - start, len(docs))
+
+        processed_chunks = []
+        for doc, score in zip(docs.tolist(), scores.tolist()):
+            processed_chunks.append({
+                "content": clause_index.texts[doc],
+                "source": clause_index.source(doc),
+                "score": score,
+                "highlighted_content": clause_index.texts[doc]
+            })
+
+        logger.debug("Processed %s chunks from hybrid vector index", len(processed_chunks))
+        return processed_chunks
+
+    except Exception as e:
+        logger.warning("Exception in hybrid document_retrieval: %s", e)
+        return []
+
+
+def document_retrieval_multi(dataset_ids, queries, similarity_threshold=0.2, vector_similarity_weight=0.3, top_k=1024, max_retries=3, retry_delay=1):
+    """
+    Retrieve for several sub-queries in one vectorized pass and fuse them by reciprocal rank.
+
+    Same parameters as document_retrieval, with queries a list of sub-queries; top_k limits each
+    sub-query and the fused result. Chunks carry the fused "score" and the "matched_queries" indexes.
+    """
+    logger.debug("Starting document_retrieval_multi function with hybrid vector index, %s sub-queries", len(queries))
+
+    if isinstance(dataset_ids, str):
+        dataset_ids = [dataset_ids]
+    if not dataset_ids or not queries:
+        logger.warning("No dataset_ids or queries provided for retrieval")
+        return []
+
+    try:
+        clause_index = get_clause_index()
+        vector_index = get_vector_index()
+
+        policy_positions = None
+        if dataset_ids[0] != "all":
+            policy_positions = [clause_index.policy_positions[pid] for pid in dataset_ids if pid in clause_index.policy_positions]
+            if not policy_positions:
+                return []
+
+        start = time.perf_counter()
+        ranked = vector_index.search_many(queries, vector_similarity_weight, policy_positions, similarity_threshold, top_k)
+        fused = fuse_ranks(ranked, limit=top_k)
+        record_retrieval("hybrid", "multi_search", time.perf_counter() - start, len(fused))
+
+        processed_chunks = []
+        for doc, score, matched in fused:
+            processed_chunks.append({
+                "content": clause_index.texts[doc],
+                "source": clause_index.source(doc),
+                "score": score,
+                "rrf_score": score,
+                "matched_queries": matched,
+                "highlighted_content": clause_index.texts[doc]
+            })
+
+        logger.debug("Fused %s chunks from %s sub-queries", len(processed_chunks), len(queries))
+        return processed_chunks
+
+    except Exception as e:
+        logger.warning("Exception in hybrid document_retrieval_multi: %s", e)
+        return []
+
+
+def document_match_stats(dataset_ids, query, similarity_threshold=0.2, vector_similarity_weight=0.3, max_retries=3, retry_delay=1):
+    """Count the clauses whose fused score (weighted as in document_retrieval) reaches similarity_threshold and their histogram per policy"""
+    if isinstance(dataset_ids, str):
+        dataset_ids = [dataset_ids]
+    if not dataset_ids:
+        logger.warning("No dataset_ids provided for match stats")
+        return empty_match_stats(HYBRID_SCORE_BINS)
+
+    try:
+        clause_index = get_clause_index()
+        vector_index = get_vector_index()
+
+        policy_positions = None
+        if dataset_ids[0] != "all":
+            policy_positions = [clause_index.policy_positions[pid] for pid in dataset_ids if pid in clause_index.policy_positions]
+            if not policy_positions:
+                return empty_match_stats(HYBRID_SCORE_BINS)
+
+        start = time.perf_counter()
+        # No top_k, every match is counted
+        scores = vector_index.score(query, vector_similarity_weight, policy_positions)
+        docs = np.flatnonzero(scores >= max(similarity_threshold, np.finfo(np.float32).tiny))
+        stats = summarize_scores(
+            ((clause_index.source(doc), score) for doc, score in zip(docs.tolist(), scores[docs].tolist())),
+            HYBRID_SCORE_BINS
+        )
+        record_retrieval("hybrid", "count", time.perf_counter() - start, len(stats["policies"]))
+        return stats
+
+    except Exception as e:
+        logger.warning("Exception in hybrid document_match_stats: %s", e)
+        return empty_match_stats(HYBRID_SCORE_BINS)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the local clause vector index from the csv/ export")
+    parser.add_argument("--index-dir", default=settings.VECTOR_INDEX_DIR)
+    parser.add_argument("--dim", type=int, default=settings.VECTOR_DIM)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG, format="%(levelname)s - %(message)s")
+    build_vector_index(args.index_dir, args.dim)
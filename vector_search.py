@@ -1,8 +1,230 @@
+import asyncio
+import logging
 import requests
+import httpx
+import threading
 import uuid
 import time
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from config import settings
+from retrieval_cache import RetrievalCache
+from policy_catalog import PolicyCatalog
+from metrics import RETRIEVAL_ERRORS, record_retrieval
+from match_stats import stats_from_chunks
+from rank_fusion import fuse_chunks
 
+logger = logging.getLogger(__name__)
+
+retrieval_cache = RetrievalCache("ragflow", settings.RETRIEVAL_CACHE_SIZE, settings.RETRIEVAL_CACHE_TTL)
+
+class RAGFlowClient:
+    """
+    RAGFlow API client with keep-alive connection pooling.
+    
+    Retrieval fans out one request chain per dataset on a bounded thread pool (or as
+    concurrent tasks on the async client), pages through each dataset only while results
+    stay above the similarity threshold, and merges everything by similarity.
+    """
+    
+    def __init__(self, base_url=None, api_key=None, max_connections=None, page_size=None):
+        self.base_url = base_url or settings.RAGFLOW_API_URL
+        self.api_key = api_key or settings.RAGFLOW_API_KEY
+        self.max_connections = max_connections or settings.RAGFLOW_MAX_CONNECTIONS
+        self.page_size = page_size or settings.RAGFLOW_PAGE_SIZE
+        self.headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+        
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_connections)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update(self.headers)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_connections, thread_name_prefix="ragflow")
+        
+        self.async_client = None
+    
+    def build_retrieval_request(self, dataset_ids, query, similarity_threshold, vector_similarity_weight, top_k, page=1):
+        """Return the url and body for one page of the RAGFlow /api/v1/retrieval endpoint"""
+        # Use the correct endpoint
+        url = f"{self.base_url}/api/v1/retrieval"
+        
+        # Prepare request body according to API documentation
+        data = {
+            "question": query,  # Using 'question' as specified in the API docs
+            "dataset_ids": dataset_ids,
+            "similarity_threshold": similarity_threshold,
+            "vector_similarity_weight": vector_similarity_weight,
+            "top_k": top_k,
+            "highlight": True,
+            "page": page,
+            "page_size": min(self.page_size, top_k),
+            "keyword": False
+        }
+        return url, data
+    
+    def has_more_pages(self, page_chunks, fetched, total, similarity_threshold, top_k):
+        """Whether another page of the same dataset can still contribute results"""
+        if len(page_chunks) < min(self.page_size, top_k) or fetched >= top_k:
+            return False
+        if total is not None and fetched >= total:
+            return False
+        # Pages are ordered by similarity, so once the tail drops below the threshold the rest will too
+        return page_chunks[-1]["score"] >= similarity_threshold
+    
+    @staticmethod
+    def merge(results, top_k):
+        chunks = [chunk for dataset_chunks in results for chunk in dataset_chunks]
+        chunks.sort(key=lambda chunk: chunk["score"] or 0, reverse=True)
+        return chunks[:top_k]
+    
+    def post(self, url, data, max_retries=3, retry_delay=1):
+        """POST with the module's retry policy; returns the decoded body, or None if every attempt failed"""
+        for attempt in range(max_retries):
+            try:
+                response = self.session.post(url, json=data, timeout=30)
+                
+                logger.debug("Retrieval response status: %s", response.status_code)
+                
+                if response.status_code == 200:
+                    return response.json()
+                
+                elif response.status_code == 429:  # Rate limit
+                    logger.debug("Rate limited, retrying after delay (%s/%s)", attempt + 1, max_retries)
+                    time.sleep(retry_delay * (2 ** attempt))  # Exponential backoff
+                else:
+                    logger.warning("Error retrieving chunks: %s", response.status_code)
+                    if attempt < max_retries - 1:
+                        time.sleep(retry_delay)
+            
+            except Exception as e:
+                logger.warning("Exception in document_retrieval: %s", e)
+                if attempt < max_retries - 1:
+                    time.sleep(retry_delay)
+        return None
+    
+    def retrieve_dataset(self, dataset_id, query, similarity_threshold, vector_similarity_weight, top_k, max_retries=3, retry_delay=1):
+        """Page through one dataset; returns (chunks, failed)"""
+        chunks = []
+        page = 1
+        while True:
+            url, data = self.build_retrieval_request([dataset_id], query, similarity_threshold, vector_similarity_weight, top_k, page)
+            start = time.perf_counter()
+            result = self.post(url, data, max_retries, retry_delay)
+            if result is None:
+                RETRIEVAL_ERRORS.inc(backend="ragflow", operation="retrieval")
+                return chunks, not chunks
+            page_chunks = parse_retrieval_response(result)
+            record_retrieval("ragflow", "retrieval", time.perf_counter() - start, len(page_chunks))
+            chunks.extend(page_chunks)
+            if not self.has_more_pages(page_chunks, len(chunks), retrieval_total(result), similarity_threshold, top_k):
+                return chunks, False
+            page += 1
+    
+    def retrieve(self, dataset_ids, query, similarity_threshold=0.2, vector_similarity_weight=0.3, top_k=1024, max_retries=3, retry_delay=1):
+        """Retrieve from every dataset concurrently and merge by similarity; [] if every dataset failed"""
+        futures = [
+            self.executor.submit(
+                self.retrieve_dataset, dataset_id, query, similarity_threshold,
+                vector_similarity_weight, top_k, max_retries, retry_delay
+            )
+            for dataset_id in dataset_ids
+        ]
+        results = [future.result() for future in futures]
+        if all(failed for _, failed in results):
+            logger.warning("All retrieval attempts failed, returning empty list")
+            return []
+        return self.merge([chunks for chunks, _ in results], top_k)
+    
+    def get_async_client(self):
+        """Shared httpx.AsyncClient so async retrievals reuse pooled connections"""
+        if self.async_client is None:
+            self.async_client = httpx.AsyncClient(
+                timeout=30,
+                headers=self.headers,
+                limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections)
+            )
+        return self.async_client
+    
+    async def close_async(self):
+        if self.async_client is not None:
+            await self.async_client.aclose()
+            self.async_client = None
+    
+    async def post_async(self, url, data, max_retries=3, retry_delay=1):
+        client = self.get_async_client()
+        for attempt in range(max_retries):
+            try:
+                response = await client.post(url, json=data)
+                logger.debug("Retrieval response status: %s", response.status_code)
+                
+                if response.status_code == 200:
+                    return response.json()
+                
+                elif response.status_code == 429:  # Rate limit
+                    logger.debug("Rate limited, retrying after delay (%s/%s)", attempt + 1, max_retries)
+                    await asyncio.sleep(retry_delay * (2 ** attempt))  # Exponential backoff
+                else:
+                    logger.warning("Error retrieving chunks: %s", response.status_code)
+                    if attempt < max_retries - 1:
+                        await asyncio.sleep(retry_delay)
+            
+            except Exception as e:
+                logger.warning("Exception in document_retrieval_async: %s", e)
+                if attempt < max_retries - 1:
+                    await asyncio.sleep(retry_delay)
+        return None
+    
+    async def retrieve_dataset_async(self, dataset_id, query, similarity_threshold, vector_similarity_weight, top_k, max_retries=3, retry_delay=1):
+        chunks = []
+        page = 1
+        while True:
+            url, data = self.build_retrieval_request([dataset_id], query, similarity_threshold, vector_similarity_weight, top_k, page)
+            start = time.perf_counter()
+            result = await self.post_async(url, data, max_retries, retry_delay)
+            if result is None:
+                RETRIEVAL_ERRORS.inc(backend="ragflow", operation="retrieval")
+                return chunks, not chunks
+            page_chunks = parse_retrieval_response(result)
+            record_retrieval("ragflow", "retrieval", time.perf_counter() - start, len(page_chunks))
+            chunks.extend(page_chunks)
+            if not self.has_more_pages(page_chunks, len(chunks), retrieval_total(result), similarity_threshold, top_k):
+                return chunks, False
+            page += 1
+    
+    async def retrieve_async(self, dataset_ids, query, similarity_threshold=0.2, vector_similarity_weight=0.3, top_k=1024, max_retries=3, retry_delay=1):
+        """Async variant of retrieve; concurrency is bounded by the httpx connection limit"""
+        results = await asyncio.gather(*[
+            self.retrieve_dataset_async(
+                dataset_id, query, similarity_threshold, vector_similarity_weight, top_k, max_retries, retry_delay
+            )
+            for dataset_id in dataset_ids
+        ])
+        if all(failed for _, failed in results):
+            logger.warning("All retrieval attempts failed, returning empty list")
+            return []
+        return self.merge([chunks for chunks, _ in results], top_k)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """Process-wide RAGFlowClient, created on first use"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = RAGFlowClient()
+        return _client
+
+async def close_async_client():
+    if _client is not None:
+        await _client.close_async()
+
+
+@retrieval_cache.cached
 def document_retrieval(dataset_ids, query, similarity_threshold=0.2, vector_similarity_weight=0.3, top_k=1024, max_retries=3, retry_delay=1):
     """
     Retrieve relevant chunks from datasets based on a query with retry logic.
@@ -12,16 +234,30 @@ def document_retrieval(dataset_ids, query, similarity_threshold=0.2, vector_simi
     - dataset_ids: List of dataset IDs to search
     - similarity_threshold: Minimum similarity score (default: 0.2)
     - vector_similarity_weight: Weight of vector cosine similarity (default: 0.3)
-    - top_k: Number of chunks engaged in vector cosine computation (default: 1024)
+    - top_k: Number of chunks engaged in vector cosine computation, and the most returned (default: 1024)
     """
-    print("\nDEBUG - Starting document_retrieval function")
+    logger.debug("Starting document_retrieval function")
     
-    # Use the correct endpoint
-    url = f"{settings.RAGFLOW_API_URL}/api/v1/retrieval"
-    headers = {
-        "Authorization": f"Bearer {settings.RAGFLOW_API_KEY}",
-        "Content-Type": "application/json"
-    }
+    # Handle single dataset_id as string
+    if isinstance(dataset_ids, str):
+        dataset_ids = [dataset_ids]
+    
+    # Handle empty dataset_ids
+    if not dataset_ids:
+        logger.warning("No dataset_ids provided for retrieval")
+        return []
+    
+    logger.debug("Retrieving from %s datasets", len(dataset_ids))
+    
+    chunks = get_client().retrieve(dataset_ids, query, similarity_threshold, vector_similarity_weight, top_k, max_retries, retry_delay)
+    logger.debug("Merged %s chunks from %s datasets", len(chunks), len(dataset_ids))
+    return chunks
+
+
+@retrieval_cache.cached
+async def document_retrieval_async(dataset_ids, query, similarity_threshold=0.2, vector_similarity_weight=0.3, top_k=1024, max_retries=3, retry_delay=1):
+    """Async variant of document_retrieval over httpx; same parameters and result shape"""
+    logger.debug("Starting document_retrieval_async function")
     
     # Handle single dataset_id as string
     if isinstance(dataset_ids, str):
@@ -29,84 +265,88 @@ def document_retrieval(dataset_ids, query, similarity_threshold=0.2, vector_simi
     
     # Handle empty dataset_ids
     if not dataset_ids:
-        print("Warning: No dataset_ids provided for retrieval")
+        logger.warning("No dataset_ids provided for retrieval")
         return []
     
-    print(f"DEBUG - Retrieving with dataset_ids: {dataset_ids}")
+    chunks = await get_client().retrieve_async(dataset_ids, query, similarity_threshold, vector_similarity_weight, top_k, max_retries, retry_delay)
+    logger.debug("Merged %s chunks from %s datasets", len(chunks), len(dataset_ids))
+    return chunks
+
+
+def document_retrieval_multi(dataset_ids, queries, similarity_threshold=0.2, vector_similarity_weight=0.3, top_k=1024, max_retries=3, retry_delay=1):
+    """
+    Retrieve for several sub-queries and fuse them by reciprocal rank.
     
-    # Prepare request body according to API documentation
-    data = {
-        "question": query,  # Using 'question' as specified in the API docs
-        "dataset_ids": dataset_ids,
-        "similarity_threshold": similarity_threshold,
-        "vector_similarity_weight": vector_similarity_weight,
-        "top_k": top_k,
-        "highlight": True,
-        "page_size": 200,
-        "keyword": False
-    }
+    RAGFlow takes one question per retrieval call, so this costs one (cached) call per sub-query;
+    the other backends answer all of them in one pass.
+    """
+    results = [
+        document_retrieval(dataset_ids, query, similarity_threshold, vector_similarity_weight, top_k, max_retries, retry_delay)
+        for query in queries
+    ]
+    return fuse_chunks(results, limit=top_k)
+
+
+async def document_retrieval_multi_async(dataset_ids, queries, similarity_threshold=0.2, vector_similarity_weight=0.3, top_k=1024, max_retries=3, retry_delay=1):
+    """Async variant of document_retrieval_multi; the sub-queries run concurrently"""
+    results = await asyncio.gather(*(
+        document_retrieval_async(dataset_ids, query, similarity_threshold, vector_similarity_weight, top_k, max_retries, retry_delay)
+        for query in queries
+    ))
+    return fuse_chunks(results, limit=top_k)
+
+
+def document_match_stats(dataset_ids, query, similarity_threshold=0.2, vector_similarity_weight=0.3, max_retries=3, retry_delay=1):
+    """Match count and score histogram per dataset; RAGFlow has no count-only retrieval, so the chunks are fetched"""
+    return stats_from_chunks(document_retrieval(dataset_ids, query, similarity_threshold, vector_similarity_weight, max_retries=max_retries, retry_delay=retry_delay))
+
+
+async def document_match_stats_async(dataset_ids, query, similarity_threshold=0.2, vector_similarity_weight=0.3, max_retries=3, retry_delay=1):
+    """Async variant of document_match_stats"""
+    return stats_from_chunks(await document_retrieval_async(dataset_ids, query, similarity_threshold, vector_similarity_weight, max_retries=max_retries, retry_delay=retry_delay))
+
+def retrieval_total(result):
+    """Total number of matching chunks reported by a retrieval response, if present"""
+    if isinstance(result, dict) and isinstance(result.get("data"), dict):
+        total = result["data"].get("total")
+        if isinstance(total, int):
+            return total
+    return None
+
+def parse_retrieval_response(result):
+    """Format a RAGFlow retrieval response body into chunks"""
+    # Debug the response structure
+    if isinstance(result, dict):
+        logger.debug("Response structure: %s", list(result.keys()))
     
-    print(f"DEBUG - Request payload: {data}")
+    # Process response according to the API documentation structure
+    chunks = []
     
-    # Implement retry logic
-    for attempt in range(max_retries):
-        try:
-            response = requests.post(url, headers=headers, json=data, timeout=30)
-            
-            print(f"DEBUG - Retrieval response status: {response.status_code}")
-            
-            if response.status_code == 200:
-                result = response.json()
-                
-                # Debug the response structure
-                if isinstance(result, dict):
-                    print(f"DEBUG - Response structure: {list(result.keys())}")
-                
-                # Process response according to the API documentation structure
-                chunks = []
-                
-                if isinstance(result, dict):
-                    if result.get("code") == 0 and "data" in result:
-                        if result["data"] is None:
-                            print("DEBUG - Response data field is None")
-                            return []
-                        elif isinstance(result["data"], dict) and "chunks" in result["data"]:
-                            chunks = result["data"]["chunks"]
-                            print(f"DEBUG - Found {len(chunks)} chunks in result.data.chunks")
-                
-                # Process and format the chunks
-                processed_chunks = []
-                for chunk in chunks:
-                    if not isinstance(chunk, dict):
-                        continue
-                        
-                    processed_chunk = {
-                        "content": chunk.get("content", ""),
-                        "source": chunk.get("document_keyword", "Unknown"),
-                        "score": chunk.get("similarity", 0),
-                        "highlighted_content": chunk.get("highlight", "")
-                    }
-                    processed_chunks.append(processed_chunk)
-                
-                print(f"DEBUG - Processed {len(processed_chunks)} chunks")
-                return processed_chunks
+    if isinstance(result, dict):
+        if result.get("code") == 0 and "data" in result:
+            if result["data"] is None:
+                logger.debug("Response data field is None")
+                return []
+            elif isinstance(result["data"], dict) and "chunks" in result["data"]:
+                chunks = result["data"]["chunks"]
+                logger.debug("Found %s chunks in result.data.chunks", len(chunks))
+    
+    # Process and format the chunks
+    processed_chunks = []
+    for chunk in chunks:
+        if not isinstance(chunk, dict):
+            continue
             
-            elif response.status_code == 429:  # Rate limit
-                print(f"DEBUG - Rate limited, retrying after delay ({attempt+1}/{max_retries})")
-                time.sleep(retry_delay * (2 ** attempt))  # Exponential backoff
-            else:
-                print(f"DEBUG - Error retrieving chunks: {response.status_code}")
-                if attempt < max_retries - 1:
-                    time.sleep(retry_delay)
-        
-        except Exception as e:
-            print(f"DEBUG - Exception in document_retrieval: {e}")
-            if attempt < max_retries - 1:
-                time.sleep(retry_delay)
+        processed_chunk = {
+            "content": chunk.get("content", ""),
+            "source": chunk.get("document_keyword", "Unknown"),
+            "score": chunk.get("similarity", 0),
+            "highlighted_content": chunk.get("highlight", "")
+        }
+        processed_chunks.append(processed_chunk)
     
-    # If all retries fail, return empty list - NO DEFAULT CONTENT
-    print("DEBUG - All retrieval attempts failed, returning empty list")
-    return []
+    logger.debug("Processed %s chunks", len(processed_chunks))
+    return processed_chunks
 
 
 def get_datasets(name=None, max_retries=3, retry_delay=1):
@@ -115,23 +355,18 @@ def get_datasets(name=None, max_retries=3, retry_delay=1):
     if name:
         url += f"?name={name}"
     
-    headers = {
-        "Authorization": f"Bearer {settings.RAGFLOW_API_KEY}"
-    }
-    
-    print(f"DEBUG - Attempting to get datasets from: {url}")
-    print(f"DEBUG - Using API key ending with: {settings.RAGFLOW_API_KEY[-5:] if settings.RAGFLOW_API_KEY else 'None'}")
+    logger.debug("Attempting to get datasets from: %s", url)
+    logger.debug("Using API key ending with: %s", settings.RAGFLOW_API_KEY[-5:] if settings.RAGFLOW_API_KEY else 'None')
     
     # Implement retry logic
     for attempt in range(max_retries):
         try:
-            response = requests.get(url, headers=headers, timeout=10)
-            print(f"DEBUG - Get datasets response status: {response.status_code}")
+            response = get_client().session.get(url, timeout=10)
+            logger.debug("Get datasets response status: %s", response.status_code)
             
             if response.status_code == 200:
                 # Dump full response for debugging
                 result = response.json()
-                print(f"DEBUG - Raw response: {result}")
                 
                 # Handle different response structures
                 datasets = []
@@ -139,47 +374,47 @@ def get_datasets(name=None, max_retries=3, retry_delay=1):
                 if isinstance(result, dict):
                     if "data" in result and isinstance(result["data"], dict) and "items" in result["data"]:
                         datasets = result["data"]["items"]
-                        print(f"DEBUG - Found datasets in result.data.items")
+                        logger.debug("Found datasets in result.data.items")
                     elif "data" in result and isinstance(result["data"], list):
                         datasets = result["data"]
-                        print(f"DEBUG - Found datasets in result.data (list)")
+                        logger.debug("Found datasets in result.data (list)")
                     elif "code" in result and result["code"] == 0 and "data" in result:
                         # This appears to be your actual response structure
                         datasets = result["data"]
-                        print(f"DEBUG - Found datasets in result.data with code 0")
+                        logger.debug("Found datasets in result.data with code 0")
                 elif isinstance(result, list):
                     datasets = result
-                    print(f"DEBUG - Result is already a list of datasets")
+                    logger.debug("Result is already a list of datasets")
                 
-                print(f"DEBUG - Found {len(datasets)} datasets")
+                logger.debug("Found %s datasets", len(datasets))
                 if datasets:
-                    print(f"DEBUG - First dataset sample: {datasets[0]}")
+                    logger.debug("First dataset sample: %s", datasets[0])
                 
                 return datasets
             elif response.status_code == 429:  # Rate limit
-                print(f"DEBUG - Rate limited, retrying after delay ({attempt+1}/{max_retries})")
+                logger.debug("Rate limited, retrying after delay (%s/%s)", attempt + 1, max_retries)
                 time.sleep(retry_delay * (2 ** attempt))  # Exponential backoff
                 continue
             else:
-                print(f"Error getting datasets: {response.status_code}, {response.text}")
+                logger.error("Error getting datasets: %s, %s", response.status_code, response.text[:200])
                 if attempt < max_retries - 1:
                     time.sleep(retry_delay)
                     continue
                 return []
         except Exception as e:
-            print(f"Exception in get_datasets: {e}")
-            print(f"DEBUG - Exception type: {type(e).__name__}")
-            import traceback
-            print(f"DEBUG - Traceback: {traceback.format_exc()}")
+            logger.error("Exception in get_datasets: %s: %s", type(e).__name__, e, exc_info=logger.isEnabledFor(logging.DEBUG))
             if attempt < max_retries - 1:
                 time.sleep(retry_delay)
                 continue
             return []
     
     # If we've exhausted all retries
-    print("DEBUG - Exhausted all retries in get_datasets")
+    logger.warning("Exhausted all retries in get_datasets")
     return []
 
+# Datasets change only when documents are re-indexed, so retrieval reads them from memory
+policy_catalog = PolicyCatalog(get_datasets, settings.POLICY_CATALOG_REFRESH)
+
 def search_documents_with_context(query, context=None, dataset_ids=None):
     """
     Search documents with context enhancement
@@ -199,8 +434,7 @@ def search_documents_with_context(query, context=None, dataset_ids=None):
     
     # Get all datasets if none specified
     if not dataset_ids:
-        datasets = get_datasets()
-        dataset_ids = [d.get("id") for d in datasets if d.get("id")]
+        dataset_ids = policy_catalog.dataset_ids()
     
     # Retrieve documents
     chunks = document_retrieval(dataset_ids, enhanced_query)
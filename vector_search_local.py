@@ -0,0 +1,454 @@
+import csv
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from config import settings
+from retrieval_cache import invalidate_all
+from policy_catalog import PolicyCatalog
+from clause_normalizer import ensure_normalized
+from metrics import record_retrieval
+from match_stats import empty_match_stats, summarize_scores
+from rank_fusion import fuse_ranks
+
+logger = logging.getLogger(__name__)
+
+# Files the local index is built from (relative to settings.GRAPH_CSV_DIR)
+CLAUSE_FILE = "nodes_clause.csv"
+POLICY_FILE = "nodes_policy.csv"
+POLICY_CLAUSE_FILE = "rels_policy_contains_clause.csv"
+
+# Bump when the on-disk layout of the persisted index changes
+INDEX_FORMAT_VERSION = 1
+
+# Lucene's default English stop words, matching the 'standard' analyzer used by clause_text_idx
+STOP_WORDS = frozenset([
+    "a", "an", "and", "are", "as", "at", "be", "but", "by", "for", "if", "in", "into", "is", "it",
+    "no", "not", "of", "on", "or", "such", "that", "the", "their", "then", "there", "these",
+    "they", "this", "to", "was", "will", "with"
+])
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+csv.field_size_limit(10 * 1024 * 1024)
+
+
+def tokenize(text):
+    """Lower-case and split text into index terms, dropping stop words"""
+    if not text:
+        return []
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOP_WORDS]
+
+
+class ClauseIndex:
+    """In-process BM25 inverted index over Clause nodes exported in csv/"""
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.clause_ids = []        # doc index -> clauseId
+        self.texts = []             # doc index -> clause text
+        self.doc_policy = []        # doc index -> position in self.policies
+        self.doc_lengths = []       # doc index -> number of terms
+        self.avg_doc_length = 0.0
+        self.postings = {}          # term -> [[doc index, ...], [term frequency, ...]]
+        self.policies = []          # list of policy dicts (id, name, insurer, jurisdiction)
+        self.policy_positions = {}  # policyId -> position in self.policies
+        self.policy_docs = {}       # policyId -> [doc index, ...]
+        self.source_stamp = {}
+
+    @staticmethod
+    def source_files(csv_dir):
+        return [os.path.join(csv_dir, name) for name in (CLAUSE_FILE, POLICY_FILE, POLICY_CLAUSE_FILE)]
+
+    @classmethod
+    def stamp_sources(cls, csv_dir):
+        """Size and mtime of every source CSV, used to detect a stale persisted index"""
+        stamp = {}
+        for path in cls.source_files(csv_dir):
+            stat = os.stat(path)
+            stamp[os.path.basename(path)] = [stat.st_size, int(stat.st_mtime)]
+        return stamp
+
+    def build_from_csv(self, csv_dir):
+        """Build the index from the Neo4j CSV export"""
+        start = time.perf_counter()
+
+        with open(os.path.join(csv_dir, POLICY_FILE), newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                policy = {
+                    "id": row["policyId:ID(Policy)"],
+                    "name": row.get("policyName", ""),
+                    "insurer": row.get("insurer", ""),
+                    "jurisdiction": row.get("jurisdiction", "")
+                }
+                self.policy_positions[policy["id"]] = len(self.policies)
+                self.policies.append(policy)
+
+        # A canonical clause shared by several policies (see clause_normalizer.py) is linked to each
+        clause_policies = defaultdict(list)
+        with open(os.path.join(csv_dir, POLICY_CLAUSE_FILE), newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                clause_policies[row[":END_ID(Clause)"]].append(row[":START_ID(Policy)"])
+
+        postings = defaultdict(lambda: ([], []))
+        with open(os.path.join(csv_dir, CLAUSE_FILE), newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                clause_id = row["clauseId:ID(Clause)"]
+                text = row.get("text") or ""
+                terms = None
+                # Clauses not attached to a policy can never be returned by the Cypher query either;
+                # like the Cypher query, a shared clause yields one result per policy
+                for policy_id in clause_policies.get(clause_id, ()):
+                    if policy_id not in self.policy_positions:
+                        continue
+                    if terms is None:
+                        terms = tokenize(text)
+                        frequencies = defaultdict(int)
+                        for term in terms:
+                            frequencies[term] += 1
+
+                    doc = len(self.clause_ids)
+                    self.clause_ids.append(clause_id)
+                    self.texts.append(text)
+                    self.doc_policy.append(self.policy_positions[policy_id])
+                    self.doc_lengths.append(len(terms))
+                    self.policy_docs.setdefault(policy_id, []).append(doc)
+                    for term, tf in frequencies.items():
+                        docs, tfs = postings[term]
+                        docs.append(doc)
+                        tfs.append(tf)
+
+        self.postings = {term: [docs, tfs] for term, (docs, tfs) in postings.items()}
+        self.avg_doc_length = (sum(self.doc_lengths) / len(self.doc_lengths)) if self.doc_lengths else 0.0
+        self.source_stamp = self.stamp_sources(csv_dir)
+
+        logger.debug("Built local clause index: %s clauses, %s terms in %.1f ms",
+              len(self.clause_ids), len(self.postings), (time.perf_counter() - start) * 1000)
+        return self
+
+    def save(self, path):
+        """Persist the index as JSON so the next start-up can skip tokenization"""
+        payload = {
+            "version": INDEX_FORMAT_VERSION,
+            "k1": self.k1,
+            "b": self.b,
+            "source_stamp": self.source_stamp,
+            "clause_ids": self.clause_ids,
+            "texts": self.texts,
+            "doc_policy": self.doc_policy,
+            "doc_lengths": self.doc_lengths,
+            "policies": self.policies,
+            "postings": self.postings
+        }
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(payload, f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Load a persisted index, or return None if it is missing or from another format version"""
+        try:
+            with open(path, encoding="utf-8") as f:
+                payload = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.debug("Could not load local clause index from %s: %s", path, e)
+            return None
+
+        if payload.get("version") != INDEX_FORMAT_VERSION:
+            return None
+
+        index = cls(k1=payload["k1"], b=payload["b"])
+        index.source_stamp = payload["source_stamp"]
+        index.clause_ids = payload["clause_ids"]
+        index.texts = payload["texts"]
+        index.doc_policy = payload["doc_policy"]
+        index.doc_lengths = payload["doc_lengths"]
+        index.policies = payload["policies"]
+        index.postings = payload["postings"]
+        index.policy_positions = {policy["id"]: i for i, policy in enumerate(index.policies)}
+        for doc, position in enumerate(index.doc_policy):
+            index.policy_docs.setdefault(index.policies[position]["id"], []).append(doc)
+        index.avg_doc_length = (sum(index.doc_lengths) / len(index.doc_lengths)) if index.doc_lengths else 0.0
+        return index
+
+    def idf(self, term):
+        postings = self.postings.get(term)
+        if not postings:
+            return 0.0
+        df = len(postings[0])
+        return math.log(1 + (len(self.clause_ids) - df + 0.5) / (df + 0.5))
+
+    def score(self, query, policy_ids=None):
+        """Return a {doc index: BM25 score} map for every clause matching at least one query term"""
+        allowed = None
+        if policy_ids is not None:
+            allowed = {self.policy_positions[pid] for pid in policy_ids if pid in self.policy_positions}
+            if not allowed:
+                return {}
+
+        query_terms = defaultdict(int)
+        for term in tokenize(query):
+            query_terms[term] += 1
+
+        k1 = self.k1
+        b = self.b
+        avg_length = self.avg_doc_length or 1.0
+        doc_lengths = self.doc_lengths
+        doc_policy = self.doc_policy
+        scores = defaultdict(float)
+        for term, query_tf in query_terms.items():
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            weight = self.idf(term) * query_tf
+            for doc, tf in zip(*postings):
+                if allowed is not None and doc_policy[doc] not in allowed:
+                    continue
+                norm = k1 * (1 - b + b * doc_lengths[doc] / avg_length)
+                scores[doc] += weight * tf * (k1 + 1) / (tf + norm)
+        return scores
+
+    def score_many(self, queries, policy_ids=None):
+        """
+        score() for several queries in one pass over the postings.
+
+        Each distinct term's posting list is walked once and its BM25 contribution added to
+        every query containing the term, so overlapping sub-queries cost little more than one.
+        """
+        allowed = None
+        if policy_ids is not None:
+            allowed = {self.policy_positions[pid] for pid in policy_ids if pid in self.policy_positions}
+            if not allowed:
+                return [{} for _ in queries]
+
+        term_queries = defaultdict(list)  # term -> [(query index, query tf), ...]
+        for query_index, query in enumerate(queries):
+            query_terms = defaultdict(int)
+            for term in tokenize(query):
+                query_terms[term] += 1
+            for term, query_tf in query_terms.items():
+                term_queries[term].append((query_index, query_tf))
+
+        k1 = self.k1
+        b = self.b
+        avg_length = self.avg_doc_length or 1.0
+        doc_lengths = self.doc_lengths
+        doc_policy = self.doc_policy
+        scores = [defaultdict(float) for _ in queries]
+        for term, users in term_queries.items():
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = self.idf(term)
+            contributions = [
+                (doc, idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * doc_lengths[doc] / avg_length)))
+                for doc, tf in zip(*postings)
+                if allowed is None or doc_policy[doc] in allowed
+            ]
+            for query_index, query_tf in users:
+                query_scores = scores[query_index]
+                for doc, contribution in contributions:
+                    query_scores[doc] += contribution * query_tf
+        return scores
+
+    def search_many(self, queries, policy_ids=None, threshold=0.0, top_k=10):
+        """search() for several queries at once; one list of (doc index, score) pairs per query"""
+        results = []
+        for scores in self.score_many(queries, policy_ids):
+            hits = [(doc, score) for doc, score in scores.items() if score >= threshold]
+            hits.sort(key=lambda hit: hit[1], reverse=True)
+            results.append(hits[:top_k])
+        return results
+
+    def search(self, query, policy_ids=None, threshold=0.0, top_k=10):
+        """Return up to top_k (doc index, score) pairs above threshold, best first"""
+        scores = self.score(query, policy_ids)
+        hits = [(doc, score) for doc, score in scores.items() if score >= threshold]
+        hits.sort(key=lambda hit: hit[1], reverse=True)
+        return hits[:top_k]
+
+    def match_stats(self, query, policy_ids=None, threshold=0.0):
+        """Match count and score histogram per policy of every clause scoring at least threshold"""
+        scores = self.score(query, policy_ids)
+        return summarize_scores((self.source(doc), score) for doc, score in scores.items() if score >= threshold)
+
+    def source(self, doc):
+        policy = self.policies[self.doc_policy[doc]]
+        return f"{policy['insurer']} - {policy['name']}"
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_clause_index(rebuild=False):
+    """Return the process-wide clause index, loading or building it on first use"""
+    global _index
+    if _index is not None and not rebuild:
+        return _index
+
+    with _index_lock:
+        if _index is not None and not rebuild:
+            return _index
+
+        # Built from the normalized copy of the export; csv/ itself stays as extracted
+        csv_dir = ensure_normalized(settings.GRAPH_CSV_DIR) if settings.NORMALIZE_CLAUSES else settings.GRAPH_CSV_DIR
+        index_path = settings.CLAUSE_INDEX_PATH
+        index = None
+        if index_path and not rebuild and os.path.exists(index_path):
+            index = ClauseIndex.load(index_path)
+            if index is not None and index.source_stamp != ClauseIndex.stamp_sources(csv_dir):
+                logger.debug("Persisted clause index is stale, rebuilding")
+                index = None
+            elif index is not None:
+                logger.debug("Loaded local clause index from %s", index_path)
+
+        if index is None:
+            index = ClauseIndex().build_from_csv(csv_dir)
+            if index_path:
+                index.save(index_path)
+
+        if _index is not None:
+            # Results cached against the previous index may reference clauses that changed
+            invalidate_all()
+            policy_catalog.invalidate()
+        _index = index
+        return _index
+
+
+def document_retrieval(dataset_ids, query, similarity_threshold=0.2, vector_similarity_weight=0.3, top_k=1024, max_retries=3, retry_delay=1):
+    """
+    Retrieve relevant chunks from the in-process clause index based on a query.
+
+    Parameters:
+    - query: The user query or query keywords
+    - dataset_ids: List of policy IDs to search (used as filter)
+    - similarity_threshold: Minimum BM25 score (default: 0.2)
+    - vector_similarity_weight: Weight parameter (not used by the keyword index)
+    - top_k: Maximum number of results to return (default: 1024)
+    - max_retries, retry_delay: Accepted for signature compatibility, no I/O happens here
+    """
+    logger.debug("Starting document_retrieval function with local index")
+
+    # Handle single dataset_id as string
+    if isinstance(dataset_ids, str):
+        dataset_ids = [dataset_ids]
+
+    # Handle empty dataset_ids
+    if not dataset_ids:
+        logger.warning("No dataset_ids provided for retrieval")
+        return []
+
+    try:
+        index = get_clause_index()
+        policy_ids = None if dataset_ids[0] == "all" else dataset_ids
+        start = time.perf_counter()
+        hits = index.search(query, policy_ids, similarity_threshold, top_k)
+        record_retrieval("local", "search", time.perf_counter() - start, len(hits))
+
+        processed_chunks = []
+        for doc, score in hits:
+            processed_chunks.append({
+                "content": index.texts[doc],
+                "source": index.source(doc),
+                "score": score,
+                "highlighted_content": index.texts[doc]
+            })
+
+        logger.debug("Processed %s chunks from local index", len(processed_chunks))
+        return processed_chunks
+
+    except Exception as e:
+        logger.warning("Exception in local document_retrieval: %s", e)
+        return []
+
+
+def document_retrieval_multi(dataset_ids, queries, similarity_threshold=0.2, vector_similarity_weight=0.3, top_k=1024, max_retries=3, retry_delay=1):
+    """
+    Retrieve for several sub-queries in one pass over the local index and fuse them by reciprocal rank.
+
+    Same parameters as document_retrieval, with queries a list of sub-queries; top_k limits each
+    sub-query and the fused result. Chunks carry the fused "score" and the "matched_queries" indexes.
+    """
+    logger.debug("Starting document_retrieval_multi function with local index, %s sub-queries", len(queries))
+
+    if isinstance(dataset_ids, str):
+        dataset_ids = [dataset_ids]
+    if not dataset_ids or not queries:
+        logger.warning("No dataset_ids or queries provided for retrieval")
+        return []
+
+    try:
+        index = get_clause_index()
+        policy_ids = None if dataset_ids[0] == "all" else dataset_ids
+        start = time.perf_counter()
+        results = index.search_many(queries, policy_ids, similarity_threshold, top_k)
+        fused = fuse_ranks([[doc for doc, _ in hits] for hits in results], limit=top_k)
+        record_retrieval("local", "multi_search", time.perf_counter() - start, len(fused))
+
+        processed_chunks = []
+        for doc, score, matched in fused:
+            processed_chunks.append({
+                "content": index.texts[doc],
+                "source": index.source(doc),
+                "score": score,
+                "rrf_score": score,
+                "matched_queries": matched,
+                "highlighted_content": index.texts[doc]
+            })
+
+        logger.debug("Fused %s chunks from %s sub-queries", len(processed_chunks), len(queries))
+        return processed_chunks
+
+    except Exception as e:
+        logger.warning("Exception in local document_retrieval_multi: %s", e)
+        return []
+
+
+def document_match_stats(dataset_ids, query, similarity_threshold=0.2, vector_similarity_weight=0.3, max_retries=3, retry_delay=1):
+    """Count the clauses matching a query and their score histogram per policy, without building chunks (vector_similarity_weight is not used by the keyword index)"""
+    if isinstance(dataset_ids, str):
+        dataset_ids = [dataset_ids]
+    if not dataset_ids:
+        logger.warning("No dataset_ids provided for match stats")
+        return empty_match_stats()
+
+    try:
+        index = get_clause_index()
+        policy_ids = None if dataset_ids[0] == "all" else dataset_ids
+        start = time.perf_counter()
+        stats = index.match_stats(query, policy_ids, similarity_threshold)
+        record_retrieval("local", "count", time.perf_counter() - start, len(stats["policies"]))
+        return stats
+    except Exception as e:
+        logger.warning("Exception in local document_match_stats: %s", e)
+        return empty_match_stats()
+
+
+def get_datasets(name=None, max_retries=3, retry_delay=1):
+    """
+    Get all policies known to the local index or filter by name
+
+    Returns a list of dictionaries with policy information
+    """
+    try:
+        policies = get_clause_index().policies
+    except Exception as e:
+        logger.warning("Exception in local get_datasets: %s", e)
+        return []
+
+    return [
+        dict(policy)
+        for policy in policies
+        if name is None or name in policy["name"]
+    ]
+
+
+# Kept for parity with the other backends; the policies already live in the clause index
+policy_catalog = PolicyCatalog(get_datasets, refresh_interval=0)
@@ -1,6 +1,19 @@
+import asyncio
+import logging
+import re
+import threading
 import time
-from neo4j import GraphDatabase
+import uuid
+from neo4j import GraphDatabase, AsyncGraphDatabase, READ_ACCESS
+from neo4j.exceptions import ServiceUnavailable, SessionExpired, TransientError
 from config import settings
+from retrieval_cache import RetrievalCache, invalidate_all
+from policy_catalog import PolicyCatalog
+from graph_version import GraphVersionWatcher
+from metrics import RETRIEVAL_ERRORS, observe_stream, record_retrieval
+from match_stats import SCORE_BINS, empty_match_stats, stats_from_rows
+
+logger = logging.getLogger(__name__)
 
 # Neo4j connection parameters
 NEO4J_URI = "bolt://localhost:7687"
@@ -11,61 +24,191 @@ class Neo4jConnection:
     """Class to manage Neo4j database connection"""
     
     _instance = None
+    _instance_lock = threading.Lock()
     
     def __new__(cls):
         if cls._instance is None:
-            cls._instance = super(Neo4jConnection, cls).__new__(cls)
-            cls._instance.driver = None
-            cls._instance.connect()
+            # Request threads get here concurrently; only one may create the driver and watcher
+            with cls._instance_lock:
+                if cls._instance is None:
+                    instance = super(Neo4jConnection, cls).__new__(cls)
+                    instance.driver = None
+                    instance.async_driver = None
+                    instance._connect_lock = threading.Lock()
+                    instance.connect()
+                    cls._instance = instance
+                    graph_version.start()
         return cls._instance
     
+    @staticmethod
+    def driver_options():
+        """Connection pool settings shared by the sync and async drivers"""
+        return {
+            "auth": (NEO4J_USER, NEO4J_PASSWORD),
+            "max_connection_pool_size": settings.NEO4J_MAX_POOL_SIZE,
+            "connection_acquisition_timeout": settings.NEO4J_ACQUISITION_TIMEOUT
+        }
+    
     def connect(self, max_retries=3, retry_delay=1):
-        """Establish connection to Neo4j database with retry logic"""
+        """Establish connection to Neo4j database with retry logic, replacing (and closing) any previous driver"""
+        with self._connect_lock:
+            for attempt in range(max_retries):
+                driver = None
+                try:
+                    driver = GraphDatabase.driver(NEO4J_URI, **self.driver_options())
+                    # Verify connection
+                    driver.verify_connectivity()
+                    previous, self.driver = self.driver, driver
+                    if previous:
+                        previous.close()
+                    logger.debug("Successfully connected to Neo4j database")
+                    return True
+                except Exception as e:
+                    logger.warning("Neo4j connection error (attempt %s/%s): %s", attempt + 1, max_retries, e)
+                    if driver:
+                        driver.close()
+                    if attempt < max_retries - 1:
+                        time.sleep(retry_delay * (2 ** attempt))  # Exponential backoff
+                    else:
+                        logger.warning("Failed to connect to Neo4j after all retries")
+                        return False
+    
+    def close(self):
+        """Close the Neo4j connection"""
+        if self.driver:
+            self.driver.close()
+            self.driver = None
+    
+    async def connect_async(self, max_retries=3, retry_delay=1):
+        """Establish the async driver connection; must run inside the event loop that will use it"""
         for attempt in range(max_retries):
+            driver = None
             try:
-                self.driver = GraphDatabase.driver(
-                    NEO4J_URI, 
-                    auth=(NEO4J_USER, NEO4J_PASSWORD)
-                )
-                # Verify connection
-                self.driver.verify_connectivity()
-                print("DEBUG - Successfully connected to Neo4j database")
+                driver = AsyncGraphDatabase.driver(NEO4J_URI, **self.driver_options())
+                await driver.verify_connectivity()
+                previous, self.async_driver = self.async_driver, driver
+                if previous:
+                    await previous.close()
+                logger.debug("Successfully connected to Neo4j database (async)")
                 return True
             except Exception as e:
-                print(f"DEBUG - Neo4j connection error (attempt {attempt+1}/{max_retries}): {e}")
+                logger.warning("Neo4j async connection error (attempt %s/%s): %s", attempt + 1, max_retries, e)
+                if driver:
+                    await driver.close()
                 if attempt < max_retries - 1:
-                    time.sleep(retry_delay * (2 ** attempt))  # Exponential backoff
+                    await asyncio.sleep(retry_delay * (2 ** attempt))  # Exponential backoff
                 else:
-                    print("DEBUG - Failed to connect to Neo4j after all retries")
+                    logger.warning("Failed to connect to Neo4j (async) after all retries")
                     return False
     
-    def close(self):
-        """Close the Neo4j connection"""
-        if self.driver:
-            self.driver.close()
-            self.driver = None
+    async def close_async(self):
+        """Close the async Neo4j connection"""
+        if self.async_driver:
+            await self.async_driver.close()
+            self.async_driver = None
+    
+    def stream_read(self, query, params=None, fetch_size=None, max_retries=3, retry_delay=1):
+        """
+        Run a read query and yield each row as a plain tuple in RETURN order.
+        
+        Rows are pulled from the server fetch_size at a time (default: settings.NEO4J_FETCH_SIZE),
+        so a large result never sits in memory as a list of Records. Like the driver's managed
+        transactions, transient failures are retried, but only until the first row was yielded.
+        The time until the stream is exhausted and its row count are recorded in metrics.
+        """
+        return observe_stream(self._stream_read(query, params, fetch_size, max_retries, retry_delay), "neo4j", "read")
+    
+    def _stream_read(self, query, params, fetch_size, max_retries, retry_delay):
+        if not self.driver:
+            if not self.connect():
+                return
+        
+        for attempt in range(max_retries):
+            yielded = False
+            try:
+                with self.driver.session(
+                    default_access_mode=READ_ACCESS,
+                    fetch_size=fetch_size or settings.NEO4J_FETCH_SIZE
+                ) as session:
+                    with session.begin_transaction() as tx:
+                        for record in tx.run(query, params):
+                            yielded = True
+                            yield tuple(record.values())
+                return
+            except Exception as e:
+                logger.warning("Neo4j read error (attempt %s/%s): %s", attempt + 1, max_retries, e)
+                if yielded or not self.is_retryable(e) or attempt == max_retries - 1:
+                    raise
+                time.sleep(retry_delay * (2 ** attempt))  # Exponential backoff
+                if isinstance(e, ServiceUnavailable):
+                    # The whole server went away; replace the driver instead of reusing dead routing info
+                    self.connect()
+    
+    @staticmethod
+    def is_retryable(error):
+        return isinstance(error, (ServiceUnavailable, SessionExpired, TransientError))
     
     def execute_query(self, query, params=None, max_retries=3, retry_delay=1):
-        """Execute a Cypher query with retry logic"""
+        """Execute a write query in a managed write transaction with retry logic; reads go through stream_read"""
         if not self.driver:
             if not self.connect():
                 return None
         
+        def work(tx):
+            return [tuple(record.values()) for record in tx.run(query, params)]
+        
         for attempt in range(max_retries):
             try:
+                start = time.perf_counter()
                 with self.driver.session() as session:
-                    result = session.run(query, params)
-                    return [record for record in result]
+                    rows = session.execute_write(work)
+                record_retrieval("neo4j", "write", time.perf_counter() - start, len(rows))
+                return rows
             except Exception as e:
-                print(f"DEBUG - Neo4j query error (attempt {attempt+1}/{max_retries}): {e}")
+                logger.warning("Neo4j query error (attempt %s/%s): %s", attempt + 1, max_retries, e)
                 if attempt < max_retries - 1:
                     time.sleep(retry_delay * (2 ** attempt))  # Exponential backoff
-                    # Try to reconnect
-                    self.connect()
+                    if isinstance(e, ServiceUnavailable):
+                        self.connect()
                 else:
-                    print("DEBUG - Failed to execute Neo4j query after all retries")
+                    logger.warning("Failed to execute Neo4j query after all retries")
+                    RETRIEVAL_ERRORS.inc(backend="neo4j", operation="write")
                     return None
 
+    async def execute_read_async(self, query, params=None, max_retries=3, retry_delay=1):
+        """Run a read query on the async driver in a managed read transaction; returns a list of tuples"""
+        if not self.async_driver:
+            if not await self.connect_async():
+                return None
+        
+        async def work(tx):
+            result = await tx.run(query, params)
+            return [tuple(record.values()) async for record in result]
+        
+        for attempt in range(max_retries):
+            try:
+                start = time.perf_counter()
+                async with self.async_driver.session(
+                    default_access_mode=READ_ACCESS,
+                    fetch_size=settings.NEO4J_FETCH_SIZE
+                ) as session:
+                    rows = await session.execute_read(work)
+                record_retrieval("neo4j", "read", time.perf_counter() - start, len(rows))
+                return rows
+            except Exception as e:
+                logger.warning("Neo4j async query error (attempt %s/%s): %s", attempt + 1, max_retries, e)
+                if attempt < max_retries - 1:
+                    await asyncio.sleep(retry_delay * (2 ** attempt))  # Exponential backoff
+                    if isinstance(e, ServiceUnavailable):
+                        await self.connect_async()
+                else:
+                    logger.warning("Failed to execute Neo4j async query after all retries")
+                    RETRIEVAL_ERRORS.inc(backend="neo4j", operation="read")
+                    return None
+
+retrieval_cache = RetrievalCache("neo4j", settings.RETRIEVAL_CACHE_SIZE, settings.RETRIEVAL_CACHE_TTL)
+
+@retrieval_cache.cached
 def document_retrieval(dataset_ids, query, similarity_threshold=0.2, vector_similarity_weight=0.3, top_k=1024, max_retries=3, retry_delay=1):
     """
     Retrieve relevant chunks from Neo4j database based on a query.
@@ -77,7 +220,7 @@ def document_retrieval(dataset_ids, query, similarity_threshold=0.2, vector_simi
     - vector_similarity_weight: Weight parameter (not used in Neo4j implementation)
     - top_k: Maximum number of results to return (default: 1024)
     """
-    print("\nDEBUG - Starting document_retrieval function with Neo4j")
+    logger.debug("Starting document_retrieval function with Neo4j")
     
     # Handle single dataset_id as string
     if isinstance(dataset_ids, str):
@@ -85,14 +228,74 @@ def document_retrieval(dataset_ids, query, similarity_threshold=0.2, vector_simi
     
     # Handle empty dataset_ids
     if not dataset_ids:
-        print("Warning: No dataset_ids provided for retrieval")
+        logger.warning("No dataset_ids provided for retrieval")
         return []
     
-    print(f"DEBUG - Retrieving with dataset_ids: {dataset_ids}")
+    logger.debug("Retrieving from %s policies", len(dataset_ids))
     
     # Connect to Neo4j
     neo4j_conn = Neo4jConnection()
     
+    cypher_query, params = build_clause_search(dataset_ids, query, similarity_threshold, top_k)
+    
+    try:
+        # Stream rows straight into chunks instead of materializing the Records first
+        processed_chunks = format_clause_records(neo4j_conn.stream_read(cypher_query, params, max_retries=max_retries, retry_delay=retry_delay))
+        
+        if not processed_chunks:
+            logger.debug("No results found")
+            return []
+        
+        logger.debug("Processed %s chunks from Neo4j", len(processed_chunks))
+        return processed_chunks
+        
+    except Exception as e:
+        logger.warning("Exception in Neo4j document_retrieval: %s", e)
+        return []
+
+@retrieval_cache.cached
+async def document_retrieval_async(dataset_ids, query, similarity_threshold=0.2, vector_similarity_weight=0.3, top_k=1024, max_retries=3, retry_delay=1):
+    """Async variant of document_retrieval using the neo4j async driver; same parameters and result shape"""
+    logger.debug("Starting document_retrieval_async function with Neo4j")
+    
+    # Handle single dataset_id as string
+    if isinstance(dataset_ids, str):
+        dataset_ids = [dataset_ids]
+    
+    # Handle empty dataset_ids
+    if not dataset_ids:
+        logger.warning("No dataset_ids provided for retrieval")
+        return []
+    
+    cypher_query, params = build_clause_search(dataset_ids, query, similarity_threshold, top_k)
+    
+    try:
+        results = await Neo4jConnection().execute_read_async(cypher_query, params, max_retries, retry_delay)
+        
+        if not results:
+            logger.warning("No results found or query failed")
+            return []
+        
+        processed_chunks = format_clause_records(results)
+        logger.debug("Processed %s chunks from Neo4j", len(processed_chunks))
+        return processed_chunks
+        
+    except Exception as e:
+        logger.warning("Exception in Neo4j document_retrieval_async: %s", e)
+        return []
+
+# Lucene query syntax characters, escaped in every full-text query
+_LUCENE_SPECIAL = re.compile(r'[+\-!(){}\[\]^"~*?:\\/&|]')
+# Upper-case boolean operators; the analyzer lower-cases terms anyway, so lower-casing them keeps the words
+_LUCENE_OPERATORS = re.compile(r"\b(?:AND|OR|NOT)\b")
+
+def escape_lucene(text):
+    """Escape Lucene query syntax so a sub-query built from an answer ("$1M - $5M", "Cyberattacks/Data Breaches", "R AND D") is searched as plain text"""
+    text = _LUCENE_OPERATORS.sub(lambda match: match.group(0).lower(), text)
+    return _LUCENE_SPECIAL.sub(r"\\\g<0>", text)
+
+def build_clause_search(dataset_ids, query, similarity_threshold, top_k):
+    """Return the full-text clause search Cypher query and its parameters"""
     # Prepare Cypher query for text search
     # This query searches for Clause nodes that contain text similar to the query
     # and are connected to policies specified in dataset_ids
@@ -129,45 +332,193 @@ def document_retrieval(dataset_ids, query, similarity_threshold=0.2, vector_simi
         
     # Prepare parameters
     params = {
-        "query_text": query,
+        "query_text": escape_lucene(query),
         "threshold": similarity_threshold,
         "policy_ids": dataset_ids,
         "limit": top_k
     }
+    return cypher_query, params
+
+def document_retrieval_multi(dataset_ids, queries, similarity_threshold=0.2, vector_similarity_weight=0.3, top_k=1024, max_retries=3, retry_delay=1):
+    """
+    Retrieve for several sub-queries in one round trip and fuse them by reciprocal rank.
+    
+    The sub-queries are UNWOUND into per-query full-text searches and fused in Cypher, so only
+    the fused clauses cross the wire. Same parameters as document_retrieval, with queries a list
+    of sub-queries; top_k limits each sub-query and the fused result. Chunks carry the fused
+    "score" and the "matched_queries" indexes.
+    """
+    logger.debug("Starting document_retrieval_multi function with Neo4j, %s sub-queries", len(queries))
     
+    if isinstance(dataset_ids, str):
+        dataset_ids = [dataset_ids]
+    if not dataset_ids or not queries:
+        logger.warning("No dataset_ids or queries provided for retrieval")
+        return []
+    
+    cypher_query, params = build_multi_clause_search(dataset_ids, queries, similarity_threshold, top_k)
     try:
-        # Execute query
-        results = neo4j_conn.execute_query(cypher_query, params)
-        
-        if not results:
-            print("DEBUG - No results found or query failed")
-            return []
-        
-        # Process and format the chunks
-        processed_chunks = []
-        for record in results:
-            processed_chunk = {
-                "content": record["content"],
-                "source": record["source"],
-                "score": record["score"],
-                "highlighted_content": record["highlight"]
-            }
-            processed_chunks.append(processed_chunk)
-        
-        print(f"DEBUG - Processed {len(processed_chunks)} chunks from Neo4j")
+        processed_chunks = format_fused_records(Neo4jConnection().stream_read(cypher_query, params, max_retries=max_retries, retry_delay=retry_delay))
+        logger.debug("Fused %s chunks from %s sub-queries", len(processed_chunks), len(queries))
         return processed_chunks
-        
     except Exception as e:
-        print(f"DEBUG - Exception in Neo4j document_retrieval: {e}")
+        logger.warning("Exception in Neo4j document_retrieval_multi: %s", e)
+        return []
+
+async def document_retrieval_multi_async(dataset_ids, queries, similarity_threshold=0.2, vector_similarity_weight=0.3, top_k=1024, max_retries=3, retry_delay=1):
+    """Async variant of document_retrieval_multi using the neo4j async driver"""
+    if isinstance(dataset_ids, str):
+        dataset_ids = [dataset_ids]
+    if not dataset_ids or not queries:
+        logger.warning("No dataset_ids or queries provided for retrieval")
+        return []
+    
+    cypher_query, params = build_multi_clause_search(dataset_ids, queries, similarity_threshold, top_k)
+    try:
+        rows = await Neo4jConnection().execute_read_async(cypher_query, params, max_retries, retry_delay)
+        return format_fused_records(rows or [])
+    except Exception as e:
+        logger.warning("Exception in Neo4j document_retrieval_multi_async: %s", e)
         return []
 
+def build_multi_clause_search(dataset_ids, queries, similarity_threshold, top_k):
+    """Return the UNWIND multi-query search Cypher query, fused by reciprocal rank, and its parameters"""
+    # Each sub-query keeps its own best $limit clauses; a clause then scores the sum of
+    # 1 / ($rrf_k + rank + 1) over the sub-queries that returned it
+    policy_filter = "" if dataset_ids[0] == "all" else "WHERE p.policyId IN $policy_ids"
+    cypher_query = f"""
+    UNWIND range(0, size($queries) - 1) AS qi
+    CALL {{
+        WITH qi
+        CALL db.index.fulltext.queryNodes('clause_text_idx', $queries[qi]) 
+        YIELD node, score
+        WHERE score >= $threshold
+        MATCH (p:Policy)-[:CONTAINS_CLAUSE]->(node)
+        {policy_filter}
+        WITH node, p, score
+        ORDER BY score DESC
+        LIMIT $limit
+        RETURN collect({{node: node, policy: p}}) AS hits
+    }}
+    UNWIND range(0, size(hits) - 1) AS rank
+    WITH hits[rank].node AS node, hits[rank].policy AS p, qi, 1.0 / ($rrf_k + rank + 1) AS rrf
+    WITH node, p, sum(rrf) AS rrf_score, collect(qi) AS matched
+    RETURN 
+        node.text AS content,
+        p.insurer + ' - ' + p.policyName AS source,
+        rrf_score AS score,
+        node.text AS highlight,
+        matched
+    ORDER BY rrf_score DESC
+    LIMIT $limit
+    """
+    params = {
+        "queries": [escape_lucene(query) for query in queries],
+        "threshold": similarity_threshold,
+        "policy_ids": dataset_ids,
+        "limit": top_k,
+        "rrf_k": settings.RRF_K
+    }
+    return cypher_query, params
+
+def document_match_stats(dataset_ids, query, similarity_threshold=0.2, vector_similarity_weight=0.3, max_retries=3, retry_delay=1):
+    """
+    Count the clauses matching a query and their score histogram per policy, without fetching them.
+
+    The aggregation runs in Cypher, so one row per policy crosses the wire instead of every
+    clause text. Same filtering as document_retrieval; see match_stats.py for the result shape.
+    """
+    if isinstance(dataset_ids, str):
+        dataset_ids = [dataset_ids]
+    if not dataset_ids:
+        logger.warning("No dataset_ids provided for match stats")
+        return empty_match_stats()
+    
+    cypher_query, params = build_match_stats_query(dataset_ids, query, similarity_threshold)
+    try:
+        stats = stats_from_rows(Neo4jConnection().stream_read(cypher_query, params, max_retries=max_retries, retry_delay=retry_delay))
+        logger.debug("%s clauses match in %s policies", stats['total'], len(stats['policies']))
+        return stats
+    except Exception as e:
+        logger.warning("Exception in Neo4j document_match_stats: %s", e)
+        return empty_match_stats()
+
+async def document_match_stats_async(dataset_ids, query, similarity_threshold=0.2, vector_similarity_weight=0.3, max_retries=3, retry_delay=1):
+    """Async variant of document_match_stats using the neo4j async driver"""
+    if isinstance(dataset_ids, str):
+        dataset_ids = [dataset_ids]
+    if not dataset_ids:
+        logger.warning("No dataset_ids provided for match stats")
+        return empty_match_stats()
+    
+    cypher_query, params = build_match_stats_query(dataset_ids, query, similarity_threshold)
+    try:
+        rows = await Neo4jConnection().execute_read_async(cypher_query, params, max_retries, retry_delay)
+        return stats_from_rows(rows or [])
+    except Exception as e:
+        logger.warning("Exception in Neo4j document_match_stats_async: %s", e)
+        return empty_match_stats()
+
+def build_match_stats_query(dataset_ids, query, similarity_threshold):
+    """Return the per-policy match count / score histogram Cypher query and its parameters"""
+    # histogram[0] counts scores below the first edge, the last entry scores of at least the last edge
+    policy_filter = "" if dataset_ids[0] == "all" else "WHERE p.policyId IN $policy_ids"
+    cypher_query = f"""
+    CALL db.index.fulltext.queryNodes('clause_text_idx', $query_text) 
+    YIELD node, score
+    WHERE score >= $threshold
+    MATCH (p:Policy)-[:CONTAINS_CLAUSE]->(node)
+    {policy_filter}
+    WITH p.insurer + ' - ' + p.policyName AS source, count(*) AS matches, max(score) AS max_score, collect(score) AS scores
+    RETURN 
+        source,
+        matches,
+        max_score,
+        [i IN range(0, size($bins)) |
+            size([s IN scores WHERE (i = 0 OR s >= $bins[i - 1]) AND (i = size($bins) OR s < $bins[i])])] AS histogram
+    """
+    params = {
+        "query_text": escape_lucene(query),
+        "threshold": similarity_threshold,
+        "policy_ids": dataset_ids,
+        "bins": list(SCORE_BINS)
+    }
+    return cypher_query, params
+
+def format_clause_records(rows):
+    """Process and format (content, source, score, highlight) rows into chunks"""
+    processed_chunks = []
+    for content, source, score, highlight in rows:
+        processed_chunk = {
+            "content": content,
+            "source": source,
+            "score": score,
+            "highlighted_content": highlight
+        }
+        processed_chunks.append(processed_chunk)
+    return processed_chunks
+
+def format_fused_records(rows):
+    """Process and format (content, source, score, highlight, matched) rows of a multi-query search into chunks"""
+    processed_chunks = []
+    for content, source, score, highlight, matched in rows:
+        processed_chunks.append({
+            "content": content,
+            "source": source,
+            "score": score,
+            "rrf_score": score,
+            "matched_queries": list(matched),
+            "highlighted_content": highlight
+        })
+    return processed_chunks
+
 def get_datasets(name=None, max_retries=3, retry_delay=1):
     """
     Get all policies from Neo4j database or filter by name
     
     Returns a list of dictionaries with policy information
     """
-    print(f"DEBUG - Getting datasets from Neo4j")
+    logger.debug("Getting datasets from Neo4j")
     
     # Connect to Neo4j
     neo4j_conn = Neo4jConnection()
@@ -176,39 +527,63 @@ def get_datasets(name=None, max_retries=3, retry_delay=1):
     cypher_query = """
     MATCH (p:Policy)
     WHERE $name IS NULL OR p.policyName CONTAINS $name
-    RETURN p.policyId AS id, p.policyName AS name, p.insurer AS insurer
+    RETURN p.policyId AS id, p.policyName AS name, p.insurer AS insurer, p.jurisdiction AS jurisdiction
     """
     
     params = {"name": name}
     
     try:
-        # Execute query
-        results = neo4j_conn.execute_query(cypher_query, params)
-        
-        if not results:
-            print("DEBUG - No policies found or query failed")
-            return []
-        
-        # Format results to match expected structure
+        # Format rows to match expected structure as they stream in
         datasets = []
-        for record in results:
+        for policy_id, policy_name, insurer, jurisdiction in neo4j_conn.stream_read(cypher_query, params, max_retries=max_retries, retry_delay=retry_delay):
             dataset = {
-                "id": record["id"],
-                "name": record["name"],
-                "insurer": record["insurer"]
+                "id": policy_id,
+                "name": policy_name,
+                "insurer": insurer,
+                "jurisdiction": jurisdiction
             }
             datasets.append(dataset)
         
-        print(f"DEBUG - Found {len(datasets)} policies in Neo4j")
+        if not datasets:
+            logger.debug("No policies found")
+            return []
+        
+        logger.debug("Found %s policies in Neo4j", len(datasets))
         if datasets:
-            print(f"DEBUG - First policy sample: {datasets[0]}")
+            logger.debug("First policy sample: %s", datasets[0])
         
         return datasets
         
     except Exception as e:
-        print(f"DEBUG - Exception in Neo4j get_datasets: {e}")
+        logger.warning("Exception in Neo4j get_datasets: %s", e)
         return []
 
+# Policies change only when the graph is reloaded, so retrieval reads them from memory
+policy_catalog = PolicyCatalog(get_datasets, settings.POLICY_CATALOG_REFRESH)
+
+# Version stamp of the loaded graph, rewritten by every graph_loader.py run
+GRAPH_VERSION_QUERY = "MATCH (m:Meta {key: 'graph'}) RETURN m.version"
+
+def read_graph_version():
+    rows = list(Neo4jConnection().stream_read(GRAPH_VERSION_QUERY, max_retries=1))
+    return rows[0][0] if rows else None
+
+def write_graph_version(connection):
+    """Stamp the graph with a new version so running apps drop what they cached from the old one"""
+    version = uuid.uuid4().hex
+    connection.execute_query(
+        "MERGE (m:Meta {key: 'graph'}) SET m.version = $version, m.loadedAt = datetime()",
+        {"version": version}
+    )
+    return version
+
+def on_graph_change():
+    # Retrieval results and the policy list cached in this process describe the old graph
+    invalidate_all()
+    policy_catalog.invalidate()
+
+graph_version = GraphVersionWatcher(read_graph_version, on_graph_change, settings.GRAPH_VERSION_CHECK_INTERVAL)
+
 def search_documents_with_context(query, context=None, dataset_ids=None):
     """
     Search documents with context enhancement
@@ -228,8 +603,7 @@ def search_documents_with_context(query, context=None, dataset_ids=None):
     
     # Get all datasets if none specified
     if not dataset_ids:
-        datasets = get_datasets()
-        dataset_ids = [d.get("id") for d in datasets if d.get("id")]
+        dataset_ids = policy_catalog.dataset_ids()
     
     # Retrieve documents
     chunks = document_retrieval(dataset_ids, enhanced_query)